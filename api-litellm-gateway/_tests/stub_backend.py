@@ -0,0 +1,55 @@
+"""
+Backend OpenAI-compatible mínimo para probar el enrutado local del gateway sin GPU.
+
+Responde con el nombre de la réplica, así se ve a dónde envió el gateway cada petición:
+
+    python _tests/stub_backend.py --port 8101 --name r1
+    python _tests/stub_backend.py --port 8102 --name r2
+    LOCAL_BACKENDS=http://localhost:8101/v1,http://localhost:8102/v1 python start_server.py
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+def build_app(name: str, delay_s: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        await asyncio.sleep(delay_s)
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body.get("model")}
+        text = f"respuesta de {name}"
+        if not body.get("stream"):
+            return {
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 3, "total_tokens": 4},
+            }
+
+        async def events():
+            for word in text.split():
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": word + " "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(0.01)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend OpenAI-compatible de prueba")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--name", default="r1")
+    parser.add_argument("--delay", type=float, default=0.05, help="Latencia simulada por petición (s)")
+    args = parser.parse_args()
+    uvicorn.run(build_app(args.name, args.delay), host="0.0.0.0", port=args.port)
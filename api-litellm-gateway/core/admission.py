@@ -0,0 +1,263 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException
+
+from core.metrics import ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de la cola de admisión (menor = antes)
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class Limits(NamedTuple):
+    """Límites de una clave o de un modelo; 0 = sin límite."""
+    max_concurrency: int = 0
+    rpm: float = 0.0
+    burst: int = 0
+
+
+class ApiKey(NamedTuple):
+    """Entrada de la tabla de claves: nombre legible, límites y prioridad por defecto."""
+    name: str
+    limits: Limits
+    priority: str = "interactive"
+
+
+def _limits(data: Dict[str, Any], default: Limits) -> Limits:
+    return Limits(
+        max_concurrency = int(data.get("max_concurrency", default.max_concurrency)),
+        rpm             = float(data.get("rpm", default.rpm)),
+        burst           = int(data.get("burst", default.burst)),
+    )
+
+
+def load_admission_config(
+    path: Optional[str], legacy_key: Optional[str], key_default: Limits, model_default: Limits
+) -> Tuple[Dict[str, ApiKey], Dict[str, Limits]]:
+    """
+    Tabla de claves y límites por modelo desde un JSON:
+
+        {"keys":   {"sk-...": {"name": "agentes", "max_concurrency": 4, "rpm": 60, "burst": 10, "priority": "batch"}},
+         "models": {"xai.grok-4": {"max_concurrency": 16, "rpm": 300}}}
+
+    `API_KEY` (clave única heredada) se sigue aceptando con los límites por defecto.
+    """
+    keys: Dict[str, ApiKey] = {}
+    models: Dict[str, Limits] = {}
+    if path:
+        with open(os.path.expanduser(path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for secret, entry in (data.get("keys") or {}).items():
+            priority = entry.get("priority", "interactive")
+            if priority not in PRIORITIES:
+                raise ValueError(f"Prioridad inválida para la clave '{entry.get('name', '?')}': {priority}")
+            keys[secret] = ApiKey(entry.get("name") or secret[-6:], _limits(entry, key_default), priority)
+        for model, entry in (data.get("models") or {}).items():
+            models[model] = _limits(entry, model_default)
+    if legacy_key and legacy_key not in keys:
+        keys[legacy_key] = ApiKey("default", key_default)
+    if not keys:
+        raise ValueError("No hay claves configuradas: defina API_KEY o ADMISSION_CONFIG_FILE")
+    return keys, models
+
+
+def too_many(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class TokenBucket:
+    """Token bucket clásico: `rpm` por minuto con ráfagas de hasta `burst` peticiones."""
+
+    def __init__(self, rpm: float, burst: int):
+        self.rate = rpm / 60.0
+        self.capacity = float(max(1, burst or math.ceil(rpm / 60.0) or 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Consume un token; devuelve 0 si se pudo o los segundos hasta que haya uno."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class PrioritySemaphore:
+    """
+    Semáforo con cola de espera por prioridad (y FIFO dentro de cada prioridad).
+
+    Mantiene una media móvil del tiempo de ocupación para estimar el `Retry-After` cuando una
+    espera caduca o la cola está llena.
+    """
+
+    def __init__(self, limit: int, max_waiters: int):
+        self.limit = limit
+        self.max_waiters = max_waiters
+        self.active = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._hold_ewma = 1.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, f in self._waiters if not f.done())
+
+    def retry_after(self) -> float:
+        return self._hold_ewma * (self.waiting + 1) / self.limit
+
+    async def acquire(self, priority: int, timeout: float) -> bool:
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            return True
+        if self.waiting >= self.max_waiters:
+            return False
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                return True  # se concedió justo al caducar
+            fut.cancel()
+            return False
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(0.0)  # concedido pero el cliente ya no lo quiere
+            else:
+                fut.cancel()
+            raise
+
+    def release(self, held_s: float) -> None:
+        if held_s > 0:
+            self._hold_ewma = 0.8 * self._hold_ewma + 0.2 * held_s
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)  # el permiso pasa directamente al siguiente en la cola
+                return
+        self.active = max(0, self.active - 1)
+
+
+class Ticket:
+    """Permisos concedidos a una petición; `release()` es idempotente."""
+
+    def __init__(self, sems: List[PrioritySemaphore]):
+        self._sems = sems
+        self._t0 = time.monotonic()
+        self._released = False
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        held = time.monotonic() - self._t0
+        for sem in reversed(self._sems):
+            sem.release(held)
+
+
+class AdmissionController:
+    """
+    Control de admisión por clave y por modelo.
+
+    1. Token bucket de la clave y del modelo: si no hay token, 429 inmediato con `Retry-After`.
+    2. Concurrencia: la petición espera en la cola con prioridad (interactive antes que batch)
+       de la clave y luego en la del modelo, como mucho `max_wait_s` en total; si caduca o la cola
+       está llena, 429 con el `Retry-After` estimado.
+    """
+
+    def __init__(self, keys: Dict[str, ApiKey], models: Dict[str, Limits], model_default: Limits,
+                 max_wait_s: float, max_queue: int):
+        self.keys = keys
+        self.models = models
+        self.model_default = model_default
+        self.max_wait_s = max_wait_s
+        self.max_queue = max_queue
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._sems: Dict[str, PrioritySemaphore] = {}
+        self.rejected: Dict[str, int] = {"rate": 0, "queue_full": 0, "timeout": 0}
+
+    def _reject(self, reason: str) -> None:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(reason).inc()
+
+    def lookup(self, secret: str) -> Optional[ApiKey]:
+        return self.keys.get(secret)
+
+    def _bucket(self, scope: str, limits: Limits) -> Optional[TokenBucket]:
+        if limits.rpm <= 0:
+            return None
+        if scope not in self._buckets:
+            self._buckets[scope] = TokenBucket(limits.rpm, limits.burst)
+        return self._buckets[scope]
+
+    def _sem(self, scope: str, limits: Limits) -> Optional[PrioritySemaphore]:
+        if limits.max_concurrency <= 0:
+            return None
+        if scope not in self._sems:
+            self._sems[scope] = PrioritySemaphore(limits.max_concurrency, self.max_queue)
+        return self._sems[scope]
+
+    async def admit(self, key: ApiKey, model: str, priority: Optional[str] = None) -> Ticket:
+        if priority and priority not in PRIORITIES:
+            raise HTTPException(status_code=400, detail=f"Prioridad inválida: {priority} (use interactive o batch)")
+        level = PRIORITIES[priority or key.priority]
+        model_limits = self.models.get(model, self.model_default)
+        scopes = [(f"key:{key.name}", key.limits), (f"model:{model}", model_limits)]
+
+        taken: List[TokenBucket] = []
+        for scope, limits in scopes:
+            bucket = self._bucket(scope, limits)
+            if bucket is None:
+                continue
+            wait = bucket.take()
+            if wait > 0:
+                for b in taken:
+                    b.refund()  # no cobrar a la clave una petición que el modelo rechaza
+                self._reject("rate")
+                raise too_many(f"Límite de peticiones por minuto alcanzado ({scope})", wait)
+            taken.append(bucket)
+
+        deadline = time.monotonic() + self.max_wait_s
+        held: List[PrioritySemaphore] = []
+        try:
+            for scope, limits in scopes:
+                sem = self._sem(scope, limits)
+                if sem is None:
+                    continue
+                if sem.waiting >= sem.max_waiters:
+                    self._reject("queue_full")
+                    raise too_many(f"Cola de espera llena ({scope})", sem.retry_after())
+                if not await sem.acquire(level, max(0.0, deadline - time.monotonic())):
+                    self._reject("timeout")
+                    raise too_many(f"Tiempo de espera agotado en la cola ({scope})", sem.retry_after())
+                held.append(sem)
+        except BaseException:
+            for sem in reversed(held):
+                sem.release(0.0)
+            raise
+        return Ticket(held)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "rejected": dict(self.rejected),
+            "scopes": {
+                scope: {"active": sem.active, "limit": sem.limit, "waiting": sem.waiting}
+                for scope, sem in sorted(self._sems.items())
+            },
+        }
@@ -0,0 +1,406 @@
+import asyncio
+import json
+import logging
+import random
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Códigos que se reintentan: límites (propios o del proveedor), timeouts y fallos transitorios
+TRANSIENT_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# Orden de entrega de resultados
+ORDERS = ("input", "completed")
+
+_BATCH_ID_RE = re.compile(r"batch_[0-9a-f]{32}")
+
+# runner(cuerpo de la petición, nombre de la clave, perfil OCI) -> respuesta JSON
+Runner = Callable[[Dict[str, Any], str, Optional[str]], Awaitable[Any]]
+
+
+def parse_line(line: str, index: int) -> Dict[str, Any]:
+    """
+    Línea del JSONL de entrada: formato de la Batch API de OpenAI
+    (`{"custom_id", "method", "url", "body"}`) o directamente el cuerpo de la petición de chat.
+    """
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        raise ValueError(f"Línea {index + 1}: JSON inválido ({e})")
+    if not isinstance(item, dict):
+        raise ValueError(f"Línea {index + 1}: se esperaba un objeto JSON")
+    body = item.get("body", item)
+    if not isinstance(body, dict) or "messages" not in body or "model" not in body:
+        raise ValueError(f"Línea {index + 1}: falta 'model' o 'messages'")
+    if item.get("url") not in (None, "/v1/chat/completions"):
+        raise ValueError(f"Línea {index + 1}: url no soportada: {item.get('url')}")
+    return {"custom_id": item.get("custom_id") or f"request-{index + 1}", "body": body}
+
+
+def _error_status(exc: BaseException) -> Tuple[int, Optional[float]]:
+    """Código HTTP y Retry-After (si lo hay) de una excepción del gateway o de LiteLLM."""
+    if isinstance(exc, HTTPException):
+        retry_after = (exc.headers or {}).get("Retry-After")
+        return exc.status_code, float(retry_after) if retry_after else None
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return 504, None
+    code = getattr(exc, "status_code", None)
+    return (code if isinstance(code, int) else 500), None
+
+
+class Batch:
+    """Estado de un lote; se persiste en `<root>/<id>/batch.json` y sus resultados en `results.jsonl`."""
+
+    def __init__(self, batch_id: str, owner: str, total: int, concurrency: int, profile: Optional[str]):
+        self.id = batch_id
+        self.owner = owner  # nombre de la clave que lo creó
+        self.total = total
+        self.concurrency = concurrency
+        self.profile = profile
+        self.status = "queued"  # queued | in_progress | completed | cancelling | cancelled | failed
+        self.error: Optional[str] = None
+        self.completed = 0
+        self.failed = 0
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # índice de entrada -> (offset, longitud) de su línea en results.jsonl; `arrival` en orden de llegada
+        self.offsets: Dict[int, Tuple[int, int]] = {}
+        self.arrival: List[Tuple[int, int]] = []
+        self.results_size = 0
+        self.changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "cancelled", "failed")
+
+    def notify(self) -> None:
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "object": "batch",
+            "owner": self.owner,
+            "status": self.status,
+            "error": self.error,
+            "concurrency": self.concurrency,
+            "profile": self.profile,
+            "request_counts": {"total": self.total, "completed": self.completed, "failed": self.failed},
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Batch":
+        batch = cls(data["id"], data["owner"], int(data["request_counts"]["total"]), int(data["concurrency"]), data.get("profile"))
+        batch.status = data.get("status", "failed")
+        batch.error = data.get("error")
+        batch.created_at = float(data.get("created_at", time.time()))
+        batch.finished_at = data.get("finished_at")
+        return batch
+
+
+class BatchManager:
+    """
+    Lotes JSONL de peticiones de chat ejecutados en segundo plano.
+
+    Cada lote corre con `concurrency` workers (≤ `max_concurrency`) que llaman a `runner`, el mismo
+    camino que /v1/chat/completions con prioridad `batch`, así que el ritmo lo marca la cuota
+    del proveedor y el control de admisión, no los round trips del cliente. Los errores transitorios
+    (429, 5xx, timeouts) se reintentan con backoff exponencial respetando `Retry-After`.
+
+    Cada resultado se añade a `results.jsonl` en cuanto termina. Tras un reinicio, los lotes
+    pendientes continúan con las peticiones que faltan; los clientes reanudan la descarga con `offset`.
+    """
+
+    def __init__(self, root: Path, runner: Runner, max_concurrency: int, max_running: int,
+                 max_retries: int, ttl_s: float, max_lines: int):
+        self.root = root
+        self.max_lines = max_lines
+        self.runner = runner
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.ttl_s = ttl_s
+        self._sem = asyncio.Semaphore(max_running)
+        self._batches: Dict[str, Batch] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        root.mkdir(parents=True, exist_ok=True)
+
+    def batch_dir(self, batch_id: str) -> Path:
+        return self.root / batch_id
+
+    # ---------- creación / consulta ----------
+    async def create(self, owner: str, lines: List[str], concurrency: Optional[int], profile: Optional[str]) -> Batch:
+        """Valida el JSONL completo (400 con el número de línea) y lo encola."""
+        lines = [line for line in lines if line.strip()]
+        if len(lines) > self.max_lines:
+            raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {self.max_lines} peticiones")
+        try:
+            items = await asyncio.to_thread(lambda: [parse_line(line, i) for i, line in enumerate(lines)])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not items:
+            raise HTTPException(status_code=400, detail="El archivo JSONL no contiene peticiones")
+        batch = Batch(f"batch_{uuid.uuid4().hex}", owner, len(items), min(concurrency or self.max_concurrency, self.max_concurrency), profile)
+        await asyncio.to_thread(self._write_input, batch, items)
+        self._batches[batch.id] = batch
+        self._spawn(batch)
+        return batch
+
+    def _write_input(self, batch: Batch, items: List[Dict[str, Any]]) -> None:
+        d = self.batch_dir(batch.id)
+        d.mkdir(parents=True)
+        with open(d / "input.jsonl", "w", encoding="utf-8") as f:
+            for item in items:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        (d / "results.jsonl").touch()
+        self._persist(batch)
+
+    def get(self, batch_id: str, owner: str) -> Batch:
+        batch = self._batches.get(batch_id)
+        if batch is None or batch.owner != owner:
+            raise HTTPException(status_code=404, detail="Lote no encontrado")
+        return batch
+
+    def list(self, owner: str) -> List[Batch]:
+        return sorted((b for b in self._batches.values() if b.owner == owner), key=lambda b: b.created_at, reverse=True)
+
+    def cancel(self, batch: Batch) -> Batch:
+        task = self._tasks.get(batch.id)
+        if task is not None and not batch.finished:
+            batch.status = "cancelling"
+            task.cancel()
+        return batch
+
+    # ---------- ejecución ----------
+    def _spawn(self, batch: Batch) -> None:
+        task = asyncio.create_task(self._run(batch))
+        self._tasks[batch.id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(batch.id, None))
+
+    def _pending(self, batch: Batch) -> List[Tuple[int, Dict[str, Any]]]:
+        done = set(batch.offsets)
+        with open(self.batch_dir(batch.id) / "input.jsonl", "r", encoding="utf-8") as f:
+            return [(i, json.loads(line)) for i, line in enumerate(f) if i not in done]
+
+    async def _run(self, batch: Batch) -> None:
+        try:
+            async with self._sem:
+                batch.status = "in_progress"
+                await asyncio.to_thread(self._persist, batch)
+                await self._run_workers(batch)
+            batch.status = "completed"
+        except asyncio.CancelledError:
+            if batch.status != "cancelling":
+                # Parada del servicio: el lote queda pendiente y se reanuda al arrancar
+                await asyncio.shield(asyncio.to_thread(self._persist, batch))
+                raise
+            batch.status = "cancelled"
+        except Exception as e:
+            logger.exception("Lote %s falló", batch.id)
+            batch.status, batch.error = "failed", str(e) or e.__class__.__name__
+        batch.finished_at = time.time()
+        await asyncio.to_thread(self._persist, batch)
+        batch.notify()
+
+    async def _run_workers(self, batch: Batch) -> None:
+        # E/S de disco en hilos: un lote grande no debe frenar el resto de peticiones del gateway
+        pending = iter(await asyncio.to_thread(self._pending, batch))
+        out = await asyncio.to_thread(open, self.batch_dir(batch.id) / "results.jsonl", "ab")
+        write_lock = asyncio.Lock()  # una escritura a la vez: el offset de cada línea es el tamaño previo
+        try:
+            async def worker() -> None:
+                for index, item in pending:  # iterador compartido: cada petición la toma un solo worker
+                    result = await self._execute(batch, index, item)
+                    line = (json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8")
+                    async with write_lock:
+                        await asyncio.to_thread(_append, out, line)
+                        batch.offsets[index] = (batch.results_size, len(line))
+                        batch.arrival.append(batch.offsets[index])
+                        batch.results_size += len(line)
+                    if result["error"] is None:
+                        batch.completed += 1
+                    else:
+                        batch.failed += 1
+                    batch.notify()
+
+            workers = [asyncio.ensure_future(worker()) for _ in range(batch.concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for w in workers:
+                    w.cancel()  # si un worker falla, los demás no siguen escribiendo en `out`
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            out.close()
+
+    async def _execute(self, batch: Batch, index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": item["custom_id"], "index": index}
+        for attempt in range(self.max_retries + 1):
+            try:
+                body = await self.runner(item["body"], batch.owner, batch.profile)
+                return {**result, "response": {"status_code": 200, "body": body}, "error": None}
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                code, retry_after = _error_status(e)
+                if code in TRANSIENT_CODES and attempt < self.max_retries:
+                    backoff = min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                    await asyncio.sleep(max(backoff, retry_after or 0))
+                    continue
+                message = e.detail if isinstance(e, HTTPException) else (str(e) or e.__class__.__name__)
+                return {**result, "response": {"status_code": code, "body": None},
+                        "error": {"code": code, "message": message, "attempts": attempt + 1}}
+        raise AssertionError("inalcanzable")
+
+    # ---------- resultados ----------
+    async def iter_results(self, batch: Batch, order: str, offset: int) -> AsyncIterator[bytes]:
+        """
+        Resultados JSONL a partir de la posición `offset` (para reanudar una descarga cortada).
+        `order=completed` los entrega según terminan; `order=input`, en el orden del archivo de entrada.
+        Si el lote sigue en curso, espera a los resultados nuevos hasta que termine.
+        """
+        path = self.batch_dir(batch.id) / "results.jsonl"
+        position = offset
+        f = await asyncio.to_thread(open, path, "rb")
+        try:
+            while True:
+                changed = batch.changed
+                finished = batch.finished
+                if order == "completed":
+                    entries = batch.arrival[position:]
+                else:
+                    entries = []
+                    while position + len(entries) in batch.offsets:
+                        entries.append(batch.offsets[position + len(entries)])
+                for chunk in await asyncio.to_thread(_read_ranges, f, entries):
+                    yield chunk
+                position += len(entries)
+                if finished or position >= batch.total:
+                    return
+                await changed.wait()
+        finally:
+            f.close()
+
+    # ---------- persistencia / TTL ----------
+    def _persist(self, batch: Batch) -> None:
+        path = self.batch_dir(batch.id) / "batch.json"
+        try:
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(batch.to_dict()), "utf-8")
+            tmp.replace(path)
+        except OSError:
+            logger.warning("No se pudo persistir el lote %s", batch.id, exc_info=True)
+
+    def _load(self) -> None:
+        """Recupera los lotes del disco; los interrumpidos por un reinicio continúan donde quedaron."""
+        for d in self.root.iterdir():
+            if not _BATCH_ID_RE.fullmatch(d.name):
+                continue
+            try:
+                batch = Batch.from_dict(json.loads((d / "batch.json").read_text("utf-8")))
+            except (OSError, ValueError, KeyError):
+                shutil.rmtree(d, ignore_errors=True)
+                continue
+            self._index_results(batch)
+            self._batches[batch.id] = batch
+            if batch.status == "cancelling":
+                batch.status, batch.finished_at = "cancelled", time.time()
+                self._persist(batch)
+            elif not batch.finished:
+                logger.info("Reanudando lote %s (%d/%d)", batch.id, len(batch.offsets), batch.total)
+                self._spawn(batch)
+
+    def _index_results(self, batch: Batch) -> None:
+        path = self.batch_dir(batch.id) / "results.jsonl"
+        seen: Set[int] = set()
+        with open(path, "r+b") as f:
+            position = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # línea a medio escribir cuando se cortó el proceso
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    break
+                index = int(result["index"])
+                if index not in seen:
+                    seen.add(index)
+                    batch.offsets[index] = (position, len(line))
+                    batch.arrival.append(batch.offsets[index])
+                    if result.get("error") is None:
+                        batch.completed += 1
+                    else:
+                        batch.failed += 1
+                position += len(line)
+            f.truncate(position)
+        batch.results_size = position
+
+    async def sweep_expired(self) -> None:
+        now = time.time()
+        for batch in list(self._batches.values()):
+            if batch.finished_at is not None and now - batch.finished_at > self.ttl_s:
+                self._batches.pop(batch.id, None)
+                await asyncio.to_thread(shutil.rmtree, self.batch_dir(batch.id), True)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await self.sweep_expired()
+            await asyncio.sleep(300)
+
+    def start(self) -> None:
+        self._load()
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        tasks = [t for t in [self._sweeper, *self._tasks.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _append(out: BinaryIO, line: bytes) -> None:
+    out.write(line)
+    out.flush()
+
+
+def _read_ranges(f: BinaryIO, entries: List[Tuple[int, int]]) -> List[bytes]:
+    chunks = []
+    for start, size in entries:
+        f.seek(start)
+        chunks.append(f.read(size))
+    return chunks
+
+
+_manager: Optional[BatchManager] = None
+
+
+def start_batch_manager(root: str, runner: Runner, max_concurrency: int, max_running: int,
+                        max_retries: int, ttl_s: float, max_lines: int) -> BatchManager:
+    global _manager
+    if _manager is None:
+        _manager = BatchManager(Path(root).expanduser(), runner, max_concurrency, max_running, max_retries, ttl_s, max_lines)
+        _manager.start()
+    return _manager
+
+
+async def stop_batch_manager() -> None:
+    global _manager
+    if _manager is not None:
+        await _manager.stop()
+        _manager = None
+
+
+def get_batch_manager() -> BatchManager:
+    if _manager is None:
+        raise HTTPException(status_code=503, detail="Gestor de lotes no iniciado")
+    return _manager
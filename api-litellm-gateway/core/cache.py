@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Resultado de una consulta a la caché (también se devuelve en la cabecera X-Cache)
+CACHE_HIT = "HIT"
+CACHE_MISS = "MISS"
+CACHE_COALESCED = "COALESCED"
+CACHE_BYPASS = "BYPASS"
+
+
+def cache_key(payload: Dict[str, Any]) -> str:
+    """Hash canónico (JSON con claves ordenadas y sin espacios) de modelo, mensajes y parámetros."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class DiskCacheBackend:
+    """
+    Segundo nivel en disco: un JSON por clave en `root/<ab>/<clave>.json`, caducado por mtime.
+    Si `root` es un volumen compartido, varias réplicas del gateway comparten las respuestas.
+    """
+
+    def __init__(self, root: str, ttl_s: float):
+        self.root = os.path.expanduser(root)
+        self.ttl_s = ttl_s
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl_s:
+                os.unlink(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp, path)  # escritura atómica: otra réplica nunca lee un JSON a medias
+        except OSError:
+            logger.warning("No se pudo escribir la respuesta en la caché de disco", exc_info=True)
+
+
+class ResponseCache:
+    """
+    Caché LRU con TTL de respuestas de chat + coalescencia de peticiones en vuelo (singleflight).
+
+    - Memoria: `OrderedDict` acotado a `max_entries`; cada entrada caduca a los `ttl_s` segundos.
+    - Disco (opcional): se consulta en un hilo cuando la clave no está en memoria.
+    - Singleflight: peticiones idénticas que llegan mientras otra está en curso esperan esa misma
+      llamada upstream en lugar de lanzar otra. La llamada corre en su propia tarea, así que si el
+      cliente que la originó se desconecta, las demás siguen recibiendo la respuesta.
+    """
+
+    def __init__(self, max_entries: int, ttl_s: float, disk: Optional[DiskCacheBackend] = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk = disk
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  # clave -> (expira, valor)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "bypass": 0}
+
+    def _get_memory(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _set_memory(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_s, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, key: str) -> Optional[Any]:
+        value = self._get_memory(key)
+        if value is None and self.disk is not None:
+            value = await asyncio.to_thread(self.disk.get, key)
+            if value is not None:
+                self._set_memory(key, value)
+        return value
+
+    async def _store(self, key: str, value: Any) -> None:
+        self._set_memory(key, value)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.set, key, value)
+
+    async def _fill(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await compute()
+            await self._store(key, value)  # los errores no se cachean: la siguiente petición reintenta
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[Any]], bypass: bool = False
+    ) -> Tuple[Any, str]:
+        """Devuelve `(respuesta, estado)` con estado HIT | MISS | COALESCED | BYPASS.
+
+        Con `bypass` no se lee la caché ni se comparte la llamada, pero la respuesta nueva sí
+        reemplaza a la guardada.
+        """
+        if bypass:
+            self.stats["bypass"] += 1
+            value = await compute()
+            await self._store(key, value)
+            return value, CACHE_BYPASS
+        task = self._inflight.get(key)
+        if task is None:
+            value = await self._lookup(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                return value, CACHE_HIT
+            task = self._inflight.get(key)  # pudo crearse mientras se leía el disco
+        if task is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(task), CACHE_COALESCED
+        self.stats["misses"] += 1
+        task = asyncio.ensure_future(self._fill(key, compute))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())  # sin avisos si nadie espera ya
+        self._inflight[key] = task
+        return await asyncio.shield(task), CACHE_MISS
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hit_rate": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 4) if lookups else 0.0,
+            "disk": self.disk.root if self.disk is not None else None,
+        }
@@ -29,17 +29,129 @@ class Settings(BaseSettings):
     OCI_PROFILE: str = "DEFAULT"
     OCI_CONFIG_FILE: str = "~/.oci/config"
     OCI_REGION: Optional[str] = None
+    # Perfiles adicionales separados por coma (p.ej. "ADRES,BACKUP"); OCI_PROFILE es el perfil por defecto
+    OCI_PROFILES: str = ""
+    # Cada cuántos segundos se revisa el mtime de config/key_file para recargar credenciales (0 = nunca)
+    OCI_CREDENTIALS_RELOAD_S: float = 5.0
+
+    # ============================================================================
+    # REGIONES OCI: FAILOVER Y HEDGING
+    # ============================================================================
+    # Regiones por orden de preferencia separadas por coma (p.ej. "us-chicago-1,sa-saopaulo-1"); vacío = solo
+    # OCI_REGION o la región del perfil. También "nombre=http://host:puerto/v1" para upstreams OpenAI-compatibles
+    OCI_REGIONS: str = ""
+    # JSON opcional con regiones por modelo: {"default": [...], "models": {"xai.grok-4": [...]}}
+    REGIONS_CONFIG_FILE: Optional[str] = None
+    # Duplicar en la siguiente región las llamadas que superan el p95 reciente de su región
+    HEDGE_ENABLED: bool = True
+    HEDGE_PERCENTILE: float = 0.95
+    HEDGE_MIN_DELAY_S: float = 0.5
+    HEDGE_MAX_DELAY_S: float = 30.0
+    # Espera antes de duplicar mientras no hay REGION_MIN_SAMPLES latencias de la región
+    HEDGE_DEFAULT_DELAY_S: float = 5.0
+    # Fracción máxima de peticiones que se duplican
+    HEDGE_MAX_RATIO: float = 0.1
+    # Salud por región: ventana de latencias, circuito tras N errores seguidos y umbrales de degradación
+    REGION_LATENCY_WINDOW: int = 200
+    REGION_MIN_SAMPLES: int = 20
+    REGION_FAILURE_THRESHOLD: int = 3
+    REGION_COOLDOWN_S: float = 30.0
+    REGION_MAX_ERROR_RATE: float = 0.2
+    REGION_SLOW_FACTOR: float = 2.0
 
     # ============================================================================
     # CONFIGURACIÓN DE OCI GENERATIVE AI
     # ============================================================================
     CON_COMPARTMENT_ID: Optional[str] = None
+
+    # ============================================================================
+    # BACKENDS LOCALES OPENAI-COMPATIBLES (vLLM + LMCache)
+    # ============================================================================
+    # URLs base separadas por coma (p.ej. "http://vllm-0:8000/v1,http://vllm-1:8000/v1")
+    LOCAL_BACKENDS: str = ""
+    # Los modelos con este prefijo (p.ej. "local/openai/gpt-oss-20b") se envían a los backends locales
+    LOCAL_MODEL_PREFIX: str = "local/"
+    LOCAL_BACKEND_API_KEY: str = "EMPTY"
+    # Afinidad de prefijo: tamaño de chunk KV (igual que chunk_size de LMCache) y chunks que se hashean
+    ROUTER_CHUNK_TOKENS: int = 256
+    ROUTER_PREFIX_CHUNKS: int = 1
+    ROUTER_TOKENIZER: str = "cl100k_base"
+    # Peticiones en vuelo a partir de las cuales una réplica se considera saturada
+    ROUTER_MAX_INFLIGHT: int = 32
+    ROUTER_VNODES: int = 64
+
+    # ============================================================================
+    # LOTES JSONL (/v1/batches)
+    # ============================================================================
+    BATCH_DIR: str = "/tmp/litellm-gateway/batches"
+    # Peticiones simultáneas por lote (tope para el parámetro `concurrency`) y lotes simultáneos
+    BATCH_MAX_CONCURRENCY: int = 16
+    BATCH_MAX_RUNNING: int = 2
+    # Reintentos por petición ante 429 / 5xx / timeouts (backoff exponencial + Retry-After)
+    BATCH_MAX_RETRIES: int = 4
+    BATCH_MAX_LINES: int = 50000
+    # Los lotes terminados se borran pasado este tiempo
+    BATCH_TTL_S: float = 86400.0
+
+    # ============================================================================
+    # MÉTRICAS (Prometheus en /metrics)
+    # ============================================================================
+    # Máximo de valores distintos de la etiqueta `model`; los demás se agrupan como "other"
+    METRICS_MAX_MODELS: int = 20
+
+    # ============================================================================
+    # CONFIGURACIÓN DE STREAMING (SSE)
+    # ============================================================================
+    # Cada cuántos segundos se comprueba si el cliente sigue conectado mientras se espera un token
+    STREAM_DISCONNECT_POLL_S: float = 1.0
     
+    # ============================================================================
+    # CACHÉ DE RESPUESTAS
+    # ============================================================================
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1024
+    RESPONSE_CACHE_TTL_S: float = 600.0
+    # Directorio opcional de segundo nivel (puede ser un volumen compartido entre réplicas)
+    RESPONSE_CACHE_DIR: Optional[str] = None
+    # Solo se cachean peticiones deterministas (temperature=0, n<=1)
+    RESPONSE_CACHE_DETERMINISTIC_ONLY: bool = True
+
     # ============================================================================
     # CONFIGURACIÓN DE SEGURIDAD
     # ============================================================================
-    API_KEY: str
+    # Clave única heredada; se combina con la tabla de ADMISSION_CONFIG_FILE si existe
+    API_KEY: Optional[str] = None
+    # JSON con la tabla de claves (límites y prioridad por clave) y los límites por modelo
+    ADMISSION_CONFIG_FILE: Optional[str] = None
+
+    # ============================================================================
+    # CONTROL DE ADMISIÓN (0 = sin límite)
+    # ============================================================================
+    # Límites por defecto de cada clave
+    KEY_MAX_CONCURRENCY: int = 0
+    KEY_RPM: float = 0
+    KEY_BURST: int = 0
+    # Límites por defecto de cada modelo (compartidos por todas las claves)
+    MODEL_MAX_CONCURRENCY: int = 0
+    MODEL_RPM: float = 0
+    MODEL_BURST: int = 0
+    # Espera máxima en cola antes de responder 429 y tamaño máximo de cada cola
+    ADMISSION_MAX_WAIT_S: float = 30.0
+    ADMISSION_MAX_QUEUE: int = 256
+
+    @property
+    def oci_profiles(self) -> List[str]:
+        """Perfiles OCI a cargar: primero OCI_PROFILE y luego los de OCI_PROFILES."""
+        extra = [p.strip() for p in self.OCI_PROFILES.split(",") if p.strip()]
+        return list(dict.fromkeys([self.OCI_PROFILE, *extra]))
+
+    @property
+    def oci_regions(self) -> List[str]:
+        return [r.strip() for r in self.OCI_REGIONS.split(",") if r.strip()]
 
+    @property
+    def local_backends(self) -> List[str]:
+        return [u.strip() for u in self.LOCAL_BACKENDS.split(",") if u.strip()]
 
     class Config:
         env_file = ".env"
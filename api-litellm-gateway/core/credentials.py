@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import oci
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+class OCICredentials(NamedTuple):
+    """Credenciales de un perfil OCI ya resueltas (clave privada incluida)."""
+    profile: str
+    user: Optional[str]
+    fingerprint: Optional[str]
+    tenancy: Optional[str]
+    region: Optional[str]
+    key: str
+
+
+def read_key_file(path: str) -> str:
+    """Lee la clave privada eliminando el trailer 'OCI_API_KEY' que añade la consola de OCI."""
+    with open(path, "r") as file:
+        key_lines = file.readlines()
+    # Elimina la última línea si es exactamente 'OCI_API_KEY', junto con su salto de línea
+    if key_lines and key_lines[-1].strip() == "OCI_API_KEY":
+        key_lines = key_lines[:-1]
+    # Si después de eliminar, la última línea es un salto de línea vacío, también lo quitamos
+    if key_lines and key_lines[-1].strip() == "":
+        key_lines = key_lines[:-1]
+    return "".join(key_lines)
+
+
+def _mtime(path: Optional[str]) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime if path else None
+    except OSError:
+        return None
+
+
+class OCICredentialProvider:
+    """
+    Caché de credenciales OCI por perfil con recarga en caliente.
+
+    Cada perfil se carga una sola vez (config + clave privada). Una tarea en segundo plano
+    compara cada `interval_s` segundos el mtime del archivo de config y de cada `key_file`
+    (en un hilo, fuera del event loop) y recarga solo los perfiles cuyos archivos cambiaron.
+    `get()` no toca el disco: devuelve lo que hay en memoria.
+    """
+
+    def __init__(self, config_file: str, profiles: List[str], interval_s: float = 5.0):
+        self.config_file = os.path.expanduser(config_file)
+        self.profiles = list(dict.fromkeys(profiles))
+        self.interval_s = interval_s
+        self._creds: Dict[str, OCICredentials] = {}
+        self._errors: Dict[str, str] = {}
+        self._mtimes: Dict[str, Tuple[Optional[float], Optional[float]]] = {}  # perfil -> (config, key)
+        self._key_files: Dict[str, str] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _load(self, profile: str) -> None:
+        config_mtime = _mtime(self.config_file)
+        try:
+            if config_mtime is None:
+                raise FileNotFoundError(f"Archivo de configuración no encontrado: {self.config_file}")
+            config = oci.config.from_file(self.config_file, profile_name=profile)
+            key_file = os.path.expanduser(config.get("key_file") or "")
+            self._key_files[profile] = key_file
+            creds = OCICredentials(
+                profile     = profile,
+                user        = config.get("user"),
+                fingerprint = config.get("fingerprint"),
+                tenancy     = config.get("tenancy"),
+                region      = config.get("region"),
+                key         = read_key_file(key_file),
+            )
+        except Exception as e:
+            # Se conserva la última credencial válida: un archivo a medio escribir no corta el servicio
+            self._errors[profile] = str(e) or e.__class__.__name__
+            logger.error("No se pudo cargar el perfil OCI '%s': %s", profile, self._errors[profile])
+        else:
+            self._creds[profile] = creds
+            self._errors.pop(profile, None)
+            logger.info("Credenciales OCI cargadas para el perfil '%s'", profile)
+        self._mtimes[profile] = (config_mtime, _mtime(self._key_files.get(profile)))
+
+    def load_all(self) -> None:
+        for profile in self.profiles:
+            self._load(profile)
+
+    def reload_changed(self) -> None:
+        """Recarga los perfiles cuyo archivo de config o de clave cambió desde la última carga."""
+        config_mtime = _mtime(self.config_file)
+        for profile in self.profiles:
+            current = (config_mtime, _mtime(self._key_files.get(profile)))
+            if current != self._mtimes.get(profile):
+                self._load(profile)
+
+    def get(self, profile: Optional[str] = None) -> OCICredentials:
+        profile = profile or self.profiles[0]
+        creds = self._creds.get(profile)
+        if creds is not None:
+            return creds
+        if profile not in self.profiles:
+            raise HTTPException(status_code=400, detail=f"Perfil OCI no configurado: {profile}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Credenciales OCI no disponibles para '{profile}': {self._errors.get(profile, 'sin cargar')}"
+        )
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_s)
+            try:
+                await asyncio.to_thread(self.reload_changed)
+            except Exception:
+                logger.exception("Error revisando cambios en las credenciales OCI")
+
+    async def start(self) -> None:
+        await asyncio.to_thread(self.load_all)
+        if self.interval_s > 0:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+_provider: Optional[OCICredentialProvider] = None
+
+
+async def start_credential_provider(config_file: str, profiles: List[str], interval_s: float) -> OCICredentialProvider:
+    global _provider
+    if _provider is None:
+        _provider = OCICredentialProvider(config_file, profiles, interval_s)
+        await _provider.start()
+    return _provider
+
+
+async def stop_credential_provider() -> None:
+    global _provider
+    if _provider is not None:
+        await _provider.stop()
+        _provider = None
+
+
+def get_credential_provider() -> OCICredentialProvider:
+    if _provider is None:
+        raise HTTPException(status_code=503, detail="Proveedor de credenciales OCI no iniciado")
+    return _provider
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from typing import Any, Optional, Set
+
+from fastapi import HTTPException
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# =============================
+# Métricas expuestas (Grafana)
+# =============================
+# Cardinalidad acotada: `model` admite como mucho METRICS_MAX_MODELS valores (el resto = "other"),
+# `status` es un código HTTP y el resto de etiquetas son conjuntos cerrados.
+
+REQUEST_SECONDS = Histogram(
+    "gateway_request_duration_seconds",
+    "Duración de /v1/chat/completions hasta el último byte (s)",
+    ["model", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300),
+)
+TTFT_SECONDS = Histogram(
+    "gateway_time_to_first_token_seconds",
+    "Tiempo hasta el primer chunk en respuestas en streaming (s)",
+    ["model"],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30),
+)
+TOKENS = Counter("gateway_tokens_total", "Tokens reportados por el proveedor (kind = prompt | completion)", ["model", "kind"])
+
+INFLIGHT = Gauge("gateway_inflight_requests", "Peticiones en curso en el gateway")
+UPSTREAM_INFLIGHT = Gauge("gateway_upstream_inflight_requests", "Llamadas en curso al proveedor (target = oci | local)", ["target"])
+UPSTREAM_ERRORS = Counter("gateway_upstream_errors_total", "Errores del proveedor por código (o 'other')", ["model", "code"])
+REGION_CALLS = Counter("gateway_region_calls_total", "Llamadas a cada región OCI (result = ok | error | cancelled)", ["region", "result"])
+HEDGES = Counter("gateway_hedged_requests_total", "Peticiones duplicadas en otra región por lentitud (winner = primary | hedge)", ["winner"])
+
+CACHE_RESULTS = Counter("gateway_cache_results_total", "Resultado de la caché de respuestas (HIT | MISS | COALESCED | BYPASS)", ["result"])
+ADMISSION_REJECTED = Counter("gateway_admission_rejected_total", "Peticiones rechazadas con 429 (reason = rate | queue_full | timeout)", ["reason"])
+
+_models: Set[str] = set()
+_max_models = 20
+
+
+def configure(max_models: int) -> None:
+    global _max_models
+    _max_models = max_models
+
+
+def model_label(model: str) -> str:
+    if model in _models:
+        return model
+    if len(_models) < _max_models:
+        _models.add(model)
+        return model
+    return "other"
+
+
+def error_code(exc: BaseException) -> str:
+    """Código HTTP de las excepciones de LiteLLM (RateLimitError = 429, Timeout = 408, ...)."""
+    code = getattr(exc, "status_code", None)
+    return str(code) if isinstance(code, int) and 100 <= code < 600 else "other"
+
+
+def record_usage(model: str, usage: Any) -> None:
+    if usage is None:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+    label = model_label(model)
+    prompt, completion = get("prompt_tokens"), get("completion_tokens")
+    if prompt:
+        TOKENS.labels(label, "prompt").inc(prompt)
+    if completion:
+        TOKENS.labels(label, "completion").inc(completion)
+
+
+class RequestObserver:
+    """Mide una petición: latencia total, TTFT (streaming) y peticiones en curso."""
+
+    __slots__ = ("model", "t0", "first", "done")
+
+    def __init__(self, model: str):
+        self.model = model_label(model)
+        self.t0 = time.perf_counter()
+        self.first = False
+        self.done = False
+        INFLIGHT.inc()
+
+    def chunk(self, chunk: Any) -> None:
+        if not self.first:
+            self.first = True
+            TTFT_SECONDS.labels(self.model).observe(time.perf_counter() - self.t0)
+        usage = getattr(chunk, "usage", None)  # último chunk: el gateway pide siempre stream_options.include_usage
+        if usage is not None:
+            record_usage(self.model, usage)
+
+    def finish(self, status: str) -> None:
+        if self.done:
+            return
+        self.done = True
+        INFLIGHT.dec()
+        REQUEST_SECONDS.labels(self.model, status).observe(time.perf_counter() - self.t0)
+
+
+def metrics_latest() -> bytes:
+    return generate_latest()
+
+
+def metrics_content_type() -> str:
+    return CONTENT_TYPE_LATEST
+
+
+def status_of(exc: Optional[BaseException]) -> str:
+    """Código HTTP que verá el cliente (las excepciones no controladas terminan en 500)."""
+    if exc is None:
+        return "200"
+    if isinstance(exc, HTTPException):
+        return str(exc.status_code)
+    if isinstance(exc, asyncio.CancelledError):
+        return "499"
+    return "500"
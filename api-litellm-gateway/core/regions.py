@@ -0,0 +1,285 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+from core.metrics import HEDGES, REGION_CALLS, error_code
+
+logger = logging.getLogger(__name__)
+
+# Errores tras los que tiene sentido probar otra región (el resto, p.ej. 400 o 401, se devuelven tal cual)
+RETRYABLE_CODES = {"408", "409", "429", "500", "502", "503", "504", "other"}
+
+
+class Endpoint(NamedTuple):
+    """Región OCI o, para pruebas con stubs, endpoint OpenAI-compatible (`api_base`)."""
+    name: str
+    api_base: Optional[str] = None
+
+
+def parse_endpoint(entry: str) -> Endpoint:
+    """`us-chicago-1`, `stub-a=http://localhost:8101/v1` o directamente `http://localhost:8101/v1`."""
+    entry = entry.strip()
+    if "=" in entry:
+        name, url = entry.split("=", 1)
+        return Endpoint(name.strip(), url.strip())
+    if entry.startswith(("http://", "https://")):
+        return Endpoint(urlparse(entry).netloc, entry)
+    return Endpoint(entry)
+
+
+def load_region_config(path: Optional[str], default: List[str]) -> Tuple[List[Endpoint], Dict[str, List[Endpoint]]]:
+    """
+    Regiones por defecto (`OCI_REGIONS`) y, opcionalmente, por modelo desde un JSON:
+
+        {"default": ["us-chicago-1", "sa-saopaulo-1"],
+         "models":  {"xai.grok-4": ["us-chicago-1", "us-ashburn-1"]}}
+
+    El orden es el de preferencia: la primera región sana recibe el tráfico.
+    """
+    regions = [parse_endpoint(e) for e in default if e.strip()]
+    models: Dict[str, List[Endpoint]] = {}
+    if path:
+        with open(os.path.expanduser(path), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("default"):
+            regions = [parse_endpoint(e) for e in data["default"]]
+        for model, entries in (data.get("models") or {}).items():
+            models[model] = [parse_endpoint(e) for e in entries]
+    return regions, models
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return error_code(exc) in RETRYABLE_CODES
+
+
+class RegionStats:
+    """Salud de una región para un modelo: latencias recientes, tasa de error (EWMA) y circuito."""
+
+    __slots__ = ("latencies", "latency_ewma", "error_ewma", "consecutive_failures", "open_until",
+                 "updated", "calls", "errors", "hedges_won")
+
+    def __init__(self, window: int):
+        # Latencias por tipo de llamada: hasta abrir el stream (True) o hasta la respuesta completa (False)
+        self.latencies: Dict[bool, Deque[float]] = {False: deque(maxlen=window), True: deque(maxlen=window)}
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.updated = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.hedges_won = 0
+
+    def percentile(self, stream: bool, q: float, min_samples: int) -> Optional[float]:
+        samples = self.latencies[stream]
+        if len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+    def record_latency(self, stream: bool, latency: float) -> None:
+        self.updated = time.monotonic()
+        self.latencies[stream].append(latency)
+        if not stream:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.9 * self.latency_ewma + 0.1 * latency
+
+    def record_success(self, stream: bool, latency: float) -> None:
+        self.calls += 1
+        self.record_latency(stream, latency)
+        self.error_ewma *= 0.9
+        self.consecutive_failures = 0
+
+    def record_failure(self, threshold: int, cooldown_s: float) -> None:
+        self.calls += 1
+        self.errors += 1
+        self.error_ewma = 0.9 * self.error_ewma + 0.1
+        self.consecutive_failures += 1
+        self.updated = time.monotonic()
+        if self.consecutive_failures >= threshold:
+            # Circuito abierto; pasado el cooldown vuelve a probarse y un nuevo fallo lo reabre
+            self.open_until = time.monotonic() + cooldown_s
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def snapshot(self, q: float) -> Dict[str, Any]:
+        p = self.percentile(False, q, 1)
+        return {
+            "calls":                self.calls,
+            "errors":               self.errors,
+            "error_rate":           round(self.error_ewma, 3),
+            "latency_ewma_s":       round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "latency_pq_s":         round(p, 3) if p is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "open":                 self.is_open(time.monotonic()),
+            "hedges_won":           self.hedges_won,
+        }
+
+
+class RegionFailover:
+    """
+    Failover entre regiones y hedging de llamadas lentas.
+
+    - Orden: las regiones configuradas, en su orden de preferencia, salvo las degradadas (circuito
+      abierto tras `failure_threshold` errores seguidos, tasa de error > `max_error_rate` o latencia
+      media > `slow_factor` veces la de la más rápida), que pasan al final.
+    - Failover: un error transitorio (429, 5xx, timeout, conexión) lanza la llamada en la siguiente región.
+    - Hedging: si la primera región no responde en su percentil `hedge_percentile` reciente (acotado
+      a [`hedge_min_delay_s`, `hedge_max_delay_s`]; `hedge_default_delay_s` mientras no hay muestras),
+      se duplica en la siguiente; gana la primera respuesta y la otra se cancela. Como mucho una
+      fracción `hedge_max_ratio` de las peticiones se duplica, para no multiplicar la carga en un
+      incidente general.
+    """
+
+    def __init__(self, default: List[Endpoint], models: Dict[str, List[Endpoint]], *,
+                 hedge_enabled: bool = True, hedge_percentile: float = 0.95, hedge_min_delay_s: float = 0.5,
+                 hedge_max_delay_s: float = 30.0, hedge_default_delay_s: float = 5.0, hedge_max_ratio: float = 0.1,
+                 window: int = 200, min_samples: int = 20, failure_threshold: int = 3, cooldown_s: float = 30.0,
+                 max_error_rate: float = 0.2, slow_factor: float = 2.0):
+        self.default = default
+        self.models = models
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay_s = hedge_min_delay_s
+        self.hedge_max_delay_s = hedge_max_delay_s
+        self.hedge_default_delay_s = hedge_default_delay_s
+        self.hedge_max_ratio = hedge_max_ratio
+        self.window = window
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.max_error_rate = max_error_rate
+        self.slow_factor = slow_factor
+        self._stats: Dict[Tuple[str, str], RegionStats] = {}
+        self._hedge_tokens = 1.0
+        self.hedged = 0
+        self.failovers = 0
+
+    def stats(self, model: str, endpoint: Endpoint) -> RegionStats:
+        key = (model, endpoint.name)
+        if key not in self._stats:
+            self._stats[key] = RegionStats(self.window)
+        return self._stats[key]
+
+    def ranked(self, model: str, fallback: Endpoint) -> List[Endpoint]:
+        """Regiones del modelo por orden de uso: sanas (en orden de preferencia) y después degradadas."""
+        endpoints = self.models.get(model) or self.default or [fallback]
+        now = time.monotonic()
+        stats = [self.stats(model, e) for e in endpoints]
+        latencies = [s.latency_ewma for s in stats if s.latency_ewma is not None and not s.is_open(now)]
+        fastest = min(latencies) if latencies else None
+
+        def rank(i: int) -> Tuple[int, int, int]:
+            s = stats[i]
+            # Una región degradada que lleva `cooldown_s` sin tráfico vuelve a su sitio para medirse de nuevo
+            recent = now - s.updated < self.cooldown_s
+            slow = fastest is not None and s.latency_ewma is not None and s.latency_ewma > self.slow_factor * fastest
+            return (int(s.is_open(now)), int(recent and (s.error_ewma > self.max_error_rate or slow)), i)
+
+        return [endpoints[i] for i in sorted(range(len(endpoints)), key=rank)]
+
+    def hedge_delay(self, model: str, endpoint: Endpoint, stream: bool) -> float:
+        p = self.stats(model, endpoint).percentile(stream, self.hedge_percentile, self.min_samples)
+        if p is None:
+            return self.hedge_default_delay_s
+        return min(self.hedge_max_delay_s, max(self.hedge_min_delay_s, p))
+
+    def _take_hedge_token(self) -> bool:
+        if self._hedge_tokens < 1:
+            return False
+        self._hedge_tokens -= 1
+        return True
+
+    async def call(self, model: str, stream: bool, fallback: Endpoint,
+                   fn: Callable[[Endpoint], Awaitable[Any]],
+                   discard: Optional[Callable[[Any], Awaitable[None]]] = None) -> Any:
+        """
+        Ejecuta `fn(endpoint)` con failover y hedging; devuelve el primer resultado correcto.
+        `discard` libera los resultados perdedores (p.ej. cierra un stream que llegó tarde).
+        """
+        queue = self.ranked(model, fallback)
+        self._hedge_tokens = min(10.0, self._hedge_tokens + self.hedge_max_ratio)
+        pending: Dict[asyncio.Future, Tuple[Endpoint, float, bool]] = {}
+        hedge_tried = False  # una sola duplicada por petición, haya o no presupuesto
+        hedged = False       # la duplicada se lanzó de verdad
+        last_exc: Optional[BaseException] = None
+
+        def launch(is_hedge: bool) -> Tuple[Endpoint, float]:
+            endpoint, t0 = queue.pop(0), time.monotonic()
+            pending[asyncio.ensure_future(fn(endpoint))] = (endpoint, t0, is_hedge)
+            return endpoint, t0
+
+        primary, started = launch(False)
+        try:
+            while pending:
+                timeout = None
+                if self.hedge_enabled and not hedge_tried and queue and len(pending) == 1:
+                    timeout = max(0.0, started + self.hedge_delay(model, primary, stream) - time.monotonic())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedge_tried = True
+                    if self._take_hedge_token():
+                        hedged = True
+                        self.hedged += 1
+                        logger.info("Hedging de %s: %s tarda, duplicando en %s", model, primary.name, queue[0].name)
+                        launch(True)
+                    continue
+
+                winner = None
+                for task in done:
+                    endpoint, t0, is_hedge = pending.pop(task)
+                    stats = self.stats(model, endpoint)
+                    exc = task.exception()
+                    if exc is None:
+                        if winner is None:
+                            winner = task.result()
+                            stats.record_success(stream, time.monotonic() - t0)
+                            REGION_CALLS.labels(endpoint.name, "ok").inc()
+                            if hedged:
+                                HEDGES.labels("hedge" if is_hedge else "primary").inc()
+                                stats.hedges_won += int(is_hedge)
+                        elif discard is not None:
+                            await discard(task.result())
+                        continue
+                    REGION_CALLS.labels(endpoint.name, "error").inc()
+                    if not is_retryable(exc):
+                        raise exc
+                    stats.record_failure(self.failure_threshold, self.cooldown_s)
+                    logger.warning("Error en la región %s para %s: %s", endpoint.name, model, exc)
+                    last_exc = exc
+                    if queue and not pending:
+                        self.failovers += 1
+                        primary, started = launch(False)
+                if winner is not None:
+                    return winner
+            raise last_exc
+        finally:
+            for task, (endpoint, _, _) in pending.items():
+                # Sin muestra de latencia: el tiempo hasta la cancelación es solo una cota inferior y
+                # haría que `ranked()` y `hedge_delay()` vieran la región más rápida de lo que es
+                REGION_CALLS.labels(endpoint.name, "cancelled").inc()
+                task.cancel()
+                task.add_done_callback(lambda t: self._discard_late(t, discard))
+
+    @staticmethod
+    def _discard_late(task: asyncio.Future, discard: Optional[Callable[[Any], Awaitable[None]]]) -> None:
+        if task.cancelled() or task.exception() is not None or discard is None:
+            return
+        asyncio.ensure_future(discard(task.result()))
+
+    def snapshot(self) -> Dict[str, Any]:
+        regions: Dict[str, Dict[str, Any]] = {}
+        for (model, name), stats in sorted(self._stats.items()):
+            regions.setdefault(model, {})[name] = stats.snapshot(self.hedge_percentile)
+        return {
+            "default":   [e.name for e in self.default],
+            "hedged":    self.hedged,
+            "failovers": self.failovers,
+            "models":    regions,
+        }
@@ -0,0 +1,156 @@
+import bisect
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Si el tokenizador no está disponible se aproxima 1 token ≈ 4 caracteres
+_CHARS_PER_TOKEN = 4
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+class PrefixHasher:
+    """
+    Hash del prefijo del prompt alineado a chunks de `chunk_tokens` (como los chunks KV de LMCache).
+
+    Solo cuentan los chunks completos: un prompt más corto que un chunk no deja KV reutilizable
+    y devuelve None (se enruta por carga). El tokenizador es una aproximación (tiktoken); lo que
+    importa es que el mismo prefijo produzca siempre el mismo hash.
+    """
+
+    def __init__(self, chunk_tokens: int = 256, chunks: int = 1, encoding: str = "cl100k_base"):
+        self.chunk_tokens = chunk_tokens
+        self.chunks = chunks
+        self._encoding_name = encoding
+        self._encoding: Any = None
+        self._encoding_failed = False
+
+    def _encode(self, text: str) -> List[int]:
+        if self._encoding is None and not self._encoding_failed:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self._encoding_name)
+            except Exception as e:
+                self._encoding_failed = True
+                logger.warning("Tokenizador '%s' no disponible (%s); se aproxima por caracteres", self._encoding_name, e)
+        if self._encoding is not None:
+            return self._encoding.encode(text, disallowed_special=())
+        data = text.encode("utf-8")
+        return [_hash64(data[i:i + _CHARS_PER_TOKEN]) for i in range(0, len(data), _CHARS_PER_TOKEN)]
+
+    def prefix_hash(self, messages: List[Dict[str, Any]]) -> Optional[int]:
+        budget = self.chunk_tokens * self.chunks
+        text = "".join(f"<|{m.get('role')}|>{m.get('content') or ''}" for m in messages)
+        tokens = self._encode(text[:budget * 8])  # cota holgada de caracteres: no tokenizar el prompt entero
+        full = min(len(tokens) // self.chunk_tokens, self.chunks) * self.chunk_tokens
+        if full == 0:
+            return None
+        return _hash64(",".join(map(str, tokens[:full])).encode("ascii"))
+
+
+class Replica:
+    """Backend OpenAI-compatible (p.ej. vLLM + LMCache) con su carga y estadísticas de afinidad."""
+
+    def __init__(self, url: str, max_inflight: int, prefix_memory: int):
+        self.url = url.rstrip("/")
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.routed = 0
+        self.prefix_hits = 0     # prefijo ya servido por esta réplica: su KV probablemente sigue en caché
+        self.fallbacks = 0       # peticiones recibidas porque la réplica afín estaba saturada
+        self._prefixes: "OrderedDict[int, None]" = OrderedDict()
+        self._prefix_memory = prefix_memory
+
+    @property
+    def saturated(self) -> bool:
+        return self.inflight >= self.max_inflight
+
+    def remember(self, prefix: Optional[int]) -> bool:
+        """Registra el prefijo; True si la réplica ya lo había servido (acierto estimado de KV)."""
+        if prefix is None:
+            return False
+        hit = prefix in self._prefixes
+        self._prefixes[prefix] = None
+        self._prefixes.move_to_end(prefix)
+        while len(self._prefixes) > self._prefix_memory:
+            self._prefixes.popitem(last=False)
+        return hit
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "inflight": self.inflight,
+            "routed": self.routed,
+            "prefix_hits": self.prefix_hits,
+            "hit_rate": round(self.prefix_hits / self.routed, 4) if self.routed else 0.0,
+            "fallbacks": self.fallbacks,
+        }
+
+
+class PrefixAffinityRouter:
+    """
+    Enrutado por afinidad de prefijo entre réplicas locales.
+
+    Un anillo de hashing consistente (`vnodes` puntos por réplica) asigna cada hash de prefijo a una
+    réplica, de modo que las conversaciones que comparten system prompt caen donde ya está su KV.
+    Añadir o quitar una réplica solo reasigna ~1/N de los prefijos. Si la réplica afín está
+    saturada (`max_inflight`), se usa la menos cargada; los prompts sin un chunk completo van
+    directamente a la menos cargada.
+    """
+
+    def __init__(
+        self, urls: List[str], hasher: PrefixHasher, max_inflight: int = 32,
+        vnodes: int = 64, prefix_memory: int = 4096
+    ):
+        if not urls:
+            raise ValueError("Se necesita al menos una réplica")
+        self.hasher = hasher
+        self.replicas = [Replica(u, max_inflight, prefix_memory) for u in dict.fromkeys(urls)]
+        ring: List[Tuple[int, int]] = []
+        for idx, r in enumerate(self.replicas):
+            ring.extend((_hash64(f"{r.url}#{v}".encode("utf-8")), idx) for v in range(vnodes))
+        ring.sort()
+        self._ring_keys = [k for k, _ in ring]
+        self._ring_idx = [i for _, i in ring]
+
+    def _owner(self, prefix: int) -> Replica:
+        pos = bisect.bisect(self._ring_keys, prefix) % len(self._ring_keys)
+        return self.replicas[self._ring_idx[pos]]
+
+    def _least_loaded(self) -> Replica:
+        return min(self.replicas, key=lambda r: (r.inflight / r.max_inflight, r.inflight))
+
+    def pick(self, messages: List[Dict[str, Any]]) -> Replica:
+        prefix = self.hasher.prefix_hash(messages)
+        replica = self._owner(prefix) if prefix is not None else self._least_loaded()
+        if replica.saturated:
+            fallback = self._least_loaded()
+            if fallback is not replica:
+                replica = fallback
+                replica.fallbacks += 1
+        replica.routed += 1
+        if replica.remember(prefix):
+            replica.prefix_hits += 1
+        return replica
+
+    def acquire(self, replica: Replica) -> None:
+        replica.inflight += 1
+
+    def release(self, replica: Replica) -> None:
+        replica.inflight = max(0, replica.inflight - 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        routed = sum(r.routed for r in self.replicas)
+        hits = sum(r.prefix_hits for r in self.replicas)
+        return {
+            "chunk_tokens": self.hasher.chunk_tokens,
+            "prefix_chunks": self.hasher.chunks,
+            "routed": routed,
+            "hit_rate": round(hits / routed, 4) if routed else 0.0,
+            "replicas": [r.snapshot() for r in self.replicas],
+        }
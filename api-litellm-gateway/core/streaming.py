@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+from typing import Any, AsyncIterator, Callable, Optional
+
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # evita que nginx/ingress acumule el stream
+}
+
+
+class ClientDisconnected(Exception):
+    """El cliente cerró la conexión antes de terminar el stream."""
+
+
+async def _next_chunk(request: Request, it: AsyncIterator[Any], poll_s: float) -> Any:
+    """Siguiente chunk del upstream; revisa cada `poll_s` s si el cliente sigue conectado
+    (entre tokens puede pasar mucho tiempo sin ningún `send` que detecte la desconexión)."""
+    task = asyncio.ensure_future(it.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_s)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def close_upstream(stream: Any) -> None:
+    """Cierra el stream de LiteLLM (y con él la conexión HTTP al proveedor), si lo permite."""
+    for target in (stream, getattr(stream, "completion_stream", None)):
+        aclose = getattr(target, "aclose", None)
+        if aclose is None:
+            continue
+        try:
+            await aclose()
+        except Exception:
+            logger.debug("No se pudo cerrar el stream upstream", exc_info=True)
+
+
+def sse_event(data: str) -> bytes:
+    return f"data: {data}\n\n".encode("utf-8")
+
+
+async def sse_chat_stream(
+    request: Request, stream: Any, poll_s: float = 1.0,
+    on_chunk: Optional[Callable[[Any], None]] = None, on_close: Optional[Callable[[str], None]] = None,
+    include_usage: bool = True,
+) -> AsyncIterator[bytes]:
+    """
+    Reenvía los chunks de `acompletion(stream=True)` como Server-Sent Events OpenAI-compatibles.
+
+    Contrapresión: el siguiente chunk se pide al upstream solo después de entregar el anterior,
+    así que un cliente lento frena la lectura en vez de acumular tokens en memoria. Si el cliente
+    se desconecta, se cancela la lectura pendiente y se cierra la conexión upstream.
+    `on_chunk` recibe cada chunk antes de enviarlo y `on_close` se invoca al terminar el stream,
+    ocurra lo que ocurra, con el resultado: "200", "499" (cliente desconectado) o "500".
+    Con `include_usage=False` (el cliente no pidió `stream_options.include_usage`), `on_chunk` ve el
+    `usage` que el gateway fuerza en el upstream, pero no se reenvía al cliente.
+    """
+    it = stream.__aiter__()
+    outcome = "499"
+    try:
+        while True:
+            try:
+                chunk = await _next_chunk(request, it, poll_s)
+            except StopAsyncIteration:
+                break
+            if on_chunk is not None:
+                on_chunk(chunk)
+            if not include_usage and getattr(chunk, "usage", None) is not None:
+                if not chunk.choices:
+                    continue  # chunk final con solo `usage`
+                chunk.usage = None
+            yield sse_event(chunk.model_dump_json(exclude_none=True))
+        yield sse_event("[DONE]")
+        outcome = "200"
+    except ClientDisconnected:
+        logger.info("Cliente desconectado; stream cancelado")
+    except asyncio.CancelledError:
+        logger.info("Stream cancelado por el servidor o por desconexión")
+        raise
+    except Exception as e:
+        # Las cabeceras ya se enviaron: el error se reporta dentro del stream, como hace OpenAI
+        logger.exception("Error durante el stream")
+        outcome = "500"
+        yield sse_event(json.dumps({"error": {"message": str(e) or e.__class__.__name__, "type": e.__class__.__name__}}))
+    finally:
+        try:
+            await close_upstream(stream)
+        finally:
+            if on_close is not None:
+                on_close(outcome)
+
+
+class SSEStreamingResponse(StreamingResponse):
+    """
+    Respuesta SSE de `sse_chat_stream` cuyo `on_close` se ejecuta exactamente una vez, también si el
+    generador no llega a iterarse: si el cliente se desconecta antes de empezar, Starlette no ejecuta
+    el `finally` del generador ni la `background` de la respuesta, y la admisión y los gauges
+    quedarían ocupados.
+    """
+
+    def __init__(self, request: Request, stream: Any, poll_s: float = 1.0,
+                 on_chunk: Optional[Callable[[Any], None]] = None, on_close: Optional[Callable[[str], None]] = None,
+                 include_usage: bool = True):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+        super().__init__(
+            sse_chat_stream(request, stream, poll_s, on_chunk, self._close, include_usage),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS,
+        )
+
+    def _close(self, outcome: str) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._on_close is not None:
+            self._on_close(outcome)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if not self._closed:
+                logger.info("Stream terminado antes de iterarse; se libera el upstream")
+                try:
+                    await close_upstream(self._stream)
+                finally:
+                    self._close("499")
@@ -1,15 +1,26 @@
-import os
 import logging
-from fastapi import FastAPI, HTTPException, Depends, Header
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ValidationError
+from typing import Any, Dict, List, Optional, Union
 
 from litellm import acompletion
 
-import oci
-
+from core.admission import AdmissionController, ApiKey, Limits, load_admission_config
+from core.batch import ORDERS, get_batch_manager, start_batch_manager, stop_batch_manager
+from core.cache import DiskCacheBackend, ResponseCache, cache_key
 from core.config import settings
+from core.credentials import get_credential_provider, start_credential_provider, stop_credential_provider
+from core.metrics import (
+	CACHE_RESULTS, UPSTREAM_ERRORS, UPSTREAM_INFLIGHT, RequestObserver, configure as configure_metrics,
+	error_code, metrics_content_type, metrics_latest, model_label, record_usage, status_of
+)
+from core.regions import Endpoint, RegionFailover, load_region_config
+from core.routing import PrefixAffinityRouter, PrefixHasher
+from core.streaming import SSEStreamingResponse, close_upstream
 
 # Configuración de logging mínima
 logging.getLogger().handlers = []
@@ -17,11 +28,28 @@ logging.basicConfig(level=getattr(logging, settings.LOG_LEVEL.upper(), logging.I
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+	# Las credenciales OCI se cargan una vez al arrancar y se recargan solo si cambian los archivos
+	await start_credential_provider(settings.OCI_CONFIG_FILE, settings.oci_profiles, settings.OCI_CREDENTIALS_RELOAD_S)
+	# Los lotes pendientes de una ejecución anterior se reanudan aquí
+	start_batch_manager(
+		settings.BATCH_DIR, run_batch_request, settings.BATCH_MAX_CONCURRENCY, settings.BATCH_MAX_RUNNING,
+		settings.BATCH_MAX_RETRIES, settings.BATCH_TTL_S, settings.BATCH_MAX_LINES
+	)
+	try:
+		yield
+	finally:
+		await stop_batch_manager()
+		await stop_credential_provider()
+
+
 # Crear aplicación FastAPI
 app = FastAPI(
 	title=settings.API_TITLE,
 	version=settings.API_VERSION,
-	description=settings.API_DESCRIPTION
+	description=settings.API_DESCRIPTION,
+	lifespan=lifespan
 )
 
 # Configurar CORS (esta es la forma preferida y más robusta)
@@ -34,6 +62,53 @@ app.add_middleware(
 )
 
 
+# Métricas Prometheus: cardinalidad de `model` acotada
+configure_metrics(settings.METRICS_MAX_MODELS)
+
+# Tabla de claves y control de admisión (concurrencia + token bucket por clave y por modelo)
+_key_defaults   = Limits(settings.KEY_MAX_CONCURRENCY, settings.KEY_RPM, settings.KEY_BURST)
+_model_defaults = Limits(settings.MODEL_MAX_CONCURRENCY, settings.MODEL_RPM, settings.MODEL_BURST)
+_keys, _model_limits = load_admission_config(settings.ADMISSION_CONFIG_FILE, settings.API_KEY, _key_defaults, _model_defaults)
+admission = AdmissionController(_keys, _model_limits, _model_defaults, settings.ADMISSION_MAX_WAIT_S, settings.ADMISSION_MAX_QUEUE)
+_keys_by_name = {key.name: key for key in _keys.values()}
+
+# Caché de respuestas + coalescencia de peticiones idénticas en vuelo
+response_cache = ResponseCache(
+	max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+	ttl_s=settings.RESPONSE_CACHE_TTL_S,
+	disk=DiskCacheBackend(settings.RESPONSE_CACHE_DIR, settings.RESPONSE_CACHE_TTL_S) if settings.RESPONSE_CACHE_DIR else None
+) if settings.RESPONSE_CACHE_ENABLED else None
+
+
+# Enrutado por afinidad de prefijo hacia réplicas locales (vLLM + LMCache)
+router = PrefixAffinityRouter(
+	settings.local_backends,
+	PrefixHasher(settings.ROUTER_CHUNK_TOKENS, settings.ROUTER_PREFIX_CHUNKS, settings.ROUTER_TOKENIZER),
+	max_inflight=settings.ROUTER_MAX_INFLIGHT,
+	vnodes=settings.ROUTER_VNODES
+) if settings.local_backends else None
+
+
+# Failover entre regiones OCI y hedging de llamadas lentas
+_default_regions, _model_regions = load_region_config(settings.REGIONS_CONFIG_FILE, settings.oci_regions)
+regions = RegionFailover(
+	_default_regions,
+	_model_regions,
+	hedge_enabled         = settings.HEDGE_ENABLED,
+	hedge_percentile      = settings.HEDGE_PERCENTILE,
+	hedge_min_delay_s     = settings.HEDGE_MIN_DELAY_S,
+	hedge_max_delay_s     = settings.HEDGE_MAX_DELAY_S,
+	hedge_default_delay_s = settings.HEDGE_DEFAULT_DELAY_S,
+	hedge_max_ratio       = settings.HEDGE_MAX_RATIO,
+	window                = settings.REGION_LATENCY_WINDOW,
+	min_samples           = settings.REGION_MIN_SAMPLES,
+	failure_threshold     = settings.REGION_FAILURE_THRESHOLD,
+	cooldown_s            = settings.REGION_COOLDOWN_S,
+	max_error_rate        = settings.REGION_MAX_ERROR_RATE,
+	slow_factor           = settings.REGION_SLOW_FACTOR
+)
+
+
 class ChatMessage(BaseModel):
 	role: str
 	content: str
@@ -42,11 +117,25 @@ class ChatCompletionRequest(BaseModel):
 	model: str
 	messages: List[ChatMessage]
 	temperature: Optional[float] = None
+	max_tokens: Optional[int] = None
+	top_p: Optional[float] = None
+	stop: Optional[Union[str, List[str]]] = None
+	n: Optional[int] = None
+	stream: bool = False
+	stream_options: Optional[Dict[str, Any]] = None
 
+	def is_cacheable(self) -> bool:
+		"""Las respuestas en streaming nunca se cachean; por defecto, solo las deterministas."""
+		if self.stream:
+			return False
+		if not settings.RESPONSE_CACHE_DETERMINISTIC_ONLY:
+			return True
+		return self.temperature == 0 and (self.n or 1) == 1
 
-async def verify_api_key(authorization: str = Header(None)):
+
+async def verify_api_key(authorization: str = Header(None)) -> ApiKey:
 	"""
-	Verifica que el API key sea válido.
+	Verifica que el API key exista en la tabla de claves y devuelve su entrada (límites y prioridad).
 	Espera el formato: 'Bearer sk-oracleai-gateway-2024'
 	"""
 	if not authorization:
@@ -63,13 +152,14 @@ async def verify_api_key(authorization: str = Header(None)):
 				detail="Formato inválido. Use: Authorization: Bearer <api_key>"
 			)
 		
-		if api_key != settings.API_KEY:
+		key = admission.lookup(api_key)
+		if key is None:
 			raise HTTPException(
 				status_code=401, 
 				detail="API key inválida"
 			)
 		
-		return api_key
+		return key
 		
 	except ValueError:
 		raise HTTPException(
@@ -78,47 +168,243 @@ async def verify_api_key(authorization: str = Header(None)):
 		)
 
 
+def release_upstream(ticket, replica, target: str) -> None:
+	ticket.release()
+	UPSTREAM_INFLIGHT.labels(target).dec()
+	if replica is not None:
+		router.release(replica)
+
+
+@app.get("/metrics")
+async def metrics():
+	return Response(content=metrics_latest(), media_type=metrics_content_type())
+
 @app.get(f"{settings.GATEWAY_BASE_PATH}/v1/health")
-async def proxy_health(api_key: str = Depends(verify_api_key)):
+async def proxy_health(api_key: ApiKey = Depends(verify_api_key)):
 	return {"status": "ok", "message": "API key válida"}
 
+@app.get(f"{settings.GATEWAY_BASE_PATH}/v1/cache/stats")
+async def cache_stats(api_key: ApiKey = Depends(verify_api_key)):
+	if response_cache is None:
+		return {"enabled": False}
+	return {"enabled": True, **response_cache.snapshot()}
+
+@app.get(f"{settings.GATEWAY_BASE_PATH}/v1/router/stats")
+async def router_stats(api_key: ApiKey = Depends(verify_api_key)):
+	if router is None:
+		return {"enabled": False}
+	return {"enabled": True, **router.snapshot()}
+
+@app.get(f"{settings.GATEWAY_BASE_PATH}/v1/regions/stats")
+async def region_stats(api_key: ApiKey = Depends(verify_api_key)):
+	return regions.snapshot()
+
+@app.get(f"{settings.GATEWAY_BASE_PATH}/v1/admission/stats")
+async def admission_stats(api_key: ApiKey = Depends(verify_api_key)):
+	return admission.snapshot()
+
+@app.post(f"{settings.GATEWAY_BASE_PATH}/v1/batches")
+async def create_batch(
+	request: Request,
+	api_key: ApiKey = Depends(verify_api_key),
+	concurrency: Optional[int] = Query(None, ge=1),
+	x_oci_profile: Optional[str] = Header(None)
+):
+	"""Crea un lote a partir del cuerpo JSONL (una petición de chat por línea)."""
+	raw = await request.body()
+	try:
+		lines = raw.decode("utf-8").splitlines()
+	except UnicodeDecodeError:
+		raise HTTPException(status_code=400, detail="El lote debe ser JSONL en UTF-8")
+	return (await get_batch_manager().create(api_key.name, lines, concurrency, x_oci_profile)).to_dict()
+
+@app.get(f"{settings.GATEWAY_BASE_PATH}/v1/batches")
+async def list_batches(api_key: ApiKey = Depends(verify_api_key)):
+	return {"object": "list", "data": [b.to_dict() for b in get_batch_manager().list(api_key.name)]}
+
+@app.get(f"{settings.GATEWAY_BASE_PATH}/v1/batches/{{batch_id}}")
+async def get_batch(batch_id: str, api_key: ApiKey = Depends(verify_api_key)):
+	return get_batch_manager().get(batch_id, api_key.name).to_dict()
+
+@app.post(f"{settings.GATEWAY_BASE_PATH}/v1/batches/{{batch_id}}/cancel")
+async def cancel_batch(batch_id: str, api_key: ApiKey = Depends(verify_api_key)):
+	manager = get_batch_manager()
+	return manager.cancel(manager.get(batch_id, api_key.name)).to_dict()
+
+@app.get(f"{settings.GATEWAY_BASE_PATH}/v1/batches/{{batch_id}}/results")
+async def batch_results(
+	batch_id: str,
+	api_key: ApiKey = Depends(verify_api_key),
+	order: str = Query("input"),
+	offset: int = Query(0, ge=0)
+):
+	"""
+	Resultados en JSONL, en streaming mientras el lote avanza.
+	`order=input|completed`; `offset` = líneas ya recibidas (para reanudar una descarga cortada).
+	"""
+	if order not in ORDERS:
+		raise HTTPException(status_code=400, detail=f"order debe ser uno de {', '.join(ORDERS)}")
+	manager = get_batch_manager()
+	batch = manager.get(batch_id, api_key.name)
+	return StreamingResponse(
+		manager.iter_results(batch, order, offset),
+		media_type="application/x-ndjson",
+		headers={"X-Batch-Status": batch.status, "X-Batch-Total": str(batch.total)}
+	)
+
+
+async def run_batch_request(body: dict, owner: str, profile: Optional[str]):
+	"""Ejecuta una línea de un lote por el mismo camino que /v1/chat/completions, con prioridad batch."""
+	key = _keys_by_name.get(owner)
+	if key is None:
+		raise HTTPException(status_code=401, detail="La clave que creó el lote ya no existe")
+	try:
+		req = ChatCompletionRequest.model_validate({**body, "stream": False})
+	except ValidationError as e:
+		raise HTTPException(status_code=422, detail=str(e))
+	resp, _ = await execute_chat(req, key, None, profile, "batch")
+	return jsonable_encoder(resp)
+
+
 @app.post(f"{settings.GATEWAY_BASE_PATH}/v1/chat/completions")
-async def chat_completions(req: ChatCompletionRequest, api_key: str = Depends(verify_api_key)):
-	# Aceptamos el nombre oficial (xai.grok-4) y resolvemos el proveedor internamente
-	model    = req.model if "/" in req.model else f"oci/{req.model}"
+async def chat_completions(
+	req: ChatCompletionRequest,
+	request: Request,
+	api_key: ApiKey = Depends(verify_api_key),
+	x_oci_profile: Optional[str] = Header(None),
+	x_cache_bypass: Optional[str] = Header(None),
+	x_priority: Optional[str] = Header(None)
+):
+	bypass = (x_cache_bypass or "").lower() in ("1", "true", "yes")
+	result = await execute_chat(req, api_key, request, x_oci_profile, x_priority, bypass)
+	if isinstance(result, StreamingResponse):
+		return result
+	body, cache_status = result
+	return JSONResponse(jsonable_encoder(body), headers={"X-Cache": cache_status} if cache_status else None)
+
+
+async def execute_chat(
+	req: ChatCompletionRequest,
+	api_key: ApiKey,
+	request: Optional[Request] = None,
+	x_oci_profile: Optional[str] = None,
+	x_priority: Optional[str] = None,
+	bypass: bool = False
+):
+	"""
+	Camino común de /v1/chat/completions y de los lotes: proveedor, caché, admisión, enrutado y métricas.
+	Devuelve un StreamingResponse si `req.stream`; si no, `(respuesta, estado de caché o None)`.
+	"""
 	messages = [m.model_dump() for m in req.messages]
-	
-	# Leer la configuración desde el archivo de configuración
-	config_file = os.path.expanduser(settings.OCI_CONFIG_FILE)
-	if not os.path.exists(config_file):
-		raise FileNotFoundError(f"Archivo de configuración no encontrado: {config_file}")
-	
-	# Leer la configuración desde el archivo de configuración
-	config   = oci.config.from_file(config_file, profile_name=settings.OCI_PROFILE)
-	
-	# Leer la clave desde el archivo de configuración
-	path_key = config.get("key_file")
-	with open(path_key, "r") as file:
-		key_lines = file.readlines()
-	# Elimina la última línea si es exactamente 'OCI_API_KEY\n' o 'OCI_API_KEY', junto con su salto de línea
-	if key_lines and key_lines[-1].strip() == "OCI_API_KEY":
-		key_lines = key_lines[:-1]
-	# Si después de eliminar, la última línea es un salto de línea vacío, también lo quitamos
-	if key_lines and key_lines[-1].strip() == "":
-		key_lines = key_lines[:-1]
-	key = "".join(key_lines)
-
-	resp = await acompletion(	
-		model              = model,	
-		messages           = messages,
-		stream             = False,
-		temperature        = req.temperature,
-		oci_region         = settings.OCI_REGION,
-		oci_user           = config.get("user"),
-		oci_fingerprint    = config.get("fingerprint"),	
-		oci_tenancy        = config.get("tenancy"),
-		oci_key            = key,
-		oci_compartment_id = settings.CON_COMPARTMENT_ID,
-	)
 
-	return resp
\ No newline at end of file
+	if router is not None and req.model.startswith(settings.LOCAL_MODEL_PREFIX):
+		# Backend local OpenAI-compatible: la réplica se elige al llamar (afinidad de prefijo + carga)
+		model    = f"openai/{req.model[len(settings.LOCAL_MODEL_PREFIX):]}"
+		target   = "local"
+		provider = None
+	else:
+		# Aceptamos el nombre oficial (xai.grok-4) y resolvemos el proveedor internamente
+		model    = req.model if "/" in req.model else f"oci/{req.model}"
+		# Credenciales en memoria: sin E/S de disco en el camino de la petición
+		creds    = get_credential_provider().get(x_oci_profile)
+		target   = creds.profile
+		provider = {
+			"oci_user":           creds.user,
+			"oci_fingerprint":    creds.fingerprint,
+			"oci_tenancy":        creds.tenancy,
+			"oci_key":            creds.key,
+			"oci_compartment_id": settings.CON_COMPARTMENT_ID,
+		}
+
+	params = {
+		"temperature": req.temperature,
+		"max_tokens":  req.max_tokens,
+		"top_p":       req.top_p,
+		"stop":        req.stop,
+		"n":           req.n,
+	}
+	if req.stream:
+		# Siempre se pide `usage` al upstream para contar tokens; al cliente solo le llega si lo pidió
+		params["stream_options"] = {"include_usage": True}
+
+	release_stream = None  # libera admisión y réplica local cuando termina el stream
+	upstream_target = "local" if provider is None else "oci"
+
+	async def call_region(endpoint: Endpoint):
+		if endpoint.api_base:
+			# Upstream OpenAI-compatible (p.ej. _tests/stub_backend.py) en lugar de una región OCI
+			return await acompletion(
+				model    = f"openai/{req.model}",
+				messages = messages,
+				stream   = req.stream,
+				**params,
+				api_base = endpoint.api_base,
+				api_key  = settings.LOCAL_BACKEND_API_KEY,
+			)
+		return await acompletion(model=model, messages=messages, stream=req.stream, **params, **provider, oci_region=endpoint.name)
+
+	async def call_upstream():
+		nonlocal release_stream
+		# Solo las llamadas reales al proveedor pasan por admisión (los aciertos de caché no)
+		ticket  = await admission.admit(api_key, req.model, x_priority)
+		replica = None
+		UPSTREAM_INFLIGHT.labels(upstream_target).inc()
+		try:
+			if provider is not None:
+				fallback = Endpoint(settings.OCI_REGION or creds.region)
+				resp = await regions.call(req.model, req.stream, fallback, call_region, close_upstream if req.stream else None)
+			else:
+				replica = router.pick(messages)
+				router.acquire(replica)
+				resp = await acompletion(
+					model    = model,
+					messages = messages,
+					stream   = req.stream,
+					**params,
+					api_base = replica.url,
+					api_key  = settings.LOCAL_BACKEND_API_KEY,
+				)
+		except BaseException as e:
+			release_upstream(ticket, replica, upstream_target)
+			if isinstance(e, Exception):
+				UPSTREAM_ERRORS.labels(model_label(req.model), error_code(e)).inc()
+			raise
+		if req.stream:
+			# Los permisos siguen ocupados mientras dure el stream
+			release_stream = lambda: release_upstream(ticket, replica, upstream_target)
+		else:
+			release_upstream(ticket, replica, upstream_target)
+			record_usage(req.model, getattr(resp, "usage", None))
+		return resp
+
+	obs = RequestObserver(req.model)
+	try:
+		if response_cache is not None and req.is_cacheable():
+			async def call_cached():
+				return jsonable_encoder(await call_upstream())
+
+			# La clave de API y el perfil OCI pedido forman parte del hash: sin respuestas entre clientes
+			key = cache_key({"model": model, "messages": messages, "target": target, "api_key": api_key.name, "profile": x_oci_profile, **params})
+			body, status = await response_cache.get_or_compute(key, call_cached, bypass=bypass)
+			CACHE_RESULTS.labels(status).inc()
+			obs.finish("200")
+			return body, status
+
+		resp = await call_upstream()
+	except BaseException as e:
+		obs.finish(status_of(e))
+		raise
+
+	if req.stream:
+		def on_close(outcome: str) -> None:
+			release_stream()
+			obs.finish(outcome)
+
+		# Server-Sent Events: cada chunk se reenvía en cuanto llega (menor time-to-first-token)
+		return SSEStreamingResponse(
+			request, resp, settings.STREAM_DISCONNECT_POLL_S, obs.chunk, on_close,
+			include_usage=bool((req.stream_options or {}).get("include_usage")),
+		)
+
+	obs.finish("200")
+	return resp, None
@@ -0,0 +1,324 @@
+"""
+Generador de carga asíncrono para cualquier endpoint OpenAI-compatible (vLLM + LMCache, gateway, ...).
+
+Reproduce cargas con prefijos compartidos o conversaciones multi-turno, alineadas al `chunk_size`
+de LMCache, y reporta en JSON TTFT, latencia entre tokens (ITL), latencia total, tokens/s y
+p50/p95/p99. Las peticiones "warm" (prefijo ya procesado antes) se reportan aparte de las "cold" para
+ver el beneficio de la caché KV.
+
+    # Contra el servidor simulado, sin GPU ni red
+    python _test/loadgen.py --mock --workload multi-turn --sessions 16 --turns 4
+
+    # Contra vLLM + LMCache
+    python _test/loadgen.py --base-url http://localhost:8000/v1 --concurrency 8 --rate 4 --output report.json
+
+    # Contra el gateway
+    python _test/loadgen.py --base-url http://localhost:4000/litellm/oci/v1 --api-key oci-*** --model xai.grok-4
+
+Los prompts son sintéticos: una palabra ≈ un token, así que los prefijos quedan alineados a
+`--chunk-size` de forma aproximada con tokenizadores reales.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+VOCAB = (
+    "the of and to in is for on that with as by at from it this be are was or an not which have has "
+    "data model cache token request server latency memory prefix system user answer question context "
+    "time value number result table list file code test build run node cluster region stream batch"
+).split()
+
+
+# =============================
+# Carga de trabajo
+# =============================
+def words(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(VOCAB) for _ in range(n))
+
+
+def align(n: int, chunk: int) -> int:
+    return max(chunk, math.ceil(n / chunk) * chunk)
+
+
+class Conversation:
+    """Una o varias vueltas que comparten system prompt; cada vuelta incluye el historial anterior."""
+
+    def __init__(self, cid: int, prefix_id: int, system: str, questions: List[str]):
+        self.cid = cid
+        self.prefix_id = prefix_id
+        self.system = system
+        self.questions = questions
+
+
+def build_workload(args: argparse.Namespace) -> List[Conversation]:
+    rng = random.Random(args.seed)
+    prefix_tokens = align(args.prefix_tokens, args.chunk_size)
+    prefixes = [f"[sistema {i}] " + words(rng, prefix_tokens - 2) for i in range(args.num_prefixes)]
+    turns = args.turns if args.workload == "multi-turn" else 1
+    count = args.sessions if args.workload == "multi-turn" else args.requests
+    conversations = []
+    for cid in range(count):
+        if args.workload == "random":
+            # Sin prefijo compartido: la caché no debería ayudar (línea base)
+            prefix_id, system = -1 - cid, f"[unico {cid}] " + words(rng, prefix_tokens - 2)
+        else:
+            prefix_id = rng.randrange(args.num_prefixes)
+            system = prefixes[prefix_id]
+        questions = [f"[{cid}.{t}] " + words(rng, args.suffix_tokens - 1) for t in range(turns)]
+        conversations.append(Conversation(cid, prefix_id, system, questions))
+    return conversations
+
+
+# =============================
+# Cliente
+# =============================
+async def send(client: httpx.AsyncClient, args: argparse.Namespace, messages: List[Dict[str, str]],
+               t0: Optional[float] = None) -> Dict[str, Any]:
+    """Envía una petición y mide TTFT, gaps entre tokens, latencia y tokens desde `t0` (por defecto, ahora)."""
+    payload: Dict[str, Any] = {"model": args.model, "messages": messages, "max_tokens": args.max_tokens,
+                               "temperature": args.temperature, "stream": args.stream}
+    if args.stream:
+        payload["stream_options"] = {"include_usage": True}
+    if t0 is None:
+        t0 = time.perf_counter()
+    result: Dict[str, Any] = {"ttft": None, "itl": [], "latency": None, "output_tokens": 0,
+                              "prompt_tokens": None, "cached_tokens": None, "text": "", "error": None}
+    try:
+        if not args.stream:
+            r = await client.post("/chat/completions", json=payload)
+            r.raise_for_status()
+            data = r.json()
+            result["latency"] = result["ttft"] = time.perf_counter() - t0
+            result["text"] = data["choices"][0]["message"]["content"] or ""
+            _usage(result, data.get("usage"))
+            return result
+
+        parts: List[str] = []
+        chunks, last = 0, None
+        async with client.stream("POST", "/chat/completions", json=payload) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if event.get("usage"):
+                    _usage(result, event["usage"])
+                content = "".join((c.get("delta") or {}).get("content") or "" for c in event.get("choices") or [])
+                if not content:
+                    continue
+                now = time.perf_counter()
+                if last is None:
+                    result["ttft"] = now - t0
+                else:
+                    result["itl"].append(now - last)
+                last = now
+                chunks += 1
+                parts.append(content)
+        result["latency"] = time.perf_counter() - t0
+        result["text"] = "".join(parts)
+        if not result["output_tokens"]:
+            result["output_tokens"] = chunks  # sin usage: 1 chunk ≈ 1 token
+    except Exception as e:
+        result["latency"] = time.perf_counter() - t0
+        result["error"] = f"{e.__class__.__name__}: {e}"[:300]
+    return result
+
+
+def _usage(result: Dict[str, Any], usage: Optional[Dict[str, Any]]) -> None:
+    if not usage:
+        return
+    result["output_tokens"] = usage.get("completion_tokens") or 0
+    result["prompt_tokens"] = usage.get("prompt_tokens")
+    result["cached_tokens"] = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    conversations = build_workload(args)
+    records: List[Dict[str, Any]] = []
+    seen_prefixes = set()
+    slots = asyncio.Semaphore(args.concurrency)
+    rng = random.Random(args.seed + 1)
+    headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url.rstrip("/"), headers=headers, limits=limits,
+                                 timeout=httpx.Timeout(args.timeout)) as client:
+
+        async def converse(conv: Conversation, scheduled: Optional[float] = None) -> None:
+            messages = [{"role": "system", "content": conv.system}]
+            async with slots:
+                for turn, question in enumerate(conv.questions):
+                    messages.append({"role": "user", "content": question})
+                    # warm: el servidor ya procesó este prefijo (otra conversación terminada o la vuelta anterior)
+                    warm = turn > 0 or conv.prefix_id in seen_prefixes
+                    sent = time.perf_counter()
+                    # Con --rate la primera vuelta se mide desde su llegada programada: la espera por un
+                    # hueco de concurrencia cuenta en TTFT y latencia (sin omisión coordinada)
+                    start = scheduled if scheduled is not None and turn == 0 else sent
+                    res = await send(client, args, messages, start)
+                    res.update(conversation=conv.cid, turn=turn, warm=warm, start=start, queue=sent - start)
+                    records.append(res)
+                    if res["error"]:
+                        return
+                    seen_prefixes.add(conv.prefix_id)
+                    messages.append({"role": "assistant", "content": res.pop("text")})
+                    if args.think_time > 0 and turn + 1 < len(conv.questions):
+                        await asyncio.sleep(args.think_time)
+
+        for conv in conversations[:args.warmup]:
+            await converse(conv)  # calentamiento secuencial, fuera del reporte
+        records.clear()
+
+        t0 = time.perf_counter()
+        tasks = []
+        arrival = t0
+        for conv in conversations[args.warmup:]:
+            if args.rate > 0:
+                await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+            tasks.append(asyncio.create_task(converse(conv, arrival if args.rate > 0 else None)))
+            if args.rate > 0:
+                arrival += rng.expovariate(args.rate)  # llegadas de Poisson, independientes de las respuestas
+        await asyncio.gather(*tasks)
+        duration = time.perf_counter() - t0
+
+    return report(args, records, duration)
+
+
+# =============================
+# Reporte
+# =============================
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    lo, hi = math.floor(pos), math.ceil(pos)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def summary(values: List[float]) -> Dict[str, Optional[float]]:
+    def r(v: Optional[float]) -> Optional[float]:
+        return round(v, 4) if v is not None else None
+
+    return {
+        "count": len(values),
+        "mean": r(sum(values) / len(values)) if values else None,
+        "p50": r(percentile(values, 0.50)),
+        "p95": r(percentile(values, 0.95)),
+        "p99": r(percentile(values, 0.99)),
+        "max": r(max(values)) if values else None,
+    }
+
+
+def group(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    ok = [r for r in records if not r["error"]]
+    prompt = sum(r["prompt_tokens"] or 0 for r in ok)
+    cached = sum(r["cached_tokens"] or 0 for r in ok)
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "ttft_s": summary([r["ttft"] for r in ok if r["ttft"] is not None]),
+        "latency_s": summary([r["latency"] for r in ok]),
+        "queue_s": summary([r["queue"] for r in ok]),
+        "cached_token_ratio": round(cached / prompt, 4) if prompt else None,
+    }
+
+
+def report(args: argparse.Namespace, records: List[Dict[str, Any]], duration: float) -> Dict[str, Any]:
+    ok = [r for r in records if not r["error"]]
+    output_tokens = sum(r["output_tokens"] for r in ok)
+    # Velocidad de decodificación por petición: tokens después del primero / tiempo después del primero
+    decode = [(r["output_tokens"] - 1) / (r["latency"] - r["ttft"])
+              for r in ok if r["ttft"] is not None and r["output_tokens"] > 1 and r["latency"] > r["ttft"]]
+    errors: Dict[str, int] = {}
+    for r in records:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("api_key", "output")},
+        "duration_s": round(duration, 3),
+        **group(records),
+        "throughput": {
+            "requests_per_s": round(len(ok) / duration, 3) if duration else None,
+            "output_tokens_per_s": round(output_tokens / duration, 2) if duration else None,
+            "input_tokens_per_s": round(sum(r["prompt_tokens"] or 0 for r in ok) / duration, 2) if duration else None,
+        },
+        "itl_s": summary([gap for r in ok for gap in r["itl"]]),
+        "decode_tokens_per_s": summary(decode),
+        # cold = primera vez que se ve el prefijo; warm = prefijo ya enviado (debería tener menor TTFT)
+        "cold": group([r for r in records if not r["warm"]]),
+        "warm": group([r for r in records if r["warm"]]),
+        "error_samples": dict(sorted(errors.items(), key=lambda kv: -kv[1])[:5]),
+    }
+
+
+# =============================
+# Servidor simulado embebido
+# =============================
+async def with_mock(args: argparse.Namespace) -> Dict[str, Any]:
+    import uvicorn
+    from mock_server import build_app, parser as mock_parser
+
+    mock_args = mock_parser().parse_args(["--chunk-size", str(args.chunk_size), "--model", args.model])
+    config = uvicorn.Config(build_app(mock_args), host="127.0.0.1", port=args.mock_port, log_level="warning")
+    server = uvicorn.Server(config)
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()  # propaga el error de arranque (p.ej. puerto ocupado)
+        await asyncio.sleep(0.05)
+    args.base_url = f"http://127.0.0.1:{args.mock_port}/v1"
+    try:
+        return await run(args)
+    finally:
+        server.should_exit = True
+        await task
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Generador de carga OpenAI-compatible (TTFT, ITL, tokens/s)")
+    p.add_argument("--base-url", default="http://localhost:8000/v1")
+    p.add_argument("--api-key", default=None)
+    p.add_argument("--model", default="openai/gpt-oss-20b")
+    p.add_argument("--workload", choices=("shared-prefix", "multi-turn", "random"), default="shared-prefix")
+    p.add_argument("--requests", type=int, default=64, help="Peticiones (shared-prefix / random)")
+    p.add_argument("--sessions", type=int, default=16, help="Conversaciones (multi-turn)")
+    p.add_argument("--turns", type=int, default=4, help="Vueltas por conversación (multi-turn)")
+    p.add_argument("--num-prefixes", type=int, default=4, help="System prompts distintos que se comparten")
+    p.add_argument("--prefix-tokens", type=int, default=2048, help="Se redondea al múltiplo de --chunk-size")
+    p.add_argument("--suffix-tokens", type=int, default=64, help="Tokens de cada pregunta del usuario")
+    p.add_argument("--chunk-size", type=int, default=256, help="chunk_size de LMCache (backend_cpu.yaml)")
+    p.add_argument("--max-tokens", type=int, default=128)
+    p.add_argument("--temperature", type=float, default=0.0)
+    p.add_argument("--concurrency", type=int, default=8, help="Conversaciones en curso a la vez")
+    p.add_argument("--rate", type=float, default=0.0, help="Llegadas por segundo (Poisson); 0 = sin espera")
+    p.add_argument("--think-time", type=float, default=0.0, help="Pausa entre vueltas de una conversación (s)")
+    p.add_argument("--warmup", type=int, default=0, help="Conversaciones iniciales que no cuentan en el reporte")
+    p.add_argument("--stream", action=argparse.BooleanOptionalAction, default=True)
+    p.add_argument("--timeout", type=float, default=300.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--mock", action="store_true", help="Arranca mock_server.py embebido y lo usa como destino")
+    p.add_argument("--mock-port", type=int, default=8899)
+    p.add_argument("--output", default=None, help="Guarda el reporte JSON en este archivo")
+    return p
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    result = asyncio.run(with_mock(args) if args.mock else run(args))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    sys.exit(1 if result["errors"] and result["errors"] == result["requests"] else 0)
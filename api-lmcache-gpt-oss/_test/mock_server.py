@@ -0,0 +1,137 @@
+"""
+Servidor OpenAI-compatible simulado (sin GPU ni red) para probar loadgen.py y el gateway.
+
+Imita el coste de vLLM + LMCache: el prompt se trocea en chunks de `--chunk-size` tokens (1 palabra
+≈ 1 token) con hash encadenado como LMCache; los chunks ya vistos cuestan `--cached-ms` por token y
+el resto `--prefill-ms` (prefill). Después genera `max_tokens` tokens a `--itl-ms` cada uno.
+La respuesta incluye `usage.prompt_tokens_details.cached_tokens`, como vLLM.
+
+    python _test/mock_server.py --port 8000
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+class PrefixCache:
+    """LRU de hashes de chunk: devuelve cuántos tokens del prompt ya estaban en caché."""
+
+    def __init__(self, chunk_size: int, max_chunks: int):
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self._chunks: "OrderedDict[str, None]" = OrderedDict()
+
+    def lookup_and_store(self, tokens: List[str]) -> int:
+        cached, prefix_hit, parent = 0, True, ""
+        for start in range(0, len(tokens) - self.chunk_size + 1, self.chunk_size):
+            # Hash encadenado: un chunk solo coincide si todo lo anterior coincide
+            parent = hashlib.sha256((parent + " ".join(tokens[start:start + self.chunk_size])).encode()).hexdigest()
+            if prefix_hit and parent in self._chunks:
+                cached += self.chunk_size
+                self._chunks.move_to_end(parent)
+                continue
+            prefix_hit = False
+            self._chunks[parent] = None
+            if len(self._chunks) > self.max_chunks:
+                self._chunks.popitem(last=False)
+        return cached
+
+
+def prompt_tokens(messages: List[Dict[str, Any]]) -> List[str]:
+    tokens: List[str] = []
+    for m in messages:
+        tokens.append(f"<{m.get('role', 'user')}>")
+        tokens.extend(str(m.get("content") or "").split())
+    return tokens
+
+
+def build_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI()
+    cache = PrefixCache(args.chunk_size, args.cache_chunks)
+    slots = asyncio.Semaphore(args.max_concurrency)
+    stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": args.model, "object": "model", "owned_by": "mock"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {**stats, "hit_rate": round(stats["cached_tokens"] / max(1, stats["prompt_tokens"]), 4)}
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        tokens = prompt_tokens(body.get("messages") or [])
+        n_out = int(body.get("max_tokens") or args.default_max_tokens)
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "created": int(time.time()), "model": body.get("model") or args.model}
+
+        async with slots:
+            cached = cache.lookup_and_store(tokens)
+            stats["requests"] += 1
+            stats["prompt_tokens"] += len(tokens)
+            stats["cached_tokens"] += cached
+            await asyncio.sleep((cached * args.cached_ms + (len(tokens) - cached) * args.prefill_ms) / 1000)
+        usage = {
+            "prompt_tokens": len(tokens),
+            "completion_tokens": n_out,
+            "total_tokens": len(tokens) + n_out,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        words = [f"tok{i % 100}" for i in range(n_out)]
+
+        if not body.get("stream"):
+            await asyncio.sleep(n_out * args.itl_ms / 1000)
+            return {
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "length"}],
+                "usage": usage,
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def events():
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(args.itl_ms / 1000)
+                delta = {"content": (" " if i else "") + word}
+                chunk = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            end = {**base, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "length"}]}
+            yield f"data: {json.dumps(end)}\n\n"
+            if include_usage:
+                yield f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Servidor OpenAI-compatible simulado con caché de prefijos")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--model", default="openai/gpt-oss-20b")
+    p.add_argument("--chunk-size", type=int, default=256, help="Igual que chunk_size en backend_cpu.yaml")
+    p.add_argument("--cache-chunks", type=int, default=4096, help="Chunks que caben en la caché (LRU)")
+    p.add_argument("--prefill-ms", type=float, default=0.2, help="Coste de prefill por token no cacheado (ms)")
+    p.add_argument("--cached-ms", type=float, default=0.01, help="Coste por token recuperado de la caché (ms)")
+    p.add_argument("--itl-ms", type=float, default=10.0, help="Tiempo entre tokens generados (ms)")
+    p.add_argument("--max-concurrency", type=int, default=64, help="Prefills simultáneos")
+    p.add_argument("--default-max-tokens", type=int, default=64)
+    return p
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    uvicorn.run(build_app(args), host=args.host, port=args.port, log_level="warning")
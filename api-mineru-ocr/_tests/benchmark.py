@@ -0,0 +1,285 @@
+"""Benchmark reproducible del servicio OCR.
+
+Levanta la app FastAPI en el mismo proceso (uvicorn en un hilo) con un MinerU simulado de
+latencia y memoria configurables, de modo que corre sin GPU ni modelos. Genera PDFs sintéticos
+de N páginas, recorre combinaciones de `vram_limit` / `concurrency` / `per_worker_mb` y
+clientes concurrentes, y reporta p50/p95/p99, páginas/s y RSS pico en JSON.
+
+Ejemplos (desde api-mineru-ocr/):
+    python _tests/benchmark.py --pages 4,16 --concurrency 2,5 --clients 1,4 -o _tests/result/bench.json
+    python _tests/benchmark.py --baseline _tests/result/bench.json --max-regression 0.15
+    python _tests/benchmark.py --url http://localhost:8001 --pages 8   # servicio real (MinerU real)
+"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Optional
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _ints(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _optional_ints(value: str) -> list[Optional[int]]:
+    return [None if v.strip() in ("", "none") else int(v) for v in value.split(",")]
+
+
+# ---------- PDFs sintéticos ----------
+def make_pdf(pages: int, lines_per_page: int = 40) -> bytes:
+    """PDF mínimo con texto por página (Helvetica), sin dependencias externas."""
+    objs: list[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids: list[str] = []
+    for p in range(1, pages + 1):
+        text = "".join(f"0 -14 Td (Pagina {p} linea {i}: lorem ipsum dolor sit amet 0123456789) Tj " for i in range(lines_per_page))
+        stream = f"BT /F1 10 Tf 50 780 Td {text}ET".encode("latin-1")
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objs)
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>".encode())
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+    out = bytearray(b"%PDF-1.4\n"); offsets: list[int] = []
+    for i, body in enumerate(objs, start=1):
+        offsets.append(len(out)); out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for off in offsets: out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return bytes(out)
+
+
+# ---------- MinerU simulado ----------
+def install_stub(latency_ms: float, jitter_ms: float, mem_mb: int) -> None:
+    """Sustituye la ejecución de MinerU por una espera + reserva de memoria + salida sintética.
+
+    La salida imita la de MinerU (markdown con una imagen repetida y `*_content_list.json`),
+    así que anotación, deduplicación de imágenes, lotes y empaquetado se ejercitan de verdad.
+    """
+    from app.ocr import pipeline
+    from app.ocr.mineru_runner import open_pdf, MinerUTimeout
+    image = bytes(range(256)) * 64  # misma "imagen" en todas las páginas (logo)
+
+    async def fake_run_mineru_page(pdf: Path, out_dir: Path, vram_limit: int, timeout: Optional[float] = None):
+        reader = await asyncio.to_thread(open_pdf, pdf)
+        n_pages = len(reader.pages) if reader is not None else 1
+        ballast = b"\x01" * (mem_mb * 1024 * 1024)  # memoria residente mientras "procesa"
+        delay = max(0.0, (latency_ms + random.uniform(-jitter_ms, jitter_ms)) * n_pages / 1000)
+        try:
+            await asyncio.wait_for(asyncio.sleep(delay), timeout)
+        except asyncio.TimeoutError:
+            raise MinerUTimeout(f"MinerU simulado superó {timeout}s") from None
+        finally:
+            del ballast
+        doc_dir = out_dir / pdf.stem / "ocr"; (doc_dir / "images").mkdir(parents=True, exist_ok=True)
+        (doc_dir / "images" / "logo.jpg").write_bytes(image)
+        items = [{"type": "text", "text": f"Texto simulado de la página {i + 1}.", "page_idx": i} for i in range(n_pages)]
+        items += [{"type": "image", "img_path": "images/logo.jpg", "page_idx": i} for i in range(n_pages)]
+        (doc_dir / f"{pdf.stem}_content_list.json").write_text(json.dumps(items), "utf-8")
+        (doc_dir / f"{pdf.stem}.md").write_text("\n\n".join("Texto simulado.\n\n![](images/logo.jpg)" for _ in range(n_pages)), "utf-8")
+        return None, None
+
+    pipeline.run_mineru_page = fake_run_mineru_page
+
+
+# ---------- servidor en proceso ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); return s.getsockname()[1]
+
+
+def start_local_server(args: argparse.Namespace) -> str:
+    tmp = Path(tempfile.mkdtemp(prefix="ocr_bench_"))
+    # Entorno aislado y determinista; las variables ya definidas por el usuario tienen prioridad
+    defaults = {
+        "MINERU_MODE": "subprocess",  # sin pool: el stub reemplaza la ejecución
+        "MINERU_VRAM_BUDGET_MB": str(args.vram_budget_mb),
+        "OCR_CACHE_ENABLED": "false",
+        "OCR_TEXT_LAYER_ENABLED": "false",  # los PDFs sintéticos tienen texto: forzar el camino MinerU
+        "OCR_JOBS_DIR": str(tmp / "jobs"),
+    }
+    for k, v in defaults.items(): os.environ.setdefault(k, v)
+    sys.path.insert(0, str(ROOT))
+    import uvicorn
+    from app.factory import create_app
+    install_stub(args.stub_latency_ms, args.stub_jitter_ms, args.stub_mem_mb)
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True, name="bench-uvicorn").start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline: raise RuntimeError("El servidor de benchmark no arrancó")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+# ---------- medición ----------
+class RSSSampler:
+    """RSS pico del proceso (servidor en proceso) y sus hijos, muestreado cada `interval` s."""
+
+    def __init__(self, interval: float = 0.05):
+        import psutil
+        self._proc = psutil.Process(os.getpid())
+        self._interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _rss(self) -> int:
+        total = self._proc.memory_info().rss
+        for child in self._proc.children(recursive=True):
+            try: total += child.memory_info().rss
+            except Exception: pass
+        return total
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss()); self._stop.wait(self._interval)
+
+    def __enter__(self) -> "RSSSampler":
+        self._thread.start(); return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set(); self._thread.join()
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    if not values: return None
+    s = sorted(values); k = (len(s) - 1) * q
+    lo = int(k); hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def run_scenario(url: str, pdf: bytes, pages: int, params: dict[str, Any], clients: int, requests_per_client: int, timeout: float, measure_rss: bool) -> dict[str, Any]:
+    import requests
+    data = {k: str(v) for k, v in params.items() if v is not None}
+
+    def one(_: int) -> tuple[float, Optional[str]]:
+        t0 = time.perf_counter()
+        try:
+            r = requests.post(f"{url}/ocr", files={"file": ("bench.pdf", pdf, "application/pdf")}, data=data, timeout=timeout)
+            _ = r.content
+            err = None if r.status_code == 200 else f"HTTP {r.status_code}: {r.text[:200]}"
+        except Exception as e:
+            err = str(e) or e.__class__.__name__
+        return time.perf_counter() - t0, err
+
+    total = clients * requests_per_client
+    sampler = RSSSampler() if measure_rss else None
+    t0 = time.perf_counter()
+    if sampler: sampler.__enter__()
+    try:
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            results = list(pool.map(one, range(total)))
+    finally:
+        if sampler: sampler.__exit__(None, None, None)
+    wall = time.perf_counter() - t0
+    ok = [lat for lat, err in results if err is None]
+    errors = [err for _, err in results if err is not None]
+    return {
+        "pages": pages, **params, "clients": clients, "requests": total,
+        "errors": len(errors), "first_error": errors[0] if errors else None,
+        "wall_s": round(wall, 3),
+        "latency_s": {
+            "p50": percentile(ok, 0.50), "p95": percentile(ok, 0.95), "p99": percentile(ok, 0.99),
+            "mean": sum(ok) / len(ok) if ok else None, "max": max(ok) if ok else None,
+        },
+        "pages_per_s": round(pages * len(ok) / wall, 3) if wall > 0 else None,
+        "peak_rss_mb": round(sampler.peak / 1024 / 1024, 1) if sampler else None,
+    }
+
+
+def scenario_key(s: dict[str, Any]) -> tuple:
+    return (s["pages"], s.get("vram_limit"), s.get("concurrency"), s.get("per_worker_mb"), s.get("output_format"), s["clients"])
+
+
+def compare(current: list[dict[str, Any]], baseline: list[dict[str, Any]], max_regression: float) -> list[str]:
+    """Escenarios cuyo p95 subió o cuyo throughput bajó más de `max_regression` (fracción)."""
+    base = {scenario_key(s): s for s in baseline}
+    failures: list[str] = []
+    for s in current:
+        b = base.get(scenario_key(s))
+        if b is None: continue
+        p95, b95 = s["latency_s"]["p95"], b["latency_s"]["p95"]
+        if p95 is not None and b95 and p95 > b95 * (1 + max_regression):
+            failures.append(f"{scenario_key(s)}: p95 {b95:.3f}s -> {p95:.3f}s")
+        pps, bpps = s["pages_per_s"], b["pages_per_s"]
+        if pps is not None and bpps and pps < bpps * (1 - max_regression):
+            failures.append(f"{scenario_key(s)}: páginas/s {bpps:.2f} -> {pps:.2f}")
+    return failures
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark del servicio MinerU OCR")
+    ap.add_argument("--url", help="Servicio ya desplegado (sin stub); por defecto se levanta la app en proceso")
+    ap.add_argument("--pages", type=_ints, default=[4, 16], help="Páginas por PDF sintético (lista)")
+    ap.add_argument("--vram-limit", type=_ints, default=[4096])
+    ap.add_argument("--concurrency", type=_ints, default=[2, 5])
+    ap.add_argument("--per-worker-mb", type=_optional_ints, default=[None], help="Lista; 'none' = valor del servidor")
+    ap.add_argument("--clients", type=_ints, default=[1, 4], help="Clientes concurrentes (lista)")
+    ap.add_argument("--requests-per-client", type=int, default=3)
+    ap.add_argument("--output-format", default="zip", choices=["zip", "zip-stream", "tar", "json"])
+    ap.add_argument("--warmup", type=int, default=1, help="Requests descartadas antes de medir")
+    ap.add_argument("--timeout", type=float, default=600)
+    ap.add_argument("--vram-budget-mb", type=int, default=8192, help="Presupuesto global de VRAM del servidor en proceso")
+    ap.add_argument("--stub-latency-ms", type=float, default=200, help="Latencia simulada de MinerU por página")
+    ap.add_argument("--stub-jitter-ms", type=float, default=20)
+    ap.add_argument("--stub-mem-mb", type=int, default=32, help="Memoria reservada por invocación simulada")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("-o", "--output", type=Path, help="Archivo JSON de resultados (por defecto stdout)")
+    ap.add_argument("--baseline", type=Path, help="JSON previo contra el que detectar regresiones")
+    ap.add_argument("--max-regression", type=float, default=0.2)
+    args = ap.parse_args(argv)
+
+    random.seed(args.seed)
+    in_process = args.url is None
+    url = start_local_server(args) if in_process else args.url.rstrip("/")
+    pdfs = {n: make_pdf(n) for n in args.pages}
+
+    scenarios: list[dict[str, Any]] = []
+    for pages, vram, conc, pw, clients in itertools.product(args.pages, args.vram_limit, args.concurrency, args.per_worker_mb, args.clients):
+        params = {"vram_limit": vram, "concurrency": conc, "per_worker_mb": pw, "output_format": args.output_format}
+        if args.warmup:
+            run_scenario(url, pdfs[pages], pages, params, 1, args.warmup, args.timeout, False)
+        result = run_scenario(url, pdfs[pages], pages, params, clients, args.requests_per_client, args.timeout, in_process)
+        print(f"pages={pages} vram={vram} conc={conc} per_worker={pw} clients={clients}: "
+              f"p50={result['latency_s']['p50']} p95={result['latency_s']['p95']} páginas/s={result['pages_per_s']} "
+              f"errores={result['errors']}", file=sys.stderr)
+        scenarios.append(result)
+
+    report = {
+        "meta": {
+            "url": None if in_process else url,
+            "stub": {"latency_ms": args.stub_latency_ms, "jitter_ms": args.stub_jitter_ms, "mem_mb": args.stub_mem_mb} if in_process else None,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        },
+        "scenarios": scenarios,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True); args.output.write_text(text, "utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        failures = compare(scenarios, json.loads(args.baseline.read_text("utf-8"))["scenarios"], args.max_regression)
+        for f in failures: print(f"REGRESIÓN {f}", file=sys.stderr)
+        if failures: return 1
+    return 1 if any(s["errors"] for s in scenarios) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""Comprobación de `/ocr/stream` con caché de documento.
+
+Envía dos veces el mismo PDF sintético a `/ocr/stream` (app en proceso con el MinerU simulado de
+benchmark.py): la segunda petición acierta en la caché de documento y debe emitir igualmente un
+evento `page` por página (ruta `cache`) y reportar `pages_total` en el trabajo.
+
+Ejemplo (desde api-mineru-ocr/):
+    python _tests/check_stream_cache.py --pages 3
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmark import make_pdf, start_local_server
+
+
+def stream_pages(url: str, pdf: bytes) -> tuple[list[dict], dict]:
+    import requests
+    data = {"vram_limit": "4096", "concurrency": "2"}
+    r = requests.post(f"{url}/ocr/stream", files={"file": ("check.pdf", pdf, "application/pdf")}, data=data, stream=True, timeout=120)
+    r.raise_for_status()
+    events = [json.loads(line) for line in r.iter_lines() if line]
+    job = requests.get(events[0]["status_url"], timeout=30).json()
+    return events, job
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Eventos por página de /ocr/stream con acierto de caché de documento")
+    ap.add_argument("--pages", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    tmp = Path(tempfile.mkdtemp(prefix="ocr_check_"))
+    os.environ.setdefault("OCR_CACHE_ENABLED", "true")
+    os.environ.setdefault("OCR_CACHE_DIR", str(tmp / "cache"))
+    url = start_local_server(argparse.Namespace(vram_budget_mb=8192, stub_latency_ms=50, stub_jitter_ms=0, stub_mem_mb=1))
+    pdf = make_pdf(args.pages)
+
+    failures: list[str] = []
+    first_md: dict[int, str] = {}
+    for attempt in ("primera", "segunda"):
+        events, job = stream_pages(url, pdf)
+        pages = [e for e in events if e["type"] == "page"]
+        done = events[-1]
+        routes = sorted({e["route"] for e in pages})
+        print(f"{attempt}: eventos page={len(pages)} rutas={routes} done.pages={done.get('pages')} pages_total={job['pages_total']}", file=sys.stderr)
+        if len(pages) != args.pages or done.get("pages") != args.pages or job["pages_total"] != args.pages:
+            failures.append(f"{attempt} petición: se esperaban {args.pages} páginas")
+        if sorted(e["page"] for e in pages) != list(range(1, args.pages + 1)):
+            failures.append(f"{attempt} petición: números de página incorrectos")
+        markdown = {e["page"]: e["markdown"] for e in pages}
+        if attempt == "primera":
+            first_md = markdown
+        elif routes != ["cache"]:
+            failures.append("segunda petición: no acertó en la caché de documento")
+        elif markdown != first_md:
+            failures.append("segunda petición: el markdown por página difiere del de la primera")
+    for f in failures: print(f"FALLO {f}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
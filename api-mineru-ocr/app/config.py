@@ -11,11 +11,58 @@ class Settings(BaseSettings):
     GPU_DEVICE: str = "cuda"
     GPU_BACKEND: str = "pipeline"
 
+    # Servidor: procesos uvicorn por nodo (>1 = métricas agregadas y VRAM coordinada entre procesos)
+    OCR_PROCESS_WORKERS: int = 1
+    OCR_RUNTIME_DIR: str = "/tmp/mineru_ocr"  # métricas multi-proceso y libro compartido de VRAM
+
     # Concurrencia
     MINERU_VRAM_PER_WORKER_MB: int = 768
+    MINERU_VRAM_BUDGET_MB: int = 8192      # VRAM total del nodo reservada para MinerU
+
+    # Ejecución de MinerU: "pool" (workers residentes) o "subprocess" (CLI por página)
+    MINERU_MODE: str = "pool"
+    MINERU_POOL_CPU_WORKERS: int = 2       # tamaño del pool cuando GPU_ENABLED=False
+    MINERU_POOL_START_TIMEOUT_S: int = 600 # espera máxima a que un worker cargue modelos
+    MINERU_LANG: str = "latin"
+    MINERU_PAGE_TIMEOUT_S: int = 300       # tiempo máximo por página (0 = sin límite); se mata el proceso
+
+    # Lotes adaptativos: varias páginas por invocación de MinerU
+    MINERU_BATCH_ENABLED: bool = False
+    MINERU_BATCH_MAX_PAGES: int = 16
+    MINERU_BATCH_VRAM_PER_PAGE_MB: int = 96  # tope de páginas por lote = VRAM por worker / este valor
+    MINERU_BATCH_OVERHEAD_TARGET: float = 0.1  # fracción máxima de tiempo en overhead por invocación
+
+    # Atajo por capa de texto: páginas nativas digitales se extraen sin OCR
+    OCR_TEXT_LAYER_ENABLED: bool = True
+    OCR_TEXT_LAYER_THRESHOLD: float = 0.85  # score mínimo (0-1) para omitir MinerU
+    OCR_TEXT_LAYER_MIN_CHARS: int = 200     # caracteres con los que la densidad de texto satura
+
+    # Caché de resultados OCR (por página y por documento)
+    OCR_CACHE_ENABLED: bool = True
+    OCR_CACHE_DIR: str = "/tmp/mineru_ocr/cache"  # docker-compose lo monta en /cache/ocr
+    OCR_CACHE_MAX_MB: int = 10240
+
+    # Trabajos OCR asíncronos (/ocr/jobs)
+    OCR_JOBS_DIR: str = "/tmp/mineru_ocr/jobs"  # docker-compose lo monta en /data/jobs
+    OCR_JOBS_MAX_RUNNING: int = 2       # documentos procesándose a la vez
+    OCR_JOBS_MAX_QUEUED: int = 100      # trabajos en espera antes de responder 429
+    OCR_JOBS_TTL_S: int = 86400         # retención de resultados en disco
+    OCR_STREAM_QUEUE_MAX: int = 256     # eventos pendientes por cliente de /ocr/stream antes de cortarlo
+
+    # Empaquetado del resultado: deflate en paralelo para textos, medios ya comprimidos sin recomprimir
+    OCR_ZIP_WORKERS: int = 4
+    OCR_ZIP_LEVEL: int = 6
+
+    # Cancelación: intervalo de sondeo de desconexión del cliente en /ocr
+    OCR_DISCONNECT_POLL_S: float = 1.0
 
     # Métricas
     METRICS_ENABLED: bool = True
+    # Telemetría de hardware: auto (NVML si GPU_ENABLED, si no CPU) | nvml | cpu | fake
+    TELEMETRY_PROVIDER: str = "auto"
+    TELEMETRY_CACHE_TTL_S: float = 2.0   # muestras reutilizadas entre scrapes cercanos
+    TELEMETRY_FAKE_GPUS: int = 1
+    TELEMETRY_FAKE_GPU_MB: int = 16384
 
 @lru_cache()
 def get_settings() -> Settings:
@@ -1,25 +1,45 @@
 from __future__ import annotations
 import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Response
 from .config import get_settings
-from .metrics import start_metrics_collector, get_metrics_latest, get_metrics_content_type, init_metric_series
+from .metrics import mark_process_dead, get_metrics_latest, get_metrics_content_type, init_metric_series, get_recent_documents
 from .ocr.endpoints import router as ocr_router
+from .ocr.worker_pool import start_worker_pool, stop_worker_pool
+from .ocr.jobs import start_job_manager, stop_job_manager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers MinerU residentes: los modelos se cargan una vez al arrancar
+    await start_worker_pool(get_settings())
+    start_job_manager(get_settings())
+    try:
+        yield
+    finally:
+        await stop_job_manager()
+        await stop_worker_pool()
+        mark_process_dead()
 
 
 def create_app() -> FastAPI:
     settings = get_settings()
-    app = FastAPI(title="MinerU OCR Service", version="2.2.0-prom")
+    app = FastAPI(title="MinerU OCR Service", version="2.2.0-prom", lifespan=lifespan)
     app.include_router(ocr_router)
 
     if settings.METRICS_ENABLED:
-        start_metrics_collector()
-        init_metric_series()
+        init_metric_series()  # CPU/RAM/GPU se muestrean en cada scrape, sin hilo de sondeo
 
         @app.get("/metrics")
         async def metrics():
             data = await asyncio.to_thread(get_metrics_latest)
             return Response(content=data, media_type=get_metrics_content_type())
 
+        @app.get("/metrics/documents")
+        async def metrics_documents():
+            # Últimos documentos procesados (más reciente primero), para la tabla de Grafana
+            return get_recent_documents()
+
     @app.get("/health")
     async def health():
         return {"status": "healthy"}
@@ -1,87 +1,228 @@
 from __future__ import annotations
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Iterator
+import datetime
+import glob
+import json
+import logging
+import os
 import time
 import threading
 import psutil
-from prometheus_client import Counter, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from .config import get_settings
+from .telemetry import get_telemetry
 
-# Asumimos GPU siempre disponible (simplifica la lógica y evita ramas muertas)
-import pynvml  # type: ignore
-pynvml.nvmlInit()
+logger = logging.getLogger(__name__)
+
+# Modo multi-proceso (OCR_PROCESS_WORKERS > 1): main.py define PROMETHEUS_MULTIPROC_DIR antes de
+# importar prometheus_client; cada worker escribe sus valores en disco y /metrics los agrega.
+# `multiprocess_mode` de cada Gauge indica cómo combinar los procesos (se ignora en modo simple).
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
 
 # =============================
 # Métricas expuestas (Grafana)
 # =============================
 
 # Sistema
-SYS_CPU = Gauge("system_cpu_usage_percent", "CPU %")
-SYS_RAM = Gauge("system_ram_usage_percent", "RAM %")
+SYS_CPU = Gauge("system_cpu_usage_percent", "CPU %", multiprocess_mode="mostrecent")
+SYS_RAM = Gauge("system_ram_usage_percent", "RAM %", multiprocess_mode="mostrecent")
 
 # GPU (por índice)
-GPU_USED = Gauge("gpu_memory_used_bytes", "GPU mem used (bytes)", ["index"])
-GPU_TOTAL = Gauge("gpu_memory_total_bytes", "GPU mem total (bytes)", ["index"])
-GPU_USED_PCT = Gauge("gpu_memory_used_percent", "GPU mem usada %", ["index"])
+GPU_USED = Gauge("gpu_memory_used_bytes", "GPU mem used (bytes)", ["index"], multiprocess_mode="mostrecent")
+GPU_TOTAL = Gauge("gpu_memory_total_bytes", "GPU mem total (bytes)", ["index"], multiprocess_mode="mostrecent")
+GPU_USED_PCT = Gauge("gpu_memory_used_percent", "GPU mem usada %", ["index"], multiprocess_mode="mostrecent")
+# VRAM real por proceso (worker = mineru-worker-N | mineru-cli | api | other), para calibrar MINERU_VRAM_PER_WORKER_MB
+GPU_PROC_USED = Gauge("gpu_process_memory_used_bytes", "GPU mem usada por proceso (bytes)", ["index", "worker"], multiprocess_mode="mostrecent")
+GPU_PROC_PEAK = Gauge("gpu_process_memory_peak_bytes", "Pico de GPU mem observado por proceso desde el arranque (bytes)", ["worker"], multiprocess_mode="max")
 
 # OCR flujo
-OCR_INFLIGHT = Gauge("ocr_inflight_requests", "Requests en proceso")
-PAGES_ACTIVE = Gauge("ocr_pages_in_progress", "Páginas en procesamiento")
+OCR_INFLIGHT = Gauge("ocr_inflight_requests", "Requests en proceso", multiprocess_mode="livesum")
+PAGES_ACTIVE = Gauge("ocr_pages_in_progress", "Páginas en procesamiento", multiprocess_mode="livesum")
 BYTES_UP = Counter("ocr_bytes_uploaded_total", "Bytes subidos")
 
-# Último documento procesado (valor = duración en segundos)
-DOC_LAST = Gauge(
-    "ocr_last_document_seconds",
-    "Duración del último documento (s)",
-    ["name", "pages", "processed_at", "vram", "concurrency"],
+# Trabajos OCR asíncronos
+JOBS_QUEUED = Gauge("ocr_jobs_queued", "Trabajos OCR en cola", multiprocess_mode="livesum")
+JOBS_RUNNING = Gauge("ocr_jobs_running", "Trabajos OCR en ejecución", multiprocess_mode="livesum")
+
+# Ruta de cada página (route = text | cache | ocr | timeout)
+PAGES_ROUTED = Counter("ocr_pages_routed_total", "Páginas por ruta de procesamiento", ["route"])
+
+# Caché OCR (level = page | document)
+OCR_CACHE_HITS = Counter("ocr_cache_hits_total", "Aciertos de caché OCR", ["level"])
+OCR_CACHE_MISSES = Counter("ocr_cache_misses_total", "Fallos de caché OCR", ["level"])
+OCR_CACHE_BYTES = Gauge("ocr_cache_size_bytes", "Tamaño ocupado por la caché OCR (bytes)", multiprocess_mode="max")
+
+# Planificador global de VRAM (compartido por todas las requests)
+SCHED_QUEUE_DEPTH = Gauge("ocr_scheduler_queue_depth", "Páginas esperando reserva de VRAM", multiprocess_mode="livesum")
+SCHED_VRAM_RESERVED = Gauge("ocr_scheduler_vram_reserved_mb", "VRAM reservada por páginas en ejecución (MB)", multiprocess_mode="livesum")
+SCHED_WAIT_SECONDS = Histogram(
+    "ocr_scheduler_wait_seconds",
+    "Espera de una página hasta obtener VRAM (s)",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
 )
 
-
-def start_metrics_collector() -> None:
-    t = threading.Thread(target=_loop, daemon=True)
-    t.start()
+# Latencia por etapa (stage = upload | split | mineru_page | annotate | zip) y por documento
+STAGES = ("upload", "split", "mineru_page", "annotate", "zip")
+STAGE_SECONDS = Histogram(
+    "ocr_stage_duration_seconds",
+    "Duración de cada etapa del pipeline OCR (s); split/mineru_page/annotate por página",
+    ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+DOC_SECONDS = Histogram(
+    "ocr_document_duration_seconds",
+    "Duración total por documento (s)",
+    ["status"],
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600),
+)
+PAGES_DONE = Counter("ocr_pages_processed_total", "Páginas procesadas (cualquier ruta)")
+BYTES_OUT = Counter("ocr_bytes_returned_total", "Bytes de resultados devueltos")
+
+# Tabla de documentos recientes: buffer circular en memoria (servido en /metrics/documents),
+# en lugar de una serie Prometheus por documento con cardinalidad sin límite.
+# En modo multi-proceso cada worker vuelca su buffer a `recent_<pid>.json` y se combinan al leer.
+RECENT_DOCS: deque[dict[str, Any]] = deque(maxlen=200)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - t0)
+
+
+def record_document(name: str, pages: int, duration: float, status: str, **extra: Any) -> None:
+    DOC_SECONDS.labels(status=status).observe(duration)
+    RECENT_DOCS.appendleft({
+        "name": name,
+        "pages": pages,
+        "duration_s": round(duration, 3),
+        "status": status,
+        "processed_at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        **extra,
+    })
+    if MULTIPROC_DIR:
+        path = os.path.join(MULTIPROC_DIR, f"recent_{os.getpid()}.json")
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f: json.dump(list(RECENT_DOCS), f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            logger.warning("No se pudo guardar la tabla de documentos recientes", exc_info=True)
+
+
+def get_recent_documents() -> list[dict[str, Any]]:
+    if not MULTIPROC_DIR:
+        return list(RECENT_DOCS)
+    docs: list[dict[str, Any]] = []
+    for path in glob.glob(os.path.join(MULTIPROC_DIR, "recent_*.json")):
+        try:
+            with open(path, encoding="utf-8") as f: docs.extend(json.load(f))
+        except (OSError, ValueError):
+            continue
+    docs.sort(key=lambda d: d.get("processed_at", ""), reverse=True)
+    return docs[:RECENT_DOCS.maxlen]
+
+
+# Procesos conocidos (pid -> nombre), registrados por el pool de workers MinerU
+_processes: dict[int, str] = {}
+_sample_lock = threading.Lock()
+_last_sample = 0.0
+_proc_peaks: dict[str, float] = {}
+_proc_series: set[tuple[str, str]] = set()
+
+
+def register_process(pid: int, name: str) -> None:
+    _processes[pid] = name
+
+
+def unregister_process(pid: int) -> None:
+    _processes.pop(pid, None)
+
+
+def _process_name(pid: int, children: set[int]) -> str:
+    if pid in _processes: return _processes[pid]
+    if pid == os.getpid(): return "api"
+    return "mineru-cli" if pid in children else "other"
+
+
+def refresh_hardware_metrics(force: bool = False) -> None:
+    """Muestrea CPU/RAM/GPU bajo demanda (en cada scrape), con caché de `TELEMETRY_CACHE_TTL_S`."""
+    global _last_sample
+    with _sample_lock:
+        now = time.monotonic()
+        if not force and now - _last_sample < get_settings().TELEMETRY_CACHE_TTL_S: return
+        _last_sample = now
+        provider = get_telemetry()
+        try:
+            SYS_CPU.set(provider.cpu_percent())
+            SYS_RAM.set(provider.ram_percent())
+            # GPU por índice – porcentaje preciso usado/total
+            for g in provider.gpus():
+                idx = str(g.index)
+                GPU_USED.labels(index=idx).set(g.used_bytes)
+                GPU_TOTAL.labels(index=idx).set(g.total_bytes)
+                GPU_USED_PCT.labels(index=idx).set((g.used_bytes / g.total_bytes) * 100.0 if g.total_bytes > 0 else 0.0)
+            procs = provider.gpu_processes()
+        except Exception:
+            logger.warning("Fallo al muestrear telemetría (%s)", provider.name, exc_info=True)
+            return
+        children = {c.pid for c in psutil.Process().children(recursive=True)} if procs else set()
+        usage: dict[tuple[str, str], float] = {}
+        for p in procs:
+            key = (str(p.index), _process_name(p.pid, children))
+            usage[key] = usage.get(key, 0.0) + p.used_bytes
+        # Los procesos que ya no usan GPU quedan a 0 (clear() no alcanza a los valores en disco del modo multi-proceso)
+        for key in _proc_series - usage.keys():
+            GPU_PROC_USED.labels(index=key[0], worker=key[1]).set(0)
+        for (idx, worker), used in usage.items():
+            GPU_PROC_USED.labels(index=idx, worker=worker).set(used)
+        _proc_series.update(usage.keys())
+        for (_, worker), used in usage.items():
+            if used > _proc_peaks.get(worker, 0.0):
+                _proc_peaks[worker] = used; GPU_PROC_PEAK.labels(worker=worker).set(used)
 
 
 def init_metric_series() -> None:
     # Inicializa series para evitar "No data" en Grafana
     BYTES_UP.inc(0)
+    BYTES_OUT.inc(0)
+    PAGES_DONE.inc(0)
+    for stage in STAGES:
+        STAGE_SECONDS.labels(stage=stage)
     OCR_INFLIGHT.set(0)
     PAGES_ACTIVE.set(0)
+    JOBS_QUEUED.set(0)
+    JOBS_RUNNING.set(0)
+    SCHED_QUEUE_DEPTH.set(0)
+    SCHED_VRAM_RESERVED.set(0)
+    for route in ("text", "cache", "ocr", "timeout"):
+        PAGES_ROUTED.labels(route=route).inc(0)
+    for level in ("page", "document"):
+        OCR_CACHE_HITS.labels(level=level).inc(0)
+        OCR_CACHE_MISSES.labels(level=level).inc(0)
 
-    # Inicializa métricas por GPU
-    count = pynvml.nvmlDeviceGetCount()
-    for i in range(count):
-        idx = str(i)
-        h = pynvml.nvmlDeviceGetHandleByIndex(i)
-        m = pynvml.nvmlDeviceGetMemoryInfo(h)
-        GPU_USED.labels(index=idx).set(0)
-        GPU_TOTAL.labels(index=idx).set(m.total)
-        GPU_USED_PCT.labels(index=idx).set(0)
+    # Primera muestra: crea las series por GPU
+    refresh_hardware_metrics(force=True)
 
 
 def get_metrics_latest() -> bytes:
+    refresh_hardware_metrics()
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)  # agrega los valores de todos los workers
+        return generate_latest(registry)
     return generate_latest()
 
 
-def get_metrics_content_type() -> str:
-    return CONTENT_TYPE_LATEST
+def mark_process_dead() -> None:
+    """Al apagar un worker: sus gauges `livesum` dejan de sumar en el agregado."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
 
 
-def _loop() -> None:
-    while True:
-        # CPU / RAM
-        cpu_pct = psutil.cpu_percent(interval=None)
-        ram_pct = psutil.virtual_memory().percent
-        SYS_CPU.set(cpu_pct)
-        SYS_RAM.set(ram_pct)
-
-        # GPU por índice – porcentaje preciso usado/total
-        count = pynvml.nvmlDeviceGetCount()
-        for i in range(count):
-            idx = str(i)
-            h = pynvml.nvmlDeviceGetHandleByIndex(i)
-            m = pynvml.nvmlDeviceGetMemoryInfo(h)
-            used = float(m.used)
-            total = float(m.total) if m.total else 0.0
-            GPU_USED.labels(index=idx).set(used)
-            GPU_TOTAL.labels(index=idx).set(total)
-            GPU_USED_PCT.labels(index=idx).set((used / total) * 100.0 if total > 0 else 0.0)
-
-        time.sleep(5)
+def get_metrics_content_type() -> str:
+    return CONTENT_TYPE_LATEST
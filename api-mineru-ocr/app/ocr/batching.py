@@ -0,0 +1,114 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+import asyncio
+import math
+from ..config import get_settings
+
+# Ejecuta un lote de páginas [(pnum, pdf)] y devuelve {pnum: markdown anotado}
+RunChunk = Callable[[list[tuple[int, Path]]], Awaitable[dict[int, str]]]
+
+
+class AdaptiveChunkSizer:
+    """Dimensiona los lotes de páginas a partir de la latencia observada de MinerU.
+
+    Modela cada invocación como `t(n) = overhead + n * por_página` y ajusta ambos términos por
+    mínimos cuadrados con decaimiento exponencial (las observaciones recientes pesan más).
+    El lote se elige para que el overhead fijo no supere `overhead_target` del tiempo útil.
+    """
+
+    def __init__(self, max_pages: int, overhead_target: float, default_overhead_s: float, default_per_page_s: float = 1.0, decay: float = 0.9):
+        self.max_pages = max(1, max_pages)
+        self.overhead_target = overhead_target
+        self.default_overhead_s = default_overhead_s
+        self.default_per_page_s = default_per_page_s
+        self.decay = decay
+        self._s0 = self._sx = self._sy = self._sxx = self._sxy = 0.0
+
+    def observe(self, pages: int, seconds: float) -> None:
+        d = self.decay
+        self._s0 = d * self._s0 + 1
+        self._sx = d * self._sx + pages
+        self._sy = d * self._sy + seconds
+        self._sxx = d * self._sxx + pages * pages
+        self._sxy = d * self._sxy + pages * seconds
+
+    def estimate(self) -> tuple[float, float]:
+        """Devuelve `(overhead_s, por_página_s)`; valores por defecto sin varianza suficiente en `n`."""
+        den = self._s0 * self._sxx - self._sx * self._sx
+        if self._s0 < 2 or den < 1e-6:
+            return self.default_overhead_s, self.default_per_page_s
+        per_page = (self._s0 * self._sxy - self._sx * self._sy) / den
+        overhead = (self._sy - per_page * self._sx) / self._s0
+        return max(overhead, 0.0), max(per_page, 1e-3)
+
+    def size(self, cap: Optional[int] = None) -> int:
+        overhead, per_page = self.estimate()
+        n = math.ceil(overhead / (self.overhead_target * per_page)) if overhead > 0 else 1
+        return max(1, min(n, self.max_pages, cap if cap is not None else self.max_pages))
+
+
+class PageBatcher:
+    """Agrupa las páginas de un documento que necesitan MinerU en lotes de `chunk_size`.
+
+    Cada página llama a `submit` (o a `skip` si se resolvió sin MinerU, p.ej. por caché). Un lote
+    se despacha en cuanto se llena; cuando todas las páginas esperadas se han visto, el resto
+    pendiente se despacha aunque el lote quede incompleto.
+    """
+
+    def __init__(self, expected_pages: int, chunk_size: int, run_chunk: RunChunk):
+        self.chunk_size = max(1, chunk_size)
+        self._expected = expected_pages
+        self._seen = 0
+        self._run_chunk = run_chunk
+        self._pending: list[tuple[int, Path, asyncio.Future]] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    def skip(self) -> None:
+        self._seen += 1
+        self._flush()
+
+    async def submit(self, pnum: int, pdf: Path) -> str:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((pnum, pdf, fut)); self._seen += 1
+        self._flush()
+        return await fut
+
+    def cancel(self) -> None:
+        for task in self._tasks: task.cancel()
+
+    def _flush(self) -> None:
+        while len(self._pending) >= self.chunk_size or (self._pending and self._seen >= self._expected):
+            self._pending.sort(key=lambda x: x[0])
+            chunk, self._pending = self._pending[:self.chunk_size], self._pending[self.chunk_size:]
+            task = asyncio.create_task(self._dispatch(chunk))
+            self._tasks.add(task); task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, chunk: list[tuple[int, Path, asyncio.Future]]) -> None:
+        try:
+            results = await self._run_chunk([(pnum, pdf) for pnum, pdf, _ in chunk])
+        except asyncio.CancelledError:
+            for _, _, fut in chunk: fut.cancel()
+            raise
+        except Exception as e:
+            for _, _, fut in chunk:
+                if not fut.done(): fut.set_exception(e)
+            return
+        for pnum, _, fut in chunk:
+            if not fut.done(): fut.set_result(results.get(pnum, ""))
+
+
+_sizer: Optional[AdaptiveChunkSizer] = None
+
+
+def get_chunk_sizer() -> AdaptiveChunkSizer:
+    """Estimador compartido por todas las requests (el overhead depende del modo de ejecución)."""
+    global _sizer
+    if _sizer is None:
+        settings = get_settings()
+        _sizer = AdaptiveChunkSizer(
+            max_pages=settings.MINERU_BATCH_MAX_PAGES,
+            overhead_target=settings.MINERU_BATCH_OVERHEAD_TARGET,
+            default_overhead_s=1.0 if settings.MINERU_MODE == "pool" else 15.0,
+        )
+    return _sizer
@@ -0,0 +1,199 @@
+from __future__ import annotations
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from ..config import get_settings
+from app.metrics import OCR_CACHE_HITS, OCR_CACHE_MISSES, OCR_CACHE_BYTES
+from .mineru_runner import renumber_page_markers, list_image_refs
+
+# pypdf escribe un /ID de trailer distinto en cada PdfWriter; se excluye del hash
+_TRAILER_ID_RE = re.compile(rb"/ID\s*\[\s*<[0-9A-Fa-f]*>\s*<[0-9A-Fa-f]*>\s*\]")
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    """Hard link si src y dst comparten filesystem (sin copia de datos); copia si no."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class OCRCache:
+    """Caché en disco direccionada por contenido, con límite de tamaño y expulsión LRU.
+
+    Estructura:
+        <root>/pages/<key>/page.md, meta.json, images/*   (markdown anotado por página)
+        <root>/docs/<key>/upload.zip                      (resultado completo del documento)
+    La recencia se persiste en el mtime de cada entrada para sobrevivir reinicios. Con varios
+    procesos sobre el mismo directorio, las entradas escritas por otro proceso se incorporan al
+    índice local la primera vez que se consultan.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, backend: str, lang: str, device: str):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._params = f"{backend}|{lang}|{device}".encode()
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._total = 0
+        for kind in ("pages", "docs"):
+            (root / kind).mkdir(parents=True, exist_ok=True)
+        self._load_index()
+
+    # ---------- claves ----------
+    def _key(self, digest: "hashlib._Hash") -> str:
+        digest.update(b"\0" + self._params)
+        return digest.hexdigest()
+
+    def page_key(self, page_pdf: Path) -> str:
+        return self._key(hashlib.sha256(_TRAILER_ID_RE.sub(b"", page_pdf.read_bytes())))
+
+    def document_key(self, digest: "hashlib._Hash") -> str:
+        """Recibe un sha256 ya alimentado con los bytes del PDF (p.ej. durante la subida)."""
+        return self._key(digest.copy())
+
+    # ---------- páginas ----------
+    def get_page(self, key: str, images_out_dir: Path, page_num: int) -> Optional[str]:
+        entry = self._touch(f"pages/{key}")
+        if entry is None:
+            OCR_CACHE_MISSES.labels(level="page").inc(); return None
+        try:
+            meta = json.loads((entry / "meta.json").read_text("utf-8"))
+            md = (entry / "page.md").read_text("utf-8")
+            src_page = int(meta["page"])
+            images_out_dir.mkdir(parents=True, exist_ok=True)
+            # Nombres por hash de contenido: válidos tal cual en cualquier número de página
+            for name in meta.get("images", []):
+                dst = images_out_dir / name
+                if not dst.exists(): link_or_copy(entry / "images" / name, dst)
+        except (OSError, ValueError, KeyError):
+            self._drop(f"pages/{key}")
+            OCR_CACHE_MISSES.labels(level="page").inc(); return None
+        OCR_CACHE_HITS.labels(level="page").inc()
+        return renumber_page_markers(md, src_page, page_num) if src_page != page_num else md
+
+    def put_page(self, key: str, annotated: str, images_dir: Path, page_num: int) -> None:
+        rel = f"pages/{key}"
+        if self._contains(rel): return
+        staging = self.root / "pages" / f".tmp-{uuid.uuid4().hex}"
+        try:
+            (staging / "images").mkdir(parents=True)
+            names = sorted(n for n in list_image_refs(annotated) if (images_dir / n).is_file())
+            for name in names: link_or_copy(images_dir / name, staging / "images" / name)
+            (staging / "page.md").write_text(annotated, "utf-8")
+            (staging / "meta.json").write_text(json.dumps({"page": page_num, "images": names}), "utf-8")
+            self._commit(staging, rel)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    # ---------- documentos ----------
+    def get_document(self, key: str, dst: Path) -> bool:
+        entry = self._touch(f"docs/{key}")
+        try:
+            if entry is None: raise FileNotFoundError(key)
+            link_or_copy(entry / "upload.zip", dst)
+        except OSError:
+            if entry is not None: self._drop(f"docs/{key}")
+            OCR_CACHE_MISSES.labels(level="document").inc(); return False
+        OCR_CACHE_HITS.labels(level="document").inc()
+        return True
+
+    def put_document(self, key: str, zip_path: Path) -> None:
+        rel = f"docs/{key}"
+        if self._contains(rel): return
+        staging = self.root / "docs" / f".tmp-{uuid.uuid4().hex}"
+        try:
+            link_or_copy(zip_path, staging / "upload.zip")
+            self._commit(staging, rel)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    # ---------- índice LRU ----------
+    def _load_index(self) -> None:
+        found: list[tuple[float, str, int]] = []
+        for kind in ("pages", "docs"):
+            for d in (self.root / kind).iterdir():
+                if d.name.startswith(".tmp-"):
+                    shutil.rmtree(d, ignore_errors=True); continue
+                found.append((d.stat().st_mtime, f"{kind}/{d.name}", _dir_size(d)))
+        for _, rel, size in sorted(found):
+            self._entries[rel] = size; self._total += size
+        self._evict()
+
+    def _contains(self, rel: str) -> bool:
+        with self._lock:
+            if rel in self._entries: return True
+        return self._adopt(rel)
+
+    def _adopt(self, rel: str) -> bool:
+        # Entrada creada por otro proceso (modo multi-worker): se añade al índice local
+        path = self.root / rel
+        if not path.is_dir(): return False
+        size = _dir_size(path)
+        with self._lock:
+            if rel not in self._entries:
+                self._entries[rel] = size; self._total += size
+                self._evict()
+        return True
+
+    def _touch(self, rel: str) -> Optional[Path]:
+        with self._lock:
+            known = rel in self._entries
+            if known: self._entries.move_to_end(rel)
+        if not known and not self._adopt(rel): return None
+        path = self.root / rel
+        try: os.utime(path)
+        except OSError: pass
+        return path
+
+    def _commit(self, staging: Path, rel: str) -> None:
+        size = _dir_size(staging)
+        if size > self.max_bytes: return
+        try:
+            os.replace(staging, self.root / rel)
+        except OSError:
+            return  # otra petición guardó la misma entrada en paralelo
+        with self._lock:
+            self._entries[rel] = size; self._total += size
+            self._evict()
+
+    def _drop(self, rel: str) -> None:
+        with self._lock:
+            self._total -= self._entries.pop(rel, 0)
+            OCR_CACHE_BYTES.set(self._total)
+        shutil.rmtree(self.root / rel, ignore_errors=True)
+
+    def _evict(self) -> None:
+        # Llamar con el lock tomado
+        while self._total > self.max_bytes and self._entries:
+            rel, size = self._entries.popitem(last=False)
+            self._total -= size
+            shutil.rmtree(self.root / rel, ignore_errors=True)
+        OCR_CACHE_BYTES.set(self._total)
+
+
+@lru_cache()
+def get_ocr_cache() -> Optional[OCRCache]:
+    settings = get_settings()
+    if not settings.OCR_CACHE_ENABLED:
+        return None
+    return OCRCache(
+        root=Path(settings.OCR_CACHE_DIR),
+        max_bytes=settings.OCR_CACHE_MAX_MB * 1024 * 1024,
+        backend=settings.GPU_BACKEND,
+        lang=settings.MINERU_LANG,
+        device=settings.GPU_DEVICE if settings.GPU_ENABLED else "cpu",
+    )
@@ -1,132 +1,305 @@
 from __future__ import annotations
-from fastapi import APIRouter, HTTPException, UploadFile, File, Body, Form, Request
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, HTTPException, UploadFile, File, Body, Form, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from starlette.background import BackgroundTask
 from pathlib import Path
-import tempfile, os, asyncio, time, shutil, datetime
+from typing import AsyncIterator, Awaitable, Iterator, Optional, Tuple, TypeVar
+import tempfile, asyncio, time, shutil, hashlib, json, base64
 from ..config import get_settings
-from app.metrics import BYTES_UP, OCR_INFLIGHT, PAGES_ACTIVE, DOC_LAST
-from .mineru_runner import (
-    run_mineru,
-    split_pdf_to_pages,
-    find_or_make_md,
-    rewrite_and_copy_images,
-    annotate_single_page_markers,
-    build_annotated_from_zip,
-    zip_directory,
-)
+from app.metrics import BYTES_UP, BYTES_OUT, OCR_INFLIGHT, record_document, stage_timer
+from .cache import get_ocr_cache
+from .pipeline import process_pdf, ROUTE_TIMEOUT
+from .packaging import iter_zip, write_tar, build_json_result
+from .jobs import get_job_manager, OCRJob
 
 router = APIRouter()
+T = TypeVar("T")
+
+
+async def save_upload(file: Optional[UploadFile], body: AsyncIterator[bytes], dst_dir: Path) -> Tuple[Path, "hashlib._Hash"]:
+    """Guarda el PDF (multipart o cuerpo crudo) en `dst_dir` y devuelve `(ruta, sha256)`."""
+    with stage_timer("upload"):
+        return await _save_upload(file, body, dst_dir)
+
+
+async def _save_upload(file: Optional[UploadFile], body: AsyncIterator[bytes], dst_dir: Path) -> Tuple[Path, "hashlib._Hash"]:
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    in_filename = "upload.pdf"
+    doc_hash = hashlib.sha256()
+    if file is not None:  # camino multipart
+        if file.filename and file.filename.lower().endswith(".pdf"):
+            in_filename = Path(file.filename).name
+        in_path = dst_dir / in_filename
+        total = 0
+        with open(in_path, "wb") as fout:
+            while True:
+                chunk = await file.read(1024 * 1024)
+                if not chunk: break
+                total += len(chunk); fout.write(chunk); doc_hash.update(chunk)
+    else:  # camino raw: se vuelca a disco por chunks, sin cargarlo entero en memoria
+        in_path = dst_dir / in_filename
+        total = 0
+        with open(in_path, "wb") as fout:
+            async for chunk in body:
+                if not chunk: continue
+                total += len(chunk); fout.write(chunk); doc_hash.update(chunk)
+    if total == 0:
+        raise HTTPException(400, "No se recibió archivo")
+    BYTES_UP.inc(total)
+    return in_path, doc_hash
+
+
+async def _iter_bytes(data: Optional[bytes]):
+    if data: yield data
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[T]) -> T:
+    """Ejecuta `work` mientras el cliente siga conectado; si se desconecta, lo cancela
+    (matando los procesos MinerU en curso y liberando sus reservas) y responde 499."""
+    task = asyncio.ensure_future(work)
+    poll_s = get_settings().OCR_DISCONNECT_POLL_S
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_s)
+            if done: return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise HTTPException(499, "Cliente desconectado; procesamiento cancelado")
+    finally:
+        if not task.done():
+            task.cancel(); await asyncio.gather(task, return_exceptions=True)
+
+
+def skipped_pages(routes: dict[int, str]) -> str:
+    return ",".join(str(p) for p, r in sorted(routes.items()) if r == ROUTE_TIMEOUT)
+
+
+def route_summary(routes: dict[int, str]) -> str:
+    """Resumen de rutas por página para cabecera HTTP, p.ej. `ocr=5,text=12`."""
+    counts: dict[str, int] = {}
+    for route in routes.values(): counts[route] = counts.get(route, 0) + 1
+    return ",".join(f"{r}={n}" for r, n in sorted(counts.items())) or "cache=document"
+
+
+async def enqueue_upload(file: Optional[UploadFile], body: AsyncIterator[bytes], vram_limit: int, concurrency: int, per_worker_mb: Optional[int]) -> OCRJob:
+    """Guarda el PDF directamente en el directorio del trabajo y lo encola."""
+    manager = get_job_manager()
+    cache = get_ocr_cache()
+    job_id = manager.new_job_id()
+    try:
+        in_path, doc_hash = await save_upload(file, body, manager.job_dir(job_id) / "work")
+    except BaseException:
+        shutil.rmtree(manager.job_dir(job_id), ignore_errors=True); raise
+    return manager.submit(job_id, in_path, {
+        "vram_limit": vram_limit,
+        "concurrency": concurrency,
+        "per_worker_mb": per_worker_mb,
+        "doc_key": cache.document_key(doc_hash) if cache else None,
+    })
+
+
+def _count_out(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    for chunk in chunks:
+        BYTES_OUT.inc(len(chunk)); yield chunk
+
+
+async def package_result(output_format: str, result: Path, work_dir: Path, headers: dict[str, str], include_images: bool) -> Tuple[Response, bool]:
+    """Empaqueta el resultado de `process_pdf` en el formato pedido.
+
+    `result` es el ZIP (`zip`) o el directorio final (resto de formatos). Devuelve la respuesta y si
+    el directorio de trabajo debe borrarse ya (True) o lo borra la respuesta al terminar el envío.
+    """
+    settings = get_settings()
+    cleanup = BackgroundTask(shutil.rmtree, work_dir, True)
+    if output_format == "zip":
+        # El ZIP se sirve directamente desde el directorio de trabajo, sin copia intermedia
+        BYTES_OUT.inc(result.stat().st_size)
+        return FileResponse(path=result, media_type="application/zip", filename="upload.zip", headers=headers, background=cleanup), False
+    if output_format == "zip-stream":
+        # Sin archivo intermedio: los primeros bytes salen mientras se comprime el resto
+        chunks = _count_out(iter_zip(result, settings.OCR_ZIP_WORKERS, settings.OCR_ZIP_LEVEL))
+        headers = {**headers, "Content-Disposition": 'attachment; filename="upload.zip"'}
+        return StreamingResponse(chunks, media_type="application/zip", headers=headers, background=cleanup), False
+    if output_format == "tar":
+        with stage_timer("zip"):
+            tar_path = await asyncio.to_thread(write_tar, result, work_dir / "upload.tar")
+        BYTES_OUT.inc(tar_path.stat().st_size)
+        return FileResponse(path=tar_path, media_type="application/x-tar", filename="upload.tar", headers=headers, background=cleanup), False
+    with stage_timer("zip"):
+        body = await asyncio.to_thread(lambda: json.dumps(build_json_result(result, include_images), ensure_ascii=False).encode("utf-8"))
+    BYTES_OUT.inc(len(body))
+    return Response(content=body, media_type="application/json", headers=headers), True
 
 
 @router.post("/ocr")
 async def ocr_endpoint(
     request: Request,
     file: UploadFile | None = File(None),  # PDF vía multipart (opcional)
-    raw: bytes | None = Body(None),        # PDF en bytes crudos (alternativa)
+    raw: bytes | None = Body(None),        # PDF como campo `raw` del formulario (alternativa)
     vram_limit: int = Form(..., ge=256),   # VRAM total asignada (MB)
     concurrency: int = Form(..., ge=1),    # procesos paralelos solicitados
     per_worker_mb: int | None = Form(None, ge=256),  # opcional: VRAM por worker (MB)
+    output_format: str = Form("zip", pattern="^(zip|zip-stream|tar|json)$"),  # formato de la respuesta
+    include_images: bool = Form(True),  # solo `json`: imágenes en base64 (False = solo nombres)
 ):
     """Procesa un PDF página a página usando MinerU con control de concurrencia.
 
     Pasos:
-    1) Recibe archivo (multipart) o bytes crudos y los guarda temporalmente
-    2) Divide el PDF en páginas individuales
-    3) Ejecuta MinerU por página con semáforo de concurrencia limitado por VRAM
-    4) Reconstruye un ZIP con upload.md e imágenes reescritas
-    5) Actualiza métricas y devuelve el ZIP resultante
+    1) Recibe archivo (multipart) o bytes crudos (`/ocr/raw`) y los guarda temporalmente
+    2) Si el documento completo está en caché, devuelve el ZIP almacenado
+    3) Divide el PDF en páginas y ejecuta MinerU (pool residente o CLI) solo para
+       las páginas sin caché; cada página reserva `per_worker_mb` del presupuesto
+       global de VRAM (compartido con las demás requests) y el semáforo por request
+       limita la concurrencia solicitada por el cliente
+    4) Reconstruye un ZIP con upload.md, imágenes reescritas y routing.json (ruta por página)
+    5) Actualiza métricas y devuelve el resultado (cabeceras `X-OCR-Routes` y
+       `X-OCR-Skipped-Pages` con las páginas que superaron `MINERU_PAGE_TIMEOUT_S`)
+       según `output_format`: `zip` (por defecto), `zip-stream` (ZIP generado al vuelo),
+       `tar` (sin compresión) o `json` (markdown, rutas e imágenes en base64 u omitidas)
+
+    Si el cliente se desconecta, se cancelan las páginas pendientes y se matan los procesos
+    MinerU en curso.
     """
+    return await run_ocr(request, file, _iter_bytes(raw), vram_limit, concurrency, per_worker_mb, output_format, include_images)
 
-    settings = get_settings()
+
+@router.post("/ocr/raw")
+async def ocr_raw_endpoint(
+    request: Request,
+    vram_limit: int = Query(..., ge=256),
+    concurrency: int = Query(..., ge=1),
+    per_worker_mb: int | None = Query(None, ge=256),
+    output_format: str = Query("zip", pattern="^(zip|zip-stream|tar|json)$"),
+    include_images: bool = Query(True),
+):
+    """Igual que `/ocr`, con el PDF como cuerpo crudo (`Content-Type: application/pdf`).
+
+    Las opciones van en la query: sin parámetros `Form`/`File`, FastAPI no lee el cuerpo y
+    `request.stream()` lo vuelca a disco por chunks.
+    """
+    return await run_ocr(request, None, request.stream(), vram_limit, concurrency, per_worker_mb, output_format, include_images)
+
+
+async def run_ocr(request: Request, file: Optional[UploadFile], body: AsyncIterator[bytes], vram_limit: int, concurrency: int,
+                  per_worker_mb: Optional[int], output_format: str, include_images: bool) -> Response:
+    """Cuerpo común de `/ocr` y `/ocr/raw` (ver `ocr_endpoint`)."""
+    cache = get_ocr_cache()
     t0 = time.perf_counter(); status = "200"
+    pages_count = 0; in_filename = "upload.pdf"
+    # Directorio de trabajo por request; se elimina tras enviar la respuesta (o al fallar)
+    tmpdir_path = Path(tempfile.mkdtemp(prefix="mineru_ocr_")); cleanup_now = True
     try:
         OCR_INFLIGHT.inc()
-        # Directorio de trabajo temporal por request
-        with tempfile.TemporaryDirectory() as tmpdir:
-            tmpdir_path = Path(tmpdir)
-            in_filename = "upload.pdf"
-            if file is not None:  # camino multipart
-                if file.filename and file.filename.lower().endswith(".pdf"):
-                    in_filename = Path(file.filename).name
-                in_path = tmpdir_path / in_filename
-                total = 0
-                with open(in_path, "wb") as fout:
-                    while True:
-                        chunk = await file.read(1024 * 1024)
-                        if not chunk: break
-                        total += len(chunk); fout.write(chunk)
-                BYTES_UP.inc(total)
-            else:  # camino raw bytes en body
-                data_bytes = raw if raw is not None else await request.body()
-                if not data_bytes:
-                    status = "400"; raise HTTPException(400, "No se recibió archivo")
-                in_path = tmpdir_path / in_filename
-                in_path.write_bytes(data_bytes); BYTES_UP.inc(len(data_bytes))
-
-            pages_src_dir = tmpdir_path / "pages_src"
-            pages = split_pdf_to_pages(in_path, pages_src_dir)
-            if not pages:
-                status = "500"; raise HTTPException(500, "No se pudieron generar páginas del PDF")
-            PAGES_ACTIVE.set(len(pages))  # gauge de progreso
-
-            final_root = tmpdir_path / "final"; final_pages = final_root / "pages"; images_dir = final_root / "images"
-            final_root.mkdir(parents=True, exist_ok=True); final_pages.mkdir(parents=True, exist_ok=True)
-
-            per_worker = per_worker_mb if per_worker_mb is not None else settings.MINERU_VRAM_PER_WORKER_MB
-            allowed_by_vram = (vram_limit // per_worker) if settings.GPU_ENABLED else concurrency
-            if allowed_by_vram < 1:
-                status = "400"; raise HTTPException(400, f"VRAM insuficiente para 1 worker (per_worker={per_worker}MB)")
-            max_workers = max(1, min(concurrency, allowed_by_vram))
-            sem = asyncio.Semaphore(max_workers)
-
-            async def process_one(pnum: int, pdf: Path):
-                async with sem:
-                    out_dir = tmpdir_path / "pages_out" / f"p{pnum:04d}"; out_dir.mkdir(parents=True, exist_ok=True)
-                    _md, mineru_zip = await asyncio.to_thread(run_mineru, pdf, out_dir, settings.GPU_ENABLED, settings.GPU_DEVICE, vram_limit, settings.GPU_BACKEND)
-                    annotated = await asyncio.to_thread(build_annotated_from_zip, mineru_zip, images_dir, pnum) if mineru_zip else None
-                    if annotated is None:
-                        work_dir = out_dir
-                        if mineru_zip:
-                            import zipfile
-                            work_dir = tmpdir_path / "zip_pages" / f"p{pnum:04d}"; work_dir.mkdir(parents=True, exist_ok=True)
-                            await asyncio.to_thread(lambda: zipfile.ZipFile(mineru_zip, "r").extractall(path=work_dir))
-                        md = await asyncio.to_thread(find_or_make_md, work_dir)
-                        if md:
-                            raw_md = await asyncio.to_thread(md.read_text, "utf-8", "ignore")
-                            rewritten = await asyncio.to_thread(rewrite_and_copy_images, raw_md, md.parent, images_dir, pnum)
-                            annotated = await asyncio.to_thread(annotate_single_page_markers, rewritten, pnum)
-                    if annotated is None: annotated = ""
-                    return (pnum, annotated)
-
-            # Ejecuta tareas de páginas respetando el semáforo
-            results = await asyncio.gather(*[process_one(p, pdf) for p, pdf in pages])
-            parts: list[str] = []
-            for pnum, md in sorted(results, key=lambda x: x[0]):
-                if md: parts.append(md)
-            await asyncio.to_thread((final_root / "upload.md").write_text, "\n\n".join(parts), "utf-8")
-            src_zip = tmpdir_path / "upload.zip"; await asyncio.to_thread(zip_directory, final_root, src_zip)
-            tmp_fd, tmp_zip_path = tempfile.mkstemp(suffix=".zip", prefix="mineru_ocr_"); os.close(tmp_fd); shutil.copyfile(src_zip, tmp_zip_path)
-            return FileResponse(path=tmp_zip_path, media_type="application/zip", filename="upload.zip", background=BackgroundTask(os.remove, tmp_zip_path))
+        in_path, doc_hash = await save_upload(file, body, tmpdir_path)
+        in_filename = in_path.name
+        result, pages_count, routes = await cancel_on_disconnect(request, process_pdf(
+            in_path, tmpdir_path, vram_limit, concurrency, per_worker_mb,
+            doc_key=cache.document_key(doc_hash) if cache else None,
+            archive=output_format == "zip",
+        ))
+        headers = {"X-OCR-Routes": route_summary(routes), "X-OCR-Skipped-Pages": skipped_pages(routes)}
+        response, cleanup_now = await package_result(output_format, result, tmpdir_path, headers, include_images)
+        return response
     except HTTPException as e:
         status = str(e.status_code); raise
     except Exception:
         status = "500"; raise
     finally:
-        # Telemetría por request (para tabla en Grafana)
-        duration = time.perf_counter() - t0
-        processed_at = datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z"
-        pages_count = len(pages) if 'pages' in locals() else 0
-        name = in_filename if 'in_filename' in locals() else "upload.pdf"
-        try:
-            DOC_LAST.labels(
-                name=name,
-                pages=str(pages_count),
-                processed_at=processed_at,
-                vram=str(vram_limit),
-                concurrency=str(concurrency),
-            ).set(duration)
-        except Exception:
-            pass
-        PAGES_ACTIVE.set(0)
+        # Telemetría por request (tabla de documentos recientes en Grafana)
+        record_document(in_filename, pages_count, time.perf_counter() - t0, status, vram=vram_limit, concurrency=concurrency)
         OCR_INFLIGHT.dec()
+        if cleanup_now: shutil.rmtree(tmpdir_path, ignore_errors=True)
+
+
+@router.post("/ocr/jobs", status_code=202)
+async def create_ocr_job(
+    request: Request,
+    file: UploadFile | None = File(None),
+    raw: bytes | None = Body(None),
+    vram_limit: int = Form(..., ge=256),
+    concurrency: int = Form(..., ge=1),
+    per_worker_mb: int | None = Form(None, ge=256),
+):
+    """Encola un PDF para OCR en segundo plano y devuelve el id del trabajo de inmediato."""
+    job = await enqueue_upload(file, _iter_bytes(raw), vram_limit, concurrency, per_worker_mb)
+    return {
+        **job.to_dict(),
+        "status_url": str(request.url_for("get_ocr_job", job_id=job.id)),
+        "result_url": str(request.url_for("get_ocr_job_result", job_id=job.id)),
+    }
+
+
+@router.get("/ocr/jobs/{job_id}")
+async def get_ocr_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(404, "Trabajo no encontrado")
+    return job.to_dict()
+
+
+@router.get("/ocr/jobs/{job_id}/result")
+async def get_ocr_job_result(job_id: str):
+    manager = get_job_manager()
+    job = manager.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Trabajo no encontrado")
+    if job.status == "error":
+        raise HTTPException(500, job.error or "El trabajo OCR falló")
+    if job.status != "done":
+        raise HTTPException(409, f"Trabajo en estado '{job.status}'")
+    BYTES_OUT.inc(manager.result_path(job_id).stat().st_size)
+    return FileResponse(path=manager.result_path(job_id), media_type="application/zip", filename="upload.zip")
+
+
+@router.post("/ocr/stream")
+async def ocr_stream(
+    request: Request,
+    file: UploadFile | None = File(None),
+    raw: bytes | None = Body(None),
+    vram_limit: int = Form(..., ge=256),
+    concurrency: int = Form(..., ge=1),
+    per_worker_mb: int | None = Form(None, ge=256),
+    stream_format: str = Form("ndjson", pattern="^(ndjson|sse)$"),  # ndjson | sse
+    include_zip: bool = Form(False),  # incluir el ZIP final en base64 en el evento `done`
+):
+    """Igual que `/ocr`, pero emite cada página anotada en cuanto termina.
+
+    Eventos (`type`): `job` (id y URLs), `pages` (total tras el split), `page` (número,
+    markdown anotado e imágenes referenciadas, en orden de finalización) y `done`/`error`.
+    El documento se procesa como un trabajo de `/ocr/jobs`: si el cliente se desconecta,
+    el ZIP sigue disponible en `result_url` hasta que expire.
+    """
+    manager = get_job_manager()
+    job = await enqueue_upload(file, _iter_bytes(raw), vram_limit, concurrency, per_worker_mb)
+    events = job.subscribe(get_settings().OCR_STREAM_QUEUE_MAX)
+    result_url = str(request.url_for("get_ocr_job_result", job_id=job.id))
+
+    def encode(event: dict) -> bytes:
+        data = json.dumps(event, ensure_ascii=False)
+        if stream_format == "sse":
+            out = f"event: {event['type']}\ndata: {data}\n\n".encode("utf-8")
+        else:
+            out = (data + "\n").encode("utf-8")
+        BYTES_OUT.inc(len(out))
+        return out
+
+    async def generate():
+        try:
+            yield encode({"type": "job", "job_id": job.id, "status_url": str(request.url_for("get_ocr_job", job_id=job.id)), "result_url": result_url})
+            while True:
+                event = await events.get()
+                if event["type"] != "end":
+                    yield encode(event); continue
+                if event["status"] != "done":
+                    yield encode({"type": "error", "error": event["error"]}); break
+                final = {"type": "done", "pages": job.pages_total, "result_url": result_url}
+                if include_zip:
+                    data = await asyncio.to_thread(manager.result_path(job.id).read_bytes)
+                    final["zip_base64"] = base64.b64encode(data).decode("ascii")
+                yield encode(final); break
+        finally:
+            job.unsubscribe(events)
+
+    media_type = "text/event-stream" if stream_format == "sse" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -0,0 +1,261 @@
+from __future__ import annotations
+from fastapi import HTTPException
+from pathlib import Path
+from typing import Any, Optional
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from ..config import Settings
+from app.metrics import OCR_INFLIGHT, JOBS_QUEUED, JOBS_RUNNING, record_document
+from .pipeline import process_pdf
+from .mineru_runner import list_image_refs
+
+logger = logging.getLogger(__name__)
+
+
+class OCRJob:
+    """Estado de un trabajo OCR asíncrono; se persiste en `<jobs_dir>/<id>/job.json`."""
+
+    def __init__(self, job_id: str, filename: str, params: dict[str, Any]):
+        self.id = job_id
+        self.filename = filename
+        self.params = params
+        self.status = "queued"  # queued | running | done | error
+        self.error: Optional[str] = None
+        self.pages_total = 0
+        self.pages_done: list[int] = []
+        self.routes: dict[int, str] = {}  # página -> text | cache | ocr
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._listeners: list[asyncio.Queue] = []
+
+    def subscribe(self, maxsize: int = 256) -> asyncio.Queue:
+        """Cola acotada de eventos `pages` / `page` / `end` para clientes en streaming."""
+        q: asyncio.Queue = asyncio.Queue(maxsize)
+        self._listeners.append(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        if q in self._listeners: self._listeners.remove(q)
+
+    def publish(self, event: dict[str, Any]) -> None:
+        for q in list(self._listeners):
+            try:
+                q.put_nowait(event)
+            except asyncio.QueueFull:
+                # Cliente demasiado lento: se descarta su cola y se le cierra el stream; el trabajo sigue
+                self.unsubscribe(q)
+                while not q.empty(): q.get_nowait()
+                q.put_nowait({"type": "end", "status": "error", "error": "Cliente demasiado lento; el resultado seguirá en result_url"})
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+            "pages_total": self.pages_total,
+            "pages_done": len(self.pages_done),
+            "pages_completed": sorted(self.pages_done),
+            "routes": {str(p): r for p, r in sorted(self.routes.items())},
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "OCRJob":
+        job = cls(data["job_id"], data.get("filename", "upload.pdf"), {})
+        job.status = data.get("status", "error")
+        job.error = data.get("error")
+        job.pages_total = int(data.get("pages_total", 0))
+        job.pages_done = list(data.get("pages_completed", []))
+        job.routes = {int(p): r for p, r in data.get("routes", {}).items()}
+        job.created_at = float(data.get("created_at", time.time()))
+        job.finished_at = data.get("finished_at")
+        return job
+
+
+class OCRJobManager:
+    """Cola acotada de trabajos OCR ejecutados en segundo plano.
+
+    Como máximo `max_running` documentos se procesan a la vez y `max_queued` esperan turno;
+    los resultados se guardan en disco y se eliminan `ttl_s` segundos después de terminar.
+    Con varios procesos uvicorn cada uno ejecuta sus trabajos; el estado de los trabajos de otro
+    proceso se lee de su `job.json`, de modo que cualquier worker puede responder consultas.
+    """
+
+    def __init__(self, root: Path, max_running: int, max_queued: int, ttl_s: int):
+        self.root = root
+        self.max_queued = max_queued
+        self.ttl_s = ttl_s
+        self._sem = asyncio.Semaphore(max_running)
+        self._jobs: dict[str, OCRJob] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._sweeper: Optional[asyncio.Task] = None
+        root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def job_dir(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def result_path(self, job_id: str) -> Path:
+        return self.job_dir(job_id) / "upload.zip"
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def get(self, job_id: str) -> Optional[OCRJob]:
+        job = self._jobs.get(job_id)
+        if job is None and _JOB_ID_RE.fullmatch(job_id):
+            job = self._read(self.job_dir(job_id))  # trabajo de otro proceso (modo multi-worker)
+        return job
+
+    @staticmethod
+    def _read(d: Path) -> Optional[OCRJob]:
+        try:
+            return OCRJob.from_dict(json.loads((d / "job.json").read_text("utf-8")))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def submit(self, job_id: str, in_path: Path, params: dict[str, Any]) -> OCRJob:
+        """Encola un PDF ya guardado dentro de `job_dir(job_id)`."""
+        queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+        if queued >= self.max_queued:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+            raise HTTPException(429, "Cola de trabajos OCR llena", headers={"Retry-After": "30"})
+        job = OCRJob(job_id, in_path.name, params)
+        self._jobs[job_id] = job
+        self._persist(job); JOBS_QUEUED.inc()
+        task = asyncio.create_task(self._run(job, in_path))
+        self._tasks.add(task); task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _run(self, job: OCRJob, in_path: Path) -> None:
+        try:
+            async with self._sem:
+                await self._execute(job, in_path)
+        finally:
+            if job.status == "queued": JOBS_QUEUED.dec()  # cancelado en cola (p.ej. parada del servicio)
+
+    async def _execute(self, job: OCRJob, in_path: Path) -> None:
+        JOBS_QUEUED.dec(); JOBS_RUNNING.inc(); OCR_INFLIGHT.inc()
+        job.status = "running"; self._persist(job); t0 = time.perf_counter()
+        work_dir = self.job_dir(job.id) / "work"
+
+        def on_pages(total: int) -> None:
+            job.pages_total = total; self._persist(job)
+            job.publish({"type": "pages", "pages_total": total})
+
+        def on_page(pnum: int, md: str, route: str) -> None:
+            job.pages_done.append(pnum); job.routes[pnum] = route; self._persist(job)
+            job.publish({"type": "page", "page": pnum, "route": route, "markdown": md, "images": list_image_refs(md)})
+
+        try:
+            zip_path, _pages, _routes = await process_pdf(in_path, work_dir, on_pages=on_pages, on_page=on_page, **job.params)
+            await asyncio.to_thread(zip_path.replace, self.result_path(job.id))
+            job.status = "done"
+        except HTTPException as e:
+            job.status, job.error = "error", str(e.detail)
+        except Exception as e:
+            logger.exception("Trabajo OCR %s falló", job.id)
+            job.status, job.error = "error", str(e) or e.__class__.__name__
+        finally:
+            job.finished_at = time.time()
+            self._persist(job)
+            record_document(job.filename, job.pages_total, time.perf_counter() - t0, "200" if job.status == "done" else "500", job_id=job.id)
+            job.publish({"type": "end", "status": job.status, "error": job.error})
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+            JOBS_RUNNING.dec(); OCR_INFLIGHT.dec()
+
+    # ---------- persistencia / TTL ----------
+    def _persist(self, job: OCRJob) -> None:
+        path = self.job_dir(job.id) / "job.json"
+        try:
+            data = {**job.to_dict(), "owner_pid": os.getpid()}
+            tmp = path.with_suffix(".tmp"); tmp.write_text(json.dumps(data), "utf-8"); tmp.replace(path)
+        except OSError:
+            logger.warning("No se pudo persistir el trabajo %s", job.id, exc_info=True)
+
+    def _load(self) -> None:
+        for d in self.root.iterdir():
+            meta = d / "job.json"
+            try:
+                data = json.loads(meta.read_text("utf-8")); job = OCRJob.from_dict(data)
+            except (OSError, ValueError, KeyError):
+                try: stale = time.time() - d.stat().st_mtime > 60  # no borrar un trabajo que otro proceso está creando
+                except OSError: stale = False
+                if stale: shutil.rmtree(d, ignore_errors=True)
+                continue
+            if job.status in ("queued", "running") and _pid_alive(data.get("owner_pid")):
+                continue  # en curso en otro proceso uvicorn
+            if job.status in ("queued", "running"):  # interrumpido por un reinicio
+                job.status, job.error, job.finished_at = "error", "Interrumpido por reinicio del servicio", time.time()
+                shutil.rmtree(d / "work", ignore_errors=True); self._persist(job)
+            self._jobs[job.id] = job
+
+    def sweep_expired(self) -> None:
+        now = time.time()
+        for job in list(self._jobs.values()):
+            if job.finished_at is not None and now - job.finished_at > self.ttl_s:
+                self._jobs.pop(job.id, None)
+                shutil.rmtree(self.job_dir(job.id), ignore_errors=True)
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(60)
+            await asyncio.to_thread(self.sweep_expired)
+
+    def start(self) -> None:
+        self.sweep_expired()
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        for task in [self._sweeper, *self._tasks]:
+            if task is not None: task.cancel()
+        await asyncio.gather(*[t for t in [self._sweeper, *self._tasks] if t is not None], return_exceptions=True)
+
+
+_JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid or pid == os.getpid(): return False
+    try:
+        os.kill(pid, 0); return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+_manager: Optional[OCRJobManager] = None
+
+
+def start_job_manager(settings: Settings) -> None:
+    global _manager
+    if _manager is None:
+        _manager = OCRJobManager(
+            root=Path(settings.OCR_JOBS_DIR),
+            max_running=settings.OCR_JOBS_MAX_RUNNING,
+            max_queued=settings.OCR_JOBS_MAX_QUEUED,
+            ttl_s=settings.OCR_JOBS_TTL_S,
+        )
+        _manager.start()
+
+
+async def stop_job_manager() -> None:
+    global _manager
+    if _manager is not None:
+        await _manager.stop()
+        _manager = None
+
+
+def get_job_manager() -> OCRJobManager:
+    if _manager is None:
+        raise HTTPException(503, "Gestor de trabajos OCR no iniciado")
+    return _manager
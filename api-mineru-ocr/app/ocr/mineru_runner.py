@@ -1,48 +1,180 @@
 from __future__ import annotations
 from pathlib import Path
 from typing import Optional, Tuple, Iterable
+import asyncio
+import hashlib
 import shutil
+import signal
 import subprocess
 import zipfile
+import json
 import re
+import uuid
 from pypdf import PdfReader, PdfWriter
 import os
 
 
-def run_mineru(input_file: Path, out_dir: Path, use_gpu: bool, device: str, vram: int, backend: str) -> Tuple[Optional[Path], Optional[Path]]:
-    out_dir.mkdir(parents=True, exist_ok=True)
+class MinerUTimeout(TimeoutError):
+    """MinerU superó el tiempo límite por página; el proceso ya fue terminado."""
+
+
+def mineru_command(input_file: Path, out_dir: Path, use_gpu: bool, device: str, vram: int, backend: str, lang: str = "latin") -> list[str]:
     mineru_cli = shutil.which("mineru")
-    cmd = [mineru_cli or "python3", *( [] if mineru_cli else ["-m", "mineru.cli.client"] ), "-p", str(input_file), "-o", str(out_dir), "-m", "ocr", "-b", backend, "-l", "latin"]
+    cmd = [mineru_cli or "python3", *( [] if mineru_cli else ["-m", "mineru.cli.client"] ), "-p", str(input_file), "-o", str(out_dir), "-m", "ocr", "-b", backend, "-l", lang]
     cmd += (["-d", device, "--vram", str(vram)] if use_gpu else ["-d", "cpu"])
-    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    return cmd
+
+
+def run_mineru(input_file: Path, out_dir: Path, use_gpu: bool, device: str, vram: int, backend: str, lang: str = "latin") -> Tuple[Optional[Path], Optional[Path]]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    proc = subprocess.run(mineru_command(input_file, out_dir, use_gpu, device, vram, backend, lang), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
     if proc.returncode != 0:
         raise RuntimeError(proc.stdout or "MinerU CLI error")
+    return collect_mineru_outputs(out_dir)
+
+
+async def run_mineru_async(input_file: Path, out_dir: Path, use_gpu: bool, device: str, vram: int, backend: str, lang: str = "latin", timeout: Optional[float] = None) -> Tuple[Optional[Path], Optional[Path]]:
+    """Como `run_mineru`, pero interrumpible: si se cancela la tarea o vence `timeout`,
+    se mata el grupo de procesos de la CLI (incluidos sus hijos) y se libera la GPU."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    proc = await asyncio.create_subprocess_exec(
+        *mineru_command(input_file, out_dir, use_gpu, device, vram, backend, lang),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, start_new_session=True,
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        raise MinerUTimeout(f"MinerU superó {timeout}s en {input_file.name}") from None
+    finally:
+        if proc.returncode is None:
+            try: os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError: pass
+            await proc.wait()
+    if proc.returncode != 0:
+        raise RuntimeError(stdout.decode("utf-8", "ignore") or "MinerU CLI error")
+    return await asyncio.to_thread(collect_mineru_outputs, out_dir)
+
+
+def collect_mineru_outputs(out_dir: Path) -> Tuple[Optional[Path], Optional[Path]]:
     zip_candidates = list(out_dir.rglob("*.zip"))
     zip_path = next((z for z in zip_candidates if "archive" in z.name.lower() or z.name.lower().endswith(".zip")), None)
     return None, zip_path
 
 
+def open_pdf(pdf_path: Path) -> Optional[PdfReader]:
+    try:
+        return PdfReader(str(pdf_path))
+    except Exception:
+        return None
+
+
 def split_pdf_to_pages(pdf_path: Path, out_dir: Path) -> list[tuple[int, Path]]:
-    out_dir.mkdir(parents=True, exist_ok=True)
     reader = PdfReader(str(pdf_path))
-    pages: list[tuple[int, Path]] = []
-    for i in range(len(reader.pages)):
-        writer = PdfWriter(); writer.add_page(reader.pages[i])
-        pnum = i + 1
-        dst = out_dir / f"page_{pnum:04d}.pdf"
-        with open(dst, "wb") as f: writer.write(f)
-        pages.append((pnum, dst))
-    return pages
+    return [(i + 1, write_single_page(reader, i, out_dir)) for i in range(len(reader.pages))]
+
+
+def write_single_page(reader: PdfReader, index: int, out_dir: Path) -> Path:
+    """Escribe la página `index` (0-based) como PDF independiente; permite cortar el PDF de forma perezosa."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    writer = PdfWriter(); writer.add_page(reader.pages[index])
+    dst = out_dir / f"page_{index + 1:04d}.pdf"
+    with open(dst, "wb") as f: writer.write(f)
+    return dst
+
+
+# Caracteres "limpios" de una capa de texto (letras/dígitos de cualquier idioma, espacios y puntuación común)
+_CLEAN_TEXT_RE = re.compile(r"[\w\s.,;:!?¿¡()\[\]{}'\"%$€£@#&*+\-/\\=<>|°ºª…–—“”‘’«»•·]")
+
+
+def analyze_text_layer(page, min_chars: int) -> Tuple[float, float, str]:
+    """Puntúa la capa de texto de una página de pypdf para decidir si necesita OCR.
+
+    Devuelve `(score, cobertura_imágenes, texto)`, con `score` en [0, 1]:
+    densidad de texto (caracteres / `min_chars`, saturada) × proporción de caracteres limpios
+    × fracción de página no cubierta por imágenes. La cobertura se estima con la matriz de
+    transformación vigente en cada operador `Do` (dibujo de XObject).
+    """
+    box = page.mediabox
+    page_area = abs(float(box.width) * float(box.height)) or 1.0
+    covered = 0.0
+    def visitor(op, args, cm, tm) -> None:
+        nonlocal covered
+        if op == b"Do":
+            covered += abs(cm[0] * cm[3] - cm[1] * cm[2])
+    try:
+        text = page.extract_text(visitor_operand_before=visitor) or ""
+    except Exception:
+        return 0.0, 1.0, ""
+    coverage = min(1.0, covered / page_area)
+    chars = len(text.strip())
+    if not chars:
+        return 0.0, coverage, ""
+    clean = len(_CLEAN_TEXT_RE.findall(text)) / len(text)
+    score = min(1.0, chars / max(1, min_chars)) * clean * (1.0 - coverage)
+    return score, coverage, text
+
+
+def text_layer_to_markdown(text: str) -> str:
+    """Convierte el texto extraído en párrafos markdown (corte tras puntuación final o línea vacía)."""
+    paragraphs: list[str] = []; current: list[str] = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            if current: paragraphs.append("\n".join(current)); current = []
+            continue
+        current.append(line)
+        if line.endswith((".", ":", "!", "?")):
+            paragraphs.append("\n".join(current)); current = []
+    if current: paragraphs.append("\n".join(current))
+    return "\n\n".join(paragraphs)
+
+
+def merge_page_pdfs(page_pdfs: Iterable[Path], dst: Path) -> Path:
+    """Une PDFs de una página en un único PDF (lote para una sola invocación de MinerU)."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    writer = PdfWriter()
+    for pdf in page_pdfs:
+        writer.add_page(PdfReader(str(pdf)).pages[0])
+    with open(dst, "wb") as f: writer.write(f)
+    return dst
+
+
+def content_list_to_markdown(items: list[dict]) -> str:
+    """Reconstruye markdown a partir de bloques del `*_content_list.json` de MinerU."""
+    blocks: list[str] = []
+    for it in items:
+        kind = it.get("type")
+        if kind == "text":
+            text = (it.get("text") or "").strip()
+            if not text: continue
+            level = int(it.get("text_level") or 0)
+            blocks.append(f"{'#' * min(level, 6)} {text}" if level else text)
+        elif kind == "equation":
+            if it.get("text"): blocks.append(it["text"].strip())
+        elif kind in ("image", "table"):
+            parts = [c for c in it.get(f"{kind}_caption", []) if c]
+            if kind == "table" and it.get("table_body"): parts.append(it["table_body"])
+            elif it.get("img_path"): parts.append(f"![]({it['img_path']})")
+            parts += [c for c in it.get(f"{kind}_footnote", []) if c]
+            if parts: blocks.append("\n".join(parts))
+    return "\n\n".join(blocks)
+
 
+def split_mineru_output_by_page(out_dir: Path, n_pages: int) -> Optional[Tuple[Path, list[str]]]:
+    """Divide la salida de MinerU de un PDF multipágina en markdown por página.
 
-def zip_directory(src_dir: Path, zip_path: Path) -> Path:
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(src_dir):
-            root_path = Path(root)
-            for name in files:
-                fp = root_path / name
-                zf.write(fp, arcname=str(fp.relative_to(src_dir)))
-    return zip_path
+    Usa `page_idx` de `*_content_list.json`; devuelve `(directorio base de imágenes, [md por página])`
+    o None si la salida no incluye content_list.
+    """
+    cands = list(out_dir.rglob("*_content_list.json"))
+    if not cands: return None
+    content_list = max(cands, key=lambda p: p.stat().st_mtime)
+    items = json.loads(content_list.read_text(encoding="utf-8", errors="ignore"))
+    per_page: list[list[dict]] = [[] for _ in range(n_pages)]
+    for it in items:
+        idx = int(it.get("page_idx", 0))
+        if 0 <= idx < n_pages: per_page[idx].append(it)
+    return content_list.parent, [content_list_to_markdown(page) for page in per_page]
 
 
 def annotate_single_page_markers(md_text: str, page_num: int) -> str:
@@ -65,21 +197,95 @@ def annotate_single_page_markers(md_text: str, page_num: int) -> str:
     return "\n".join(out)
 
 
-def rewrite_and_copy_images(md_text: str, md_base_dir: Path, images_out_dir: Path, page_num: int) -> str:
-    images_out_dir.mkdir(parents=True, exist_ok=True)
-    img_re = re.compile(r"!\[[^\]]*\]\(([^)]+)\)")
+_PAGE_HEADER_RE = re.compile(r'^## Página (\d+) <a id="p\1"></a>$', re.M)
+
+
+def split_annotated_pages(md_text: str) -> dict[int, str]:
+    """Inversa de unir con "\n\n" los markdown de `annotate_single_page_markers`: página -> markdown."""
+    heads = list(_PAGE_HEADER_RE.finditer(md_text))
+    pages: dict[int, str] = {}
+    for i, m in enumerate(heads):
+        end = heads[i + 1].start() if i + 1 < len(heads) else len(md_text)
+        chunk = md_text[m.start():end]
+        pages[int(m.group(1))] = chunk[:-2] if i + 1 < len(heads) and chunk.endswith("\n\n") else chunk
+    return pages
+
+
+def list_image_refs(md_text: str) -> list[str]:
+    """Nombres de imagen referenciados como `images/<nombre>` en un markdown ya reescrito."""
+    return list(dict.fromkeys(re.findall(r"\]\(images/([^)\s]+)\)", md_text)))
+
+
+def renumber_page_markers(md_text: str, old_page: int, new_page: int) -> str:
+    """Adapta el markdown anotado de una página (cacheado como página `old_page`) a `new_page`."""
+    md_text = md_text.replace(f"## Página {old_page} <a id=\"p{old_page}\"></a>", f"## Página {new_page} <a id=\"p{new_page}\"></a>", 1)
+    return md_text.replace(f" [p{old_page}](#p{old_page})", f" [p{new_page}](#p{new_page})")
+
+
+_IMG_RE = re.compile(r"!\[[^\]]*\]\(([^)]+)\)")
+
+
+class PathIndex:
+    """Índice de las rutas de una salida de MinerU (ZIP o directorio), construido una sola vez.
+
+    Resuelve referencias de imagen del markdown por ruta exacta (relativa al markdown o a la
+    raíz) y, si fallan, por nombre base eligiendo la ruta que termina con la referencia.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self._exact: dict[str, str] = {}
+        self._by_base: dict[str, list[tuple[str, str]]] = {}
+        for name in names:
+            key = normalize_zip_path(name).lower()
+            if key in self._exact: continue
+            self._exact[key] = name
+            self._by_base.setdefault(key.rsplit("/", 1)[-1], []).append((key, name))
+
+    @classmethod
+    def of_dir(cls, root: Path) -> "PathIndex":
+        return cls(p.relative_to(root).as_posix() for p in root.rglob("*") if p.is_file())
+
+    def resolve(self, ref: str, base: str = "") -> Optional[str]:
+        rel = normalize_zip_path(ref).lower()
+        while rel.startswith("./"): rel = rel[2:]
+        base = normalize_zip_path(base).lower().strip("/")
+        for cand in ((f"{base}/{rel}" if base else rel), rel):
+            if cand in self._exact: return self._exact[cand]
+        cands = self._by_base.get(rel.rsplit("/", 1)[-1])
+        if not cands: return None
+        return next((name for key, name in cands if key.endswith(f"/{rel}")), cands[0][1])
+
+
+def store_image(data: bytes, name: str, images_out_dir: Path) -> str:
+    """Guarda una imagen con nombre derivado de su contenido (`<sha256[:20]><ext>`).
+
+    Logos, sellos y demás imágenes repetidas entre páginas se guardan una sola vez; la escritura
+    es atómica, así que varias páginas pueden guardar la misma imagen en paralelo.
+    """
+    dst = images_out_dir / f"{hashlib.sha256(data).hexdigest()[:20]}{Path(name).suffix.lower()}"
+    if not dst.exists():
+        images_out_dir.mkdir(parents=True, exist_ok=True)
+        tmp = images_out_dir / f".{uuid.uuid4().hex}.tmp"
+        tmp.write_bytes(data); os.replace(tmp, dst)
+    return dst.name
+
+
+def rewrite_and_copy_images(md_text: str, md_base_dir: Path, images_out_dir: Path, index: Optional[PathIndex] = None) -> str:
+    """Copia las imágenes referenciadas (deduplicadas por contenido) y reescribe el markdown a `images/<hash>`.
+
+    `index` permite reutilizar el índice de `md_base_dir` entre páginas de una misma salida.
+    """
     def repl(m: re.Match) -> str:
+        nonlocal index
         orig = m.group(1)
         src = (md_base_dir / orig).resolve()
-        if not src.exists():
-            cands = list(md_base_dir.rglob(Path(orig).name))
-            if cands: src = cands[0]
-        if src.exists():
-            dst = images_out_dir / f"p{page_num}_{Path(orig).name}"
-            if not dst.exists(): dst.parent.mkdir(parents=True, exist_ok=True); shutil.copyfile(src, dst)
-            return m.group(0).replace(orig, f"images/{dst.name}")
-        return m.group(0)
-    return img_re.sub(repl, md_text)
+        if not src.is_file():
+            if index is None: index = PathIndex.of_dir(md_base_dir)
+            found = index.resolve(orig)
+            if not found: return m.group(0)
+            src = md_base_dir / found
+        return m.group(0).replace(orig, f"images/{store_image(src.read_bytes(), orig, images_out_dir)}")
+    return _IMG_RE.sub(repl, md_text)
 
 
 def find_or_make_md(out_dir: Path) -> Optional[Path]:
@@ -109,29 +315,20 @@ def find_md_in_zip(zf: zipfile.ZipFile) -> Optional[str]:
 
 
 def build_annotated_from_zip(mineru_zip: Path, images_out_dir: Path, page_num: int) -> Optional[str]:
+    """Markdown anotado de una página leyendo directamente el ZIP de MinerU (sin extraerlo)."""
     try:
         with zipfile.ZipFile(mineru_zip, "r") as zf:
             md_entry = find_md_in_zip(zf)
             if not md_entry: return None
             raw_md = zf.read(md_entry).decode("utf-8", errors="ignore")
             md_dir = normalize_zip_path(str(Path(md_entry).parent))
-            # reescribir imágenes extrayéndolas del ZIP
-            img_re = re.compile(r"!\[[^\]]*\]\(([^)]+)\)")
-            nl = {n.lower(): n for n in zf.namelist()}
+            index = PathIndex(zf.namelist())
             def repl(m: re.Match) -> str:
                 orig = m.group(1)
-                rel = normalize_zip_path(orig)
-                cand = f"{md_dir}/{rel}" if md_dir else rel
-                entry = nl.get(cand.lower())
-                if not entry:
-                    base = Path(rel).name.lower()
-                    entry = next((n for n in zf.namelist() if n.lower().endswith(f"/{base}") or n.lower().endswith(base)), None)
+                entry = index.resolve(orig, md_dir)
                 if not entry: return m.group(0)
-                dst = images_out_dir / f"p{page_num}_{Path(orig).name}"
-                if not dst.exists():
-                    with zf.open(entry, "r") as src, open(dst, "wb") as out: shutil.copyfileobj(src, out)
-                return m.group(0).replace(orig, f"images/{dst.name}")
-            rewritten = img_re.sub(repl, raw_md)
+                return m.group(0).replace(orig, f"images/{store_image(zf.read(entry), orig, images_out_dir)}")
+            rewritten = _IMG_RE.sub(repl, raw_md)
             return annotate_single_page_markers(rewritten, page_num)
     except Exception:
         return None
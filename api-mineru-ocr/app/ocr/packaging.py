@@ -0,0 +1,160 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, Optional
+import base64
+import json
+import os
+import struct
+import tarfile
+import time
+import zipfile
+import zlib
+
+# Formatos de salida de /ocr
+OUTPUT_FORMATS = ("zip", "zip-stream", "tar", "json")
+
+# Extensiones ya comprimidas: se guardan con ZIP_STORED (deflate no reduce su tamaño y cuesta CPU)
+COMPRESSED_SUFFIXES = frozenset({".png", ".jpg", ".jpeg", ".gif", ".webp", ".jp2", ".zip", ".gz", ".pdf"})
+
+_CHUNK = 1024 * 1024
+_UTF8_FLAG = 0x0800
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+
+def _list_files(src_dir: Path) -> list[tuple[str, Path]]:
+    out: list[tuple[str, Path]] = []
+    for root, _, files in os.walk(src_dir):
+        for name in sorted(files):
+            fp = Path(root) / name
+            out.append((fp.relative_to(src_dir).as_posix(), fp))
+    return sorted(out)
+
+
+def _dos_datetime(ts: float) -> tuple[int, int]:
+    t = time.localtime(max(ts, 315532800))  # ZIP no representa fechas anteriores a 1980
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _Entry:
+    __slots__ = ("arcname", "path", "method", "crc", "size", "csize", "payload", "dos_time", "dos_date", "offset")
+
+    def __init__(self, arcname: str, path: Path):
+        self.arcname = arcname
+        self.path = path
+        self.method = zipfile.ZIP_STORED
+        self.crc = self.size = self.csize = self.offset = 0
+        self.payload: Optional[bytes] = None  # datos deflate ya comprimidos; None = se copian del disco
+        self.dos_time = self.dos_date = 0
+
+
+def _prepare(arcname: str, path: Path, level: int) -> _Entry:
+    """Calcula CRC y tamaños de una entrada; los textos se comprimen aquí (zlib libera el GIL)."""
+    entry = _Entry(arcname, path)
+    st = path.stat()
+    entry.size = st.st_size
+    entry.dos_time, entry.dos_date = _dos_datetime(st.st_mtime)
+    if path.suffix.lower() in COMPRESSED_SUFFIXES:
+        crc = 0
+        with open(path, "rb") as f:
+            while chunk := f.read(_CHUNK): crc = zlib.crc32(chunk, crc)
+        entry.crc, entry.csize = crc, entry.size
+        return entry
+    data = path.read_bytes()
+    comp = zlib.compressobj(level, zlib.DEFLATED, -15)
+    entry.payload = comp.compress(data) + comp.flush()
+    entry.method, entry.crc, entry.csize = zipfile.ZIP_DEFLATED, zlib.crc32(data), len(entry.payload)
+    return entry
+
+
+def iter_zip(src_dir: Path, workers: int = 4, level: int = 6) -> Iterator[bytes]:
+    """Genera un ZIP de `src_dir` por fragmentos, sin archivo intermedio ni seeks.
+
+    Las entradas de texto se comprimen en paralelo en `workers` hilos y los medios ya comprimidos
+    se copian tal cual (ZIP_STORED). Los ZIP que exceden los límites de ZIP32 (65535 entradas o
+    4 GiB) se delegan en `zipfile` con ZIP64.
+    """
+    files = _list_files(src_dir)
+    if len(files) >= 0xFFFF or sum(fp.stat().st_size for _, fp in files) >= _ZIP32_LIMIT:
+        yield from _iter_zip64(src_dir, files); return
+    offset = 0; central: list[bytes] = []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ocr-zip") as pool:
+        for entry in pool.map(lambda f: _prepare(f[0], f[1], level), files):
+            name = entry.arcname.encode("utf-8")
+            header = struct.pack(
+                "<IHHHHHIIIHH", 0x04034B50, 20, _UTF8_FLAG, entry.method, entry.dos_time, entry.dos_date,
+                entry.crc, entry.csize, entry.size, len(name), 0,
+            ) + name
+            entry.offset = offset
+            yield header; offset += len(header)
+            if entry.payload is not None:
+                yield entry.payload
+            else:
+                with open(entry.path, "rb") as f:
+                    while chunk := f.read(_CHUNK): yield chunk
+            offset += entry.csize
+            central.append(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, 20, 20, _UTF8_FLAG, entry.method, entry.dos_time, entry.dos_date,
+                entry.crc, entry.csize, entry.size, len(name), 0, 0, 0, 0, 0o100644 << 16, entry.offset,
+            ) + name)
+            entry.payload = None  # liberar memoria en cuanto se emite
+    cd = b"".join(central)
+    if offset + len(cd) >= _ZIP32_LIMIT:
+        raise ValueError("ZIP excede 4 GiB tras comprimir")
+    yield cd + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(cd), offset, 0)
+
+
+class _Sink:
+    """Objeto archivo de solo escritura para que zipfile/tarfile emitan fragmentos en un generador."""
+
+    def __init__(self):
+        self.parts: list[bytes] = []; self.pos = 0
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data)); self.pos += len(data); return len(data)
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        parts, self.parts = self.parts, []
+        yield from parts
+
+
+def _iter_zip64(src_dir: Path, files: list[tuple[str, Path]]) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:  # type: ignore[arg-type]
+        for arcname, fp in files:
+            method = zipfile.ZIP_STORED if fp.suffix.lower() in COMPRESSED_SUFFIXES else zipfile.ZIP_DEFLATED
+            zf.write(fp, arcname=arcname, compress_type=method)
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def write_zip(src_dir: Path, zip_path: Path, workers: int = 4, level: int = 6) -> Path:
+    with open(zip_path, "wb") as out:
+        for chunk in iter_zip(src_dir, workers, level): out.write(chunk)
+    return zip_path
+
+
+def write_tar(src_dir: Path, tar_path: Path) -> Path:
+    """TAR sin compresión: empaquetado de coste mínimo para clientes que comprimen por su cuenta."""
+    with tarfile.open(tar_path, "w") as tf:
+        for arcname, fp in _list_files(src_dir): tf.add(fp, arcname=arcname)
+    return tar_path
+
+
+def build_json_result(src_dir: Path, include_images: bool) -> dict[str, Any]:
+    """Resultado sin archivos: markdown consolidado, rutas por página e imágenes en base64 (u omitidas)."""
+    md = src_dir / "upload.md"; routing = src_dir / "routing.json"
+    images_dir = src_dir / "images"
+    names = sorted(p.name for p in images_dir.iterdir() if p.is_file()) if images_dir.is_dir() else []
+    return {
+        "markdown": md.read_text("utf-8") if md.is_file() else "",
+        "routing": json.loads(routing.read_text("utf-8")) if routing.is_file() else [],
+        "images": {n: base64.b64encode((images_dir / n).read_bytes()).decode("ascii") for n in names} if include_images else None,
+        "image_names": names,
+    }
@@ -0,0 +1,263 @@
+from __future__ import annotations
+from fastapi import HTTPException
+from pathlib import Path
+from typing import Awaitable, Callable, Optional, Tuple
+import asyncio
+import json
+import math
+import time
+import uuid
+import zipfile
+from ..config import get_settings
+from app.metrics import PAGES_ACTIVE, PAGES_ROUTED, PAGES_DONE, STAGE_SECONDS, stage_timer
+from .mineru_runner import (
+    run_mineru_async,
+    MinerUTimeout,
+    open_pdf,
+    write_single_page,
+    analyze_text_layer,
+    text_layer_to_markdown,
+    merge_page_pdfs,
+    split_mineru_output_by_page,
+    find_or_make_md,
+    rewrite_and_copy_images,
+    PathIndex,
+    annotate_single_page_markers,
+    build_annotated_from_zip,
+    split_annotated_pages,
+)
+from .packaging import write_zip
+from .worker_pool import get_worker_pool
+from .cache import get_ocr_cache
+from .scheduler import get_vram_scheduler
+from .batching import PageBatcher, get_chunk_sizer
+
+# Callbacks de progreso: total de páginas tras el split y (página, markdown anotado, ruta) al terminar cada una
+OnPages = Callable[[int], None]
+OnPage = Callable[[int, str, str], Optional[Awaitable[None]]]
+
+# Rutas por página: "text" (capa de texto del PDF), "cache" (caché OCR), "ocr" (MinerU)
+# o "timeout" (MinerU superó el tiempo límite; la página se omite del resultado)
+ROUTE_TEXT, ROUTE_CACHE, ROUTE_OCR, ROUTE_TIMEOUT = "text", "cache", "ocr", "timeout"
+
+
+async def run_mineru_page(pdf: Path, out_dir: Path, vram_limit: int, timeout: Optional[float] = None):
+    """Ejecuta MinerU sobre una página: pool residente si está activo, CLI por subprocess si no.
+
+    Cancelar la tarea o superar `timeout` (MinerUTimeout) mata el proceso que atiende la página.
+    """
+    pool = get_worker_pool()
+    if pool is not None:
+        return await pool.run(pdf, out_dir, timeout)
+    settings = get_settings()
+    return await run_mineru_async(pdf, out_dir, settings.GPU_ENABLED, settings.GPU_DEVICE, vram_limit, settings.GPU_BACKEND, settings.MINERU_LANG, timeout)
+
+
+def skipped_page_markdown(pnum: int) -> str:
+    return annotate_single_page_markers(f"> Página {pnum} omitida: MinerU superó el tiempo límite.", pnum)
+
+
+def read_archived_pages(zip_path: Path) -> list[tuple[int, str]]:
+    """Páginas (número, markdown anotado) de un ZIP ya generado, según su `routing.json`."""
+    with zipfile.ZipFile(zip_path, "r") as zf:
+        names = set(zf.namelist())
+        md = zf.read("upload.md").decode("utf-8") if "upload.md" in names else ""
+        routing = json.loads(zf.read("routing.json")) if "routing.json" in names else []
+    by_page = split_annotated_pages(md)
+    pnums = sorted({int(r["page"]) for r in routing} | set(by_page))
+    return [(p, by_page.get(p, "")) for p in pnums]
+
+
+async def process_pdf(
+    in_path: Path,
+    work_dir: Path,
+    vram_limit: int,
+    concurrency: int,
+    per_worker_mb: Optional[int] = None,
+    doc_key: Optional[str] = None,
+    on_pages: Optional[OnPages] = None,
+    on_page: Optional[OnPage] = None,
+    archive: bool = True,
+) -> Tuple[Path, int, dict[int, str]]:
+    """Pipeline OCR completo sobre un PDF ya guardado en disco.
+
+    Corta el PDF página a página de forma perezosa (cada página entra en proceso en cuanto se
+    escribe). Las páginas con una capa de texto de calidad se extraen sin OCR; el resto pasa por
+    MinerU por página o por lotes adaptativos (con caché, planificador global de VRAM y semáforo
+    por documento). Anota el markdown y empaqueta `work_dir/upload.zip` (con `routing.json`).
+    Las páginas que superan `MINERU_PAGE_TIMEOUT_S` se marcan como omitidas (ruta `timeout`)
+    y el resto del documento se entrega igualmente. Cancelar la corrutina mata los procesos
+    MinerU en curso y libera sus reservas de VRAM.
+    Devuelve `(zip_path, páginas, ruta por página)`; un acierto de documento completo devuelve
+    rutas vacías y reproduce `on_pages`/`on_page` (ruta `cache`) desde el ZIP guardado.
+    Con `archive=False` no se genera el ZIP (ni se guarda el documento en caché) y la ruta
+    devuelta es el directorio `work_dir/final`, para empaquetar en otro formato.
+    """
+    settings = get_settings()
+    cache = get_ocr_cache()
+    src_zip = work_dir / "upload.zip"; final_root = work_dir / "final"
+    if cache and doc_key and await asyncio.to_thread(cache.get_document, doc_key, src_zip):
+        # acierto de documento completo: sin split ni MinerU; el progreso por página sale del ZIP guardado
+        cached_pages = await asyncio.to_thread(read_archived_pages, src_zip)
+        if on_pages: on_pages(len(cached_pages))
+        for pnum, md in cached_pages:
+            if on_page:
+                pending = on_page(pnum, md, ROUTE_CACHE)
+                if pending is not None: await pending
+        if archive: return src_zip, len(cached_pages), {}
+        await asyncio.to_thread(lambda: zipfile.ZipFile(src_zip, "r").extractall(final_root))
+        return final_root, len(cached_pages), {}
+
+    per_worker = per_worker_mb if per_worker_mb is not None else settings.MINERU_VRAM_PER_WORKER_MB
+    allowed_by_vram = (vram_limit // per_worker) if settings.GPU_ENABLED else concurrency
+    if allowed_by_vram < 1:
+        raise HTTPException(400, f"VRAM insuficiente para 1 worker (per_worker={per_worker}MB)")
+
+    pages_src_dir = work_dir / "pages_src"
+    reader = await asyncio.to_thread(open_pdf, in_path)
+    total_pages = len(reader.pages) if reader is not None else 0
+    if not total_pages:
+        raise HTTPException(500, "No se pudieron generar páginas del PDF")
+    if on_pages: on_pages(total_pages)
+    PAGES_ACTIVE.inc(total_pages)  # gauge de progreso (suma de todas las requests y procesos)
+    pending_pages = total_pages
+
+    final_pages = final_root / "pages"; images_dir = final_root / "images"
+    final_root.mkdir(parents=True, exist_ok=True); final_pages.mkdir(parents=True, exist_ok=True)
+
+    max_workers = max(1, min(concurrency, allowed_by_vram))
+    sem = asyncio.Semaphore(max_workers)
+    scheduler = get_vram_scheduler(); doc_id = uuid.uuid4().hex
+    sizer = get_chunk_sizer()
+    page_timeout = settings.MINERU_PAGE_TIMEOUT_S
+
+    async def run_reserved(pdf: Path, out_dir: Path, pages: int):
+        """Una invocación de MinerU con slot del documento y reserva global de VRAM."""
+        timeout = page_timeout * pages if page_timeout > 0 else None
+        async with sem:
+            if scheduler is not None:
+                # La espera por VRAM ya se mide en `ocr_scheduler_wait_seconds`; aquí solo cuenta MinerU
+                async with scheduler.reserve(doc_id, per_worker):
+                    return await run_timed(pdf, out_dir, pages, timeout)
+            return await run_timed(pdf, out_dir, pages, timeout)
+
+    async def run_timed(pdf: Path, out_dir: Path, pages: int, timeout: Optional[float]):
+        t0 = time.perf_counter()
+        result = await run_mineru_page(pdf, out_dir, vram_limit, timeout)
+        elapsed = time.perf_counter() - t0
+        sizer.observe(pages, elapsed)
+        for _ in range(pages): STAGE_SECONDS.labels(stage="mineru_page").observe(elapsed / pages)
+        return result
+
+    async def run_single(pnum: int, pdf: Path) -> str:
+        out_dir = work_dir / "pages_out" / f"p{pnum:04d}"; out_dir.mkdir(parents=True, exist_ok=True)
+        _md, mineru_zip = await run_reserved(pdf, out_dir, 1)
+        with stage_timer("annotate"):
+            return await annotate_output(pnum, out_dir, mineru_zip)
+
+    async def annotate_output(pnum: int, out_dir: Path, mineru_zip: Optional[Path]) -> str:
+        # ZIP de MinerU (CLI) leído sin extraer; si no hay ZIP o no trae markdown, salida en directorio (pool)
+        annotated = await asyncio.to_thread(build_annotated_from_zip, mineru_zip, images_dir, pnum) if mineru_zip else None
+        if annotated is None:
+            md = await asyncio.to_thread(find_or_make_md, out_dir)
+            if md:
+                raw_md = await asyncio.to_thread(md.read_text, "utf-8", "ignore")
+                rewritten = await asyncio.to_thread(rewrite_and_copy_images, raw_md, md.parent, images_dir)
+                annotated = await asyncio.to_thread(annotate_single_page_markers, rewritten, pnum)
+        return annotated or ""
+
+    async def run_chunk(chunk: list[tuple[int, Path]]) -> dict[int, str]:
+        if len(chunk) == 1:
+            pnum, pdf = chunk[0]
+            return {pnum: await run_single(pnum, pdf)}
+        first = chunk[0][0]
+        chunk_pdf = await asyncio.to_thread(merge_page_pdfs, [pdf for _, pdf in chunk], work_dir / "chunks_src" / f"c{first:04d}.pdf")
+        out_dir = work_dir / "chunks_out" / f"c{first:04d}"; out_dir.mkdir(parents=True, exist_ok=True)
+        await run_reserved(chunk_pdf, out_dir, len(chunk))
+        split = await asyncio.to_thread(split_mineru_output_by_page, out_dir, len(chunk))
+        if split is None:  # salida sin content_list: se reprocesa página a página
+            mds = await asyncio.gather(*[run_single(pnum, pdf) for pnum, pdf in chunk])
+            return {pnum: md for (pnum, _), md in zip(chunk, mds)}
+        base_dir, page_mds = split
+        index = await asyncio.to_thread(PathIndex.of_dir, base_dir)  # una vez por lote
+        out: dict[int, str] = {}
+        for (pnum, _), md in zip(chunk, page_mds):
+            with stage_timer("annotate"):
+                rewritten = await asyncio.to_thread(rewrite_and_copy_images, md, base_dir, images_dir, index)
+                out[pnum] = annotate_single_page_markers(rewritten, pnum)
+        return out
+
+    batcher: Optional[PageBatcher] = None
+    if settings.MINERU_BATCH_ENABLED:
+        vram_cap = max(1, per_worker // settings.MINERU_BATCH_VRAM_PER_PAGE_MB) if settings.GPU_ENABLED else None
+        # No agrupar tanto que queden workers ociosos: al menos un lote por slot disponible
+        parallel_cap = math.ceil(total_pages / max_workers)
+        batcher = PageBatcher(total_pages, sizer.size(min(parallel_cap, vram_cap or parallel_cap)), run_chunk)
+
+    async def annotate_page(pnum: int, pdf: Path, text: Optional[str]) -> Tuple[str, str]:
+        if text is not None:  # capa de texto suficiente: sin OCR
+            if batcher: batcher.skip()
+            with stage_timer("annotate"):
+                return annotate_single_page_markers(text_layer_to_markdown(text), pnum), ROUTE_TEXT
+        page_key = await asyncio.to_thread(cache.page_key, pdf) if cache else None
+        if cache and page_key:
+            cached = await asyncio.to_thread(cache.get_page, page_key, images_dir, pnum)
+            if cached is not None:
+                if batcher: batcher.skip()
+                return cached, ROUTE_CACHE
+        try:
+            annotated = await batcher.submit(pnum, pdf) if batcher else await run_single(pnum, pdf)
+        except MinerUTimeout:
+            return skipped_page_markdown(pnum), ROUTE_TIMEOUT
+        if annotated and cache and page_key: await asyncio.to_thread(cache.put_page, page_key, annotated, images_dir, pnum)
+        return annotated, ROUTE_OCR
+
+    async def process_one(pnum: int, pdf: Path, text: Optional[str]) -> Tuple[int, str]:
+        annotated, route = await annotate_page(pnum, pdf, text)
+        nonlocal pending_pages
+        routes[pnum] = route; PAGES_ROUTED.labels(route=route).inc(); PAGES_DONE.inc()
+        PAGES_ACTIVE.dec(); pending_pages -= 1
+        if on_page:
+            pending = on_page(pnum, annotated, route)
+            if pending is not None: await pending
+        return (pnum, annotated)
+
+    def cut_page(index: int) -> Tuple[Path, Optional[str], Optional[dict]]:
+        # Corte y análisis de la capa de texto en el mismo hilo: el PdfReader no es thread-safe
+        with stage_timer("split"):
+            pdf = write_single_page(reader, index, pages_src_dir)
+            if not settings.OCR_TEXT_LAYER_ENABLED:
+                return pdf, None, None
+            score, coverage, text = analyze_text_layer(reader.pages[index], settings.OCR_TEXT_LAYER_MIN_CHARS)
+        use_text = score >= settings.OCR_TEXT_LAYER_THRESHOLD
+        return pdf, (text if use_text else None), {"score": round(score, 3), "image_coverage": round(coverage, 3)}
+
+    routes: dict[int, str] = {}
+    scores: dict[int, dict] = {}
+    tasks: list[asyncio.Task] = []
+    try:
+        # Split perezoso: cada página se lanza en cuanto se escribe, mientras se corta el resto
+        for i in range(total_pages):
+            pdf, text, score = await asyncio.to_thread(cut_page, i)
+            if score is not None: scores[i + 1] = score
+            tasks.append(asyncio.create_task(process_one(i + 1, pdf, text)))
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks: t.cancel()
+        if batcher: batcher.cancel()
+        raise
+    finally:
+        PAGES_ACTIVE.dec(pending_pages)  # páginas canceladas o fallidas
+    parts: list[str] = []
+    for pnum, md in sorted(results, key=lambda x: x[0]):
+        if md: parts.append(md)
+    await asyncio.to_thread((final_root / "upload.md").write_text, "\n\n".join(parts), "utf-8")
+    routing = [{"page": p, "route": routes[p], **scores.get(p, {})} for p in sorted(routes)]
+    await asyncio.to_thread((final_root / "routing.json").write_text, json.dumps(routing, indent=2), "utf-8")
+    if not archive:
+        return final_root, total_pages, routes
+    with stage_timer("zip"):
+        await asyncio.to_thread(write_zip, final_root, src_zip, settings.OCR_ZIP_WORKERS, settings.OCR_ZIP_LEVEL)
+    complete = all(md for _, md in results) and ROUTE_TIMEOUT not in routes.values()
+    if cache and doc_key and complete: await asyncio.to_thread(cache.put_document, doc_key, src_zip)
+    return src_zip, total_pages, routes
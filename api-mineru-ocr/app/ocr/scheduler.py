@@ -0,0 +1,165 @@
+from __future__ import annotations
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator, Optional
+import asyncio
+import fcntl
+import os
+import time
+import uuid
+from ..config import get_settings
+from app.metrics import SCHED_QUEUE_DEPTH, SCHED_WAIT_SECONDS, SCHED_VRAM_RESERVED
+
+
+class _Waiter:
+    __slots__ = ("future", "mb", "t0")
+
+    def __init__(self, future: asyncio.Future, mb: int):
+        self.future = future
+        self.mb = mb
+        self.t0 = time.perf_counter()
+
+
+class SharedVRAMLedger:
+    """Libro de reservas de VRAM compartido entre procesos del mismo nodo (modo multi-worker).
+
+    Cada línea de `path` es `token pid mb`; las lecturas/escrituras se serializan con `flock` y
+    las reservas de procesos muertos se descartan al leer, así un worker caído no fuga VRAM.
+    """
+
+    def __init__(self, path: Path, budget_mb: int, poll_s: float = 0.05, max_poll_s: float = 0.5):
+        self.path = path
+        self.budget_mb = budget_mb
+        self.poll_s = poll_s
+        self.max_poll_s = max_poll_s
+        self._cleanup: set[asyncio.Future] = set()  # liberaciones pendientes de acquire cancelados
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch(exist_ok=True)
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0); return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def _update(self, token: str, mb: int) -> bool:
+        """Bajo lock: con `mb > 0` intenta añadir la reserva; con `mb == 0` la elimina."""
+        with open(self.path, "r+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                entries = [line.split() for line in f.read().splitlines() if line.strip()]
+                entries = [e for e in entries if len(e) == 3 and e[0] != token and self._alive(int(e[1]))]
+                granted = mb > 0 and sum(int(e[2]) for e in entries) + mb <= self.budget_mb
+                if granted: entries.append([token, str(os.getpid()), str(mb)])
+                f.seek(0); f.truncate(); f.write("".join(" ".join(e) + "\n" for e in entries)); f.flush()
+                return granted
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    async def acquire(self, mb: int) -> str:
+        token = uuid.uuid4().hex; delay = self.poll_s
+        while True:
+            update = asyncio.ensure_future(asyncio.to_thread(self._update, token, mb))
+            try:
+                if await asyncio.shield(update): return token
+            except asyncio.CancelledError:
+                # El hilo sigue y puede llegar a escribir la reserva: se deshace cuando termine
+                update.add_done_callback(lambda _: self._release_later(token))
+                raise
+            await asyncio.sleep(delay); delay = min(delay * 2, self.max_poll_s)
+
+    def _release_later(self, token: str) -> None:
+        task = asyncio.ensure_future(asyncio.to_thread(self.release, token))
+        self._cleanup.add(task); task.add_done_callback(self._cleanup.discard)
+
+    def release(self, token: str) -> None:
+        self._update(token, 0)
+
+
+class VRAMScheduler:
+    """Admisión global de páginas según un presupuesto de VRAM compartido por todas las requests.
+
+    Cada página reserva `mb` antes de ejecutar MinerU y los libera al terminar. Las páginas en
+    espera se agrupan por documento y se despachan en round-robin entre documentos, de modo que
+    un PDF de cientos de páginas no bloquea a los documentos pequeños que llegan después.
+    Con `ledger` (varios procesos por nodo), la página concedida localmente además reserva su
+    VRAM en el libro compartido, de modo que la suma de todos los procesos respeta el presupuesto.
+    """
+
+    def __init__(self, budget_mb: int, ledger: Optional[SharedVRAMLedger] = None):
+        self.budget_mb = budget_mb
+        self._ledger = ledger
+        self._available = budget_mb
+        self._queues: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+
+    @asynccontextmanager
+    async def reserve(self, doc_id: str, mb: int) -> AsyncIterator[None]:
+        mb = max(1, min(mb, self.budget_mb))  # una reserva mayor al presupuesto nunca se atendería
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), mb)
+        self._queues.setdefault(doc_id, deque()).append(waiter)
+        SCHED_QUEUE_DEPTH.inc()
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(mb)  # concedida justo antes de cancelar
+            else:
+                self._discard(doc_id, waiter)
+            raise
+        token: Optional[str] = None
+        try:
+            if self._ledger is not None:
+                token = await self._ledger.acquire(mb)
+            yield
+        finally:
+            if token is not None: await asyncio.to_thread(self._ledger.release, token)
+            self._release(mb)
+
+    def _release(self, mb: int) -> None:
+        self._available += mb
+        SCHED_VRAM_RESERVED.set(self.budget_mb - self._available)
+        self._dispatch()
+
+    def _discard(self, doc_id: str, waiter: _Waiter) -> None:
+        q = self._queues.get(doc_id)
+        if q is not None and waiter in q:
+            q.remove(waiter); SCHED_QUEUE_DEPTH.dec()
+            if not q: del self._queues[doc_id]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # Recorre documentos en orden; al conceder una página, el documento pasa al final
+        progressed = True
+        while progressed:
+            progressed = False
+            for doc_id, q in self._queues.items():
+                waiter = q[0]
+                cancelled = waiter.future.done()  # cancelada, pendiente de _discard
+                if not cancelled and waiter.mb > self._available: continue
+                q.popleft(); SCHED_QUEUE_DEPTH.dec()
+                if q: self._queues.move_to_end(doc_id)
+                else: del self._queues[doc_id]
+                progressed = True
+                if cancelled: break
+                self._available -= waiter.mb
+                SCHED_VRAM_RESERVED.set(self.budget_mb - self._available)
+                SCHED_WAIT_SECONDS.observe(time.perf_counter() - waiter.t0)
+                waiter.future.set_result(None)
+                break
+
+
+@lru_cache()
+def get_vram_scheduler() -> Optional[VRAMScheduler]:
+    settings = get_settings()
+    if not settings.GPU_ENABLED:
+        return None
+    ledger = None
+    if settings.OCR_PROCESS_WORKERS > 1:
+        ledger = SharedVRAMLedger(Path(settings.OCR_RUNTIME_DIR) / "vram.ledger", settings.MINERU_VRAM_BUDGET_MB)
+    return VRAMScheduler(settings.MINERU_VRAM_BUDGET_MB, ledger)
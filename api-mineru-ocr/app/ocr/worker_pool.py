@@ -0,0 +1,237 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Optional, Tuple
+from multiprocessing.connection import Connection
+import multiprocessing as mp
+import asyncio
+import logging
+import os
+import time
+import traceback
+from ..config import Settings
+from app.metrics import register_process, unregister_process
+from .mineru_runner import collect_mineru_outputs, MinerUTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCrashed(RuntimeError):
+    """El proceso worker murió (OOM, segfault, kill) mientras atendía una página."""
+
+
+def _warmup_models(backend: str, lang: str) -> None:
+    # Fuerza la carga de modelos al arrancar el worker; si la API interna de MinerU
+    # cambia, los modelos se cargarán igualmente (una sola vez) en la primera página.
+    try:
+        if backend == "pipeline":
+            from mineru.backend.pipeline.pipeline_analyze import ModelSingleton  # type: ignore
+            ModelSingleton().get_model(lang=lang, formula_enable=True, table_enable=True)
+    except Exception:
+        logger.warning("Warm-up de MinerU no disponible; carga diferida a la primera página", exc_info=True)
+
+
+def _worker_main(conn: Connection, device: str, backend: str, lang: str, vram_mb: int) -> None:
+    """Bucle del proceso worker: importa MinerU una vez, mantiene los modelos en memoria
+    y procesa trabajos `(input_pdf, out_dir)` recibidos por el pipe hasta recibir `None`."""
+    os.environ.setdefault("MINERU_MODEL_SOURCE", "local")
+    os.environ["MINERU_DEVICE_MODE"] = device
+    if device != "cpu":
+        os.environ["MINERU_VIRTUAL_VRAM_SIZE"] = str(max(1, vram_mb // 1024))
+    try:
+        from mineru.cli.common import do_parse, read_fn  # type: ignore
+    except Exception:
+        conn.send(("error", traceback.format_exc())); return
+    _warmup_models(backend, lang)
+    conn.send(("ready", os.getpid()))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None: break
+        input_file, out_dir = job
+        try:
+            pdf = Path(input_file)
+            do_parse(out_dir, [pdf.stem], [read_fn(pdf)], [lang], backend=backend, parse_method="ocr")
+            conn.send(("ok", None))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+
+
+class _Worker:
+    def __init__(self, ctx, index: int, device: str, backend: str, lang: str, vram_mb: int, start_timeout: float):
+        self.index = index
+        self._ctx = ctx
+        self._args = (device, backend, lang, vram_mb)
+        self._start_timeout = start_timeout
+        self.proc: Optional[mp.process.BaseProcess] = None
+        self.conn: Optional[Connection] = None
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.is_alive()
+
+    def start(self) -> None:
+        parent, child = self._ctx.Pipe()
+        self.proc = self._ctx.Process(target=_worker_main, args=(child, *self._args), name=f"mineru-worker-{self.index}")
+        self.proc.start(); child.close()
+        self.conn = parent
+        status, payload = self._recv(self._start_timeout)
+        if status != "ready":
+            self.stop()
+            raise RuntimeError(f"MinerU worker {self.index} no pudo iniciar:\n{payload}")
+        logger.info("MinerU worker %s listo (pid=%s)", self.index, payload)
+        register_process(self.proc.pid, f"mineru-worker-{self.index}")  # VRAM real por worker en /metrics
+
+    def kill(self) -> None:
+        """Mata el proceso en curso; el hilo bloqueado en `run` sale con WorkerCrashed."""
+        if self.proc is not None and self.proc.is_alive():
+            self.proc.kill()
+
+    def restart(self) -> None:
+        self.stop()
+        self.start()
+
+    def stop(self) -> None:
+        if self.conn is not None:
+            try: self.conn.send(None)
+            except Exception: pass
+        if self.proc is not None:
+            unregister_process(self.proc.pid)
+            self.proc.join(5)
+            if self.proc.is_alive():
+                self.proc.kill(); self.proc.join(5)
+        if self.conn is not None:
+            self.conn.close()
+        self.proc, self.conn = None, None
+
+    def run(self, input_file: Path, out_dir: Path) -> None:
+        assert self.conn is not None
+        try:
+            self.conn.send((str(input_file), str(out_dir)))
+        except (BrokenPipeError, OSError) as e:
+            raise WorkerCrashed(f"MinerU worker {self.index} no disponible: {e}") from e
+        status, payload = self._recv(None)
+        if status != "ok":
+            raise RuntimeError(payload or "MinerU worker error")
+
+    def _recv(self, timeout: Optional[float]):
+        assert self.conn is not None and self.proc is not None
+        deadline = time.monotonic() + timeout if timeout else None
+        while not self.conn.poll(0.5):
+            if not self.proc.is_alive():
+                raise WorkerCrashed(f"MinerU worker {self.index} terminó (exitcode={self.proc.exitcode})")
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"MinerU worker {self.index} no respondió en {timeout}s")
+        try:
+            return self.conn.recv()
+        except EOFError as e:
+            raise WorkerCrashed(f"MinerU worker {self.index} cerró el pipe") from e
+
+
+class MinerUWorkerPool:
+    """Pool de procesos MinerU residentes.
+
+    Cada worker carga el pipeline una sola vez y atiende páginas por un pipe dedicado.
+    Los workers caídos se reinician antes de recibir el siguiente trabajo. Una página cancelada
+    o que supera `timeout` mata su worker; el reinicio ocurre en segundo plano para no retener
+    la reserva de VRAM ni el slot de la request mientras se recargan los modelos.
+    """
+
+    def __init__(self, size: int, device: str, backend: str, vram_per_worker_mb: int, lang: str = "latin", start_timeout: float = 600):
+        ctx = mp.get_context("spawn")  # CUDA no soporta fork tras inicializarse
+        self.size = size
+        self._workers = [_Worker(ctx, i, device, backend, lang, vram_per_worker_mb, start_timeout) for i in range(size)]
+        self._idle: asyncio.Queue[_Worker] = asyncio.Queue()
+        self._recycling: set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        await asyncio.gather(*[asyncio.to_thread(w.start) for w in self._workers])
+        for w in self._workers: self._idle.put_nowait(w)
+
+    async def stop(self) -> None:
+        for task in self._recycling: task.cancel()
+        await asyncio.gather(*self._recycling, return_exceptions=True)
+        await asyncio.gather(*[asyncio.to_thread(w.stop) for w in self._workers])
+
+    async def run(self, input_file: Path, out_dir: Path, timeout: Optional[float] = None) -> Tuple[Optional[Path], Optional[Path]]:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        worker = await self._idle.get()
+        recycle: Optional[asyncio.Future] = None
+        try:
+            if not worker.alive():
+                logger.warning("Reiniciando MinerU worker %s", worker.index)
+                await asyncio.to_thread(worker.restart)
+            job = asyncio.ensure_future(asyncio.to_thread(worker.run, input_file, out_dir))
+            try:
+                await asyncio.wait_for(asyncio.shield(job), timeout)
+            except WorkerCrashed:
+                logger.warning("MinerU worker %s cayó; reiniciando", worker.index, exc_info=True)
+                await asyncio.to_thread(worker.restart)
+                raise
+            except asyncio.TimeoutError:
+                worker.kill(); recycle = job
+                raise MinerUTimeout(f"MinerU superó {timeout}s en {input_file.name}") from None
+            except asyncio.CancelledError:
+                worker.kill(); recycle = job
+                raise
+        finally:
+            if recycle is None:
+                self._idle.put_nowait(worker)
+            else:
+                task = asyncio.create_task(self._recycle(worker, recycle))
+                self._recycling.add(task); task.add_done_callback(self._recycling.discard)
+        return await asyncio.to_thread(collect_mineru_outputs, out_dir)
+
+    async def _recycle(self, worker: _Worker, job: asyncio.Future) -> None:
+        # Espera a que el hilo bloqueado detecte la muerte del proceso y recarga el worker
+        try:
+            await asyncio.gather(job, return_exceptions=True)
+            await asyncio.to_thread(worker.restart)
+        except Exception:
+            logger.exception("No se pudo reiniciar el MinerU worker %s", worker.index)
+        finally:
+            self._idle.put_nowait(worker)
+
+
+_pool: Optional[MinerUWorkerPool] = None
+
+
+def pool_size_for(settings: Settings) -> int:
+    """Workers MinerU de este proceso; con varios procesos uvicorn el total del nodo se reparte."""
+    procs = max(1, settings.OCR_PROCESS_WORKERS)
+    if not settings.GPU_ENABLED:
+        return max(1, settings.MINERU_POOL_CPU_WORKERS // procs)
+    return max(1, settings.MINERU_VRAM_BUDGET_MB // settings.MINERU_VRAM_PER_WORKER_MB // procs)
+
+
+async def start_worker_pool(settings: Settings) -> None:
+    """Arranca el pool global; si MinerU no puede cargarse se usa el modo subprocess."""
+    global _pool
+    if settings.MINERU_MODE != "pool" or _pool is not None:
+        return
+    pool = MinerUWorkerPool(
+        size=pool_size_for(settings),
+        device=settings.GPU_DEVICE if settings.GPU_ENABLED else "cpu",
+        backend=settings.GPU_BACKEND,
+        vram_per_worker_mb=settings.MINERU_VRAM_PER_WORKER_MB,
+        lang=settings.MINERU_LANG,
+        start_timeout=settings.MINERU_POOL_START_TIMEOUT_S,
+    )
+    try:
+        await pool.start()
+    except Exception:
+        logger.exception("No se pudo iniciar el pool de MinerU; se usará el modo subprocess")
+        await pool.stop()
+        return
+    _pool = pool
+
+
+async def stop_worker_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.stop()
+        _pool = None
+
+
+def get_worker_pool() -> Optional[MinerUWorkerPool]:
+    return _pool
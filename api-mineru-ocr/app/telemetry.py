@@ -0,0 +1,119 @@
+from __future__ import annotations
+from functools import lru_cache
+from typing import NamedTuple
+import logging
+import random
+import threading
+import psutil
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class GPUSample(NamedTuple):
+    index: int
+    used_bytes: float
+    total_bytes: float
+
+
+class GPUProcessSample(NamedTuple):
+    index: int
+    pid: int
+    used_bytes: float
+
+
+class CPUTelemetry:
+    """Proveedor sin GPU: solo CPU y RAM del host (modo `GPU_ENABLED=False`)."""
+
+    name = "cpu"
+
+    def cpu_percent(self) -> float:
+        return psutil.cpu_percent(interval=None)  # desde la muestra anterior (= desde el scrape anterior)
+
+    def ram_percent(self) -> float:
+        return psutil.virtual_memory().percent
+
+    def gpus(self) -> list[GPUSample]:
+        return []
+
+    def gpu_processes(self) -> list[GPUProcessSample]:
+        return []
+
+
+class NVMLTelemetry(CPUTelemetry):
+    """GPUs NVIDIA vía NVML. `nvmlInit` se difiere a la primera muestra, no al importar."""
+
+    name = "nvml"
+
+    def __init__(self):
+        self._nvml = None
+        self._lock = threading.Lock()
+
+    def _init(self):
+        with self._lock:
+            if self._nvml is None:
+                import pynvml  # type: ignore
+                pynvml.nvmlInit()
+                self._nvml = pynvml
+        return self._nvml
+
+    def available(self) -> bool:
+        try:
+            self._init(); return True
+        except Exception as e:
+            logger.warning("NVML no disponible (%s); telemetría solo de CPU/RAM", e)
+            return False
+
+    def _handles(self):
+        nvml = self._init()
+        return nvml, [nvml.nvmlDeviceGetHandleByIndex(i) for i in range(nvml.nvmlDeviceGetCount())]
+
+    def gpus(self) -> list[GPUSample]:
+        nvml, handles = self._handles()
+        out: list[GPUSample] = []
+        for i, h in enumerate(handles):
+            m = nvml.nvmlDeviceGetMemoryInfo(h)
+            out.append(GPUSample(i, float(m.used), float(m.total or 0)))
+        return out
+
+    def gpu_processes(self) -> list[GPUProcessSample]:
+        nvml, handles = self._handles()
+        out: list[GPUProcessSample] = []
+        for i, h in enumerate(handles):
+            try:
+                procs = nvml.nvmlDeviceGetComputeRunningProcesses(h)
+            except nvml.NVMLError:
+                continue
+            # usedGpuMemory es None si el driver no lo expone (p.ej. vGPU / MIG sin permisos)
+            out.extend(GPUProcessSample(i, p.pid, float(p.usedGpuMemory or 0)) for p in procs)
+        return out
+
+
+class FakeTelemetry(CPUTelemetry):
+    """GPUs simuladas para desarrollo y benchmarks sin hardware (uso acotado y aleatorio)."""
+
+    name = "fake"
+
+    def __init__(self, gpus: int, gpu_mb: int):
+        self._total = float(gpu_mb) * 1024 * 1024
+        self._count = gpus
+
+    def gpus(self) -> list[GPUSample]:
+        return [GPUSample(i, self._total * random.uniform(0.1, 0.6), self._total) for i in range(self._count)]
+
+
+@lru_cache()
+def get_telemetry() -> CPUTelemetry:
+    """Proveedor según `TELEMETRY_PROVIDER` (auto | nvml | cpu | fake).
+
+    `auto` usa NVML si `GPU_ENABLED` y NVML inicializa; si no, solo CPU.
+    """
+    settings = get_settings()
+    kind = settings.TELEMETRY_PROVIDER
+    if kind == "fake":
+        return FakeTelemetry(settings.TELEMETRY_FAKE_GPUS, settings.TELEMETRY_FAKE_GPU_MB)
+    if kind == "nvml" or (kind == "auto" and settings.GPU_ENABLED):
+        nvml = NVMLTelemetry()
+        if kind == "nvml" or nvml.available():
+            return nvml
+    return CPUTelemetry()
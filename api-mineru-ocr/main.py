@@ -1,7 +1,24 @@
-from app.factory import create_app
+import os
+import shutil
+from pathlib import Path
+from app.config import get_settings
 
-app = create_app()
+settings = get_settings()
 
-if __name__ == "__main__":
+if __name__ == "__main__" and settings.OCR_PROCESS_WORKERS > 1:
+    # Modo multi-proceso: cada worker importa `main:app`. PROMETHEUS_MULTIPROC_DIR debe existir
+    # (vacío) antes de que los workers importen prometheus_client; lo heredan del proceso maestro.
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    metrics_dir = Path(settings.OCR_RUNTIME_DIR) / "prometheus"
+    shutil.rmtree(metrics_dir, ignore_errors=True); metrics_dir.mkdir(parents=True)
+    (Path(settings.OCR_RUNTIME_DIR) / "vram.ledger").unlink(missing_ok=True)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(metrics_dir)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=settings.OCR_PROCESS_WORKERS)
+else:
+    from app.factory import create_app
+
+    app = create_app()
+
+    if __name__ == "__main__":
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000)